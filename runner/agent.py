@@ -6,16 +6,34 @@ Windowsマシンで常駐し、ポータルからの実行依頼をポーリン
 """
 from __future__ import annotations
 
+import argparse
 import ctypes
+import hashlib
+import hmac
 import json
+import glob
+import gzip
+import math
+import mmap
 import os
+import queue
+import re
+import shutil
+import signal
+import sqlite3
 import subprocess
 import sys
+import tempfile
 import threading
 import time
-from datetime import datetime
+import traceback
+import tracemalloc
+import urllib.parse
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 import requests
 
@@ -25,21 +43,29 @@ try:
     import win32con
     import win32process
     import win32api
+    import win32job
     HAS_WIN32 = True
 except ImportError:
     HAS_WIN32 = False
 
-# システムトレイ
-try:
-    import pystray
-    from PIL import Image, ImageDraw
-    HAS_TRAY = True
-except ImportError:
-    HAS_TRAY = False
+# システムトレイ（読み込みが重いため、ポーリング開始後に load_tray() で読み込む）
+pystray: Any = None
+Image: Any = None
+ImageDraw: Any = None
+HAS_TRAY = False
+
+IS_WINDOWS = os.name == "nt"
 
 # シャットダウン制御
 _shutdown_event = threading.Event()
 _tray_icon: Any = None
+_log_lock = threading.Lock()
+_agent_log_path = Path(__file__).parent / "agent.log"
+_log_format = "text"  # log_format: "json" で agent.log を JSON Lines にする
+_log_context = threading.local()  # run を処理中のスレッドの run_id
+
+
+_user_env_ready = threading.Event()
 
 
 def load_user_env_vars() -> None:
@@ -68,14 +94,23 @@ def load_user_env_vars() -> None:
             log(f"Loaded user env vars from registry: {', '.join(loaded)}")
     except Exception as e:
         log(f"Warning: Failed to load user env vars from registry: {e}")
+    finally:
+        _startup.mark("user_env")
+        _user_env_ready.set()
 
 
-def load_config() -> dict[str, Any]:
+def load_config(config_path: Optional[str] = None) -> dict[str, Any]:
     """設定ファイルを読み込む
 
-    PC名ごとの設定ファイル（config-{COMPUTERNAME}.json）を優先的に読み込む。
+    --config で明示された場合はそのファイルを使う。
+    それ以外は PC名ごとの設定ファイル（config-{COMPUTERNAME}.json）を優先的に読み込み、
     存在しない場合は config.json にフォールバック。
     """
+    if config_path:
+        print(f"Using config: {config_path}")
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
     base_dir = Path(__file__).parent
     computer_name = os.environ.get("COMPUTERNAME", "").upper()
 
@@ -100,15 +135,37 @@ def load_config() -> dict[str, Any]:
 
 
 def log(message: str) -> None:
-    """タイムスタンプ付きでログを出力"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{timestamp}] {message}"
-    print(line)
-    try:
-        with open(Path(__file__).parent / "agent.log", "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-    except Exception:
-        pass
+    """タイムスタンプ付きでログを出力
+
+    log_format が json の場合、agent.log には1行1オブジェクト（ts / thread / run_id / msg）で書く。
+    run_id は set_log_run_id() したスレッドからの出力に付く。
+    """
+    now = datetime.now()
+    line = f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] {message}"
+    if _log_format == "json":
+        record: dict[str, Any] = {
+            "ts": now.astimezone().isoformat(timespec="milliseconds"),
+            "thread": threading.current_thread().name,
+            "msg": message,
+        }
+        run_id = getattr(_log_context, "run_id", None)
+        if run_id:
+            record["run_id"] = run_id
+        file_line = json.dumps(record, ensure_ascii=False)
+    else:
+        file_line = line
+    with _log_lock:
+        print(line)
+        try:
+            with open(_agent_log_path, "a", encoding="utf-8") as f:
+                f.write(file_line + "\n")
+        except Exception:
+            pass
+
+
+def set_log_run_id(run_id: Optional[str]) -> None:
+    """このスレッドの以降のログに run_id を付ける（None で解除）"""
+    _log_context.run_id = run_id
 
 
 def send_heartbeat(config: dict[str, Any], starting: bool = False) -> dict[str, Any] | bool:
@@ -123,29 +180,64 @@ def send_heartbeat(config: dict[str, Any], starting: bool = False) -> dict[str,
     payload: dict[str, Any] = {"hostname": hostname}
     if starting:
         payload["starting"] = True
+    profile_path = _profiler.pending_path
+    if profile_path:
+        payload["profile_path"] = profile_path
+    estimates = run_estimates()
+    if estimates:
+        payload["run_estimates"] = estimates
+    payload["log_server_port"] = _log_server.port
 
     try:
         response = requests.post(url, headers=headers, json=payload, timeout=10)
         if response.status_code == 200:
+            if profile_path and _profiler.pending_path == profile_path:
+                _profiler.pending_path = None
             try:
-                return response.json()
+                data = response.json()
             except Exception:
                 return True
+            if data.get("log_secret"):
+                _log_server.secret = data["log_secret"]
+            return data
         else:
             log(f"Heartbeat failed: {response.status_code} - {response.text[:100]}")
+            forget_estimates(estimates)
             return False
     except requests.RequestException as e:
         log(f"Heartbeat error: {e}")
+        forget_estimates(estimates)
         return False
 
 
-def claim_task(config: dict[str, Any]) -> Optional[dict[str, Any]]:
-    """キューからタスクを取得"""
+def get_claim_preferences(config: dict[str, Any]) -> dict[str, Any]:
+    """claim 時にポータルへ伝える取得条件
+
+    min_priority: この優先度以上の run のみ取得（対話実行専用 Runner 等）
+    """
+    prefs = config.get("claim_preferences") or {}
+    result: dict[str, Any] = {}
+    if prefs.get("min_priority") is not None:
+        result["min_priority"] = int(prefs["min_priority"])
+    return result
+
+
+def claim_task(
+    config: dict[str, Any], tool_types: Optional[list[str]] = None
+) -> Optional[dict[str, Any]]:
+    """キューからタスクを取得（tool_types 指定時はその種類のみ）
+
+    claim_preferences（例: {"min_priority": 5}）もポータルに伝える。
+    """
     url = f"{config['portal_url']}/api/runner/claim"
     headers = {"X-Machine-Key": config["machine_key"]}
+    body: dict[str, Any] = dict(get_claim_preferences(config))
+    if tool_types is not None:
+        body["tool_types"] = tool_types
 
     try:
-        response = requests.post(url, headers=headers, timeout=30)
+        claim_started = time.time()
+        response = requests.post(url, headers=headers, json=body, timeout=30)
         # デバッグ: レスポンス内容を確認
         if response.status_code not in [200, 204]:
             log(f"DEBUG: status={response.status_code}, body={response.text[:200]}")
@@ -153,7 +245,7 @@ def claim_task(config: dict[str, Any]) -> Optional[dict[str, Any]]:
             data = response.json()
             # APIはタスク情報を直接返す（taskラッパーなし）
             if data.get("run_id"):
-                return {
+                task = {
                     "run_id": data["run_id"],
                     "run_token": data.get("run_token"),
                     "tool_type": data["tool"]["tool_type"],
@@ -161,8 +253,33 @@ def claim_task(config: dict[str, Any]) -> Optional[dict[str, Any]]:
                     "target": data["tool"].get("target"),
                     "run_config": data["tool"].get("run_config"),
                     "payload": data.get("payload"),
+                    "priority": data.get("priority", 0),
+                    "requested_at": data.get("requested_at"),
                     "callback_url": data.get("callback_url"),
                 }
+                estimate = _durations.estimate(task["tool_name"])
+                if estimate is not None:
+                    task["_estimate"] = estimate
+                _trace.record(
+                    "claim",
+                    task["run_id"],
+                    task=sanitize_task(task),
+                    latency_ms=round((time.time() - claim_started) * 1000, 1),
+                )
+                _history.record(
+                    task["run_id"],
+                    tool_name=task["tool_name"],
+                    tool_type=task["tool_type"],
+                    target=task["target"],
+                    priority=task["priority"],
+                    requested_at=_parse_iso(task["requested_at"]),
+                    claimed_at=time.time(),
+                )
+                if _span_exporter.enabled:
+                    spans = RunSpans(task["run_id"], data.get("trace_id"), _ns(claim_started))
+                    spans.add("claim", _ns(claim_started), kind=SPAN_KIND_CLIENT, **{"tool.type": task["tool_type"]})
+                    task["_spans"] = spans
+                return task
             return None
         elif response.status_code == 204:
             # タスクなし
@@ -178,41 +295,2876 @@ def claim_task(config: dict[str, Any]) -> Optional[dict[str, Any]]:
         return None
 
 
-def report_result(
+_reports_lock = threading.Lock()
+_reports_in_flight = 0
+
+
+def reports_in_flight() -> int:
+    """送信中（再送待ちを含む）の report 数"""
+    with _reports_lock:
+        return _reports_in_flight
+
+
+def _report_done() -> None:
+    global _reports_in_flight
+    with _reports_lock:
+        _reports_in_flight -= 1
+
+
+def _post_report(
+    config: dict[str, Any],
+    payload: dict[str, Any],
+    description: str,
+    on_delivered: Optional[Callable[[], None]] = None,
+) -> bool:
+    """/api/runner/report に送信する（送信中の件数はドレイン時の待ち合わせに使う）
+
+    ワーカーのスロットを再送で塞がないよう、ここでは1回だけ送る。
+    届かなかった report は _report_outbox に渡して False を返す（届いた時点で on_delivered を呼ぶ）。
+    同じ run の report が再送待ちなら、順序を保つためその後ろに並べる。
+    """
+    global _reports_in_flight
+    with _reports_lock:
+        _reports_in_flight += 1
+    if _report_outbox.has(payload.get("run_id")):
+        _report_outbox.put(config, payload, description, on_delivered, attempt=0)
+        return False
+    try:
+        result = _send_report(config, payload, description, attempt=1)
+    except BaseException:
+        _report_done()
+        raise
+    if result is None:
+        _report_outbox.put(config, payload, description, on_delivered, attempt=1)
+        return False
+    _report_done()
+    if result and on_delivered:
+        on_delivered()
+    return result
+
+
+def _send_report(
+    config: dict[str, Any],
+    payload: dict[str, Any],
+    description: str,
+    attempt: int,
+) -> Optional[bool]:
+    """/api/runner/report に1回送信する（True: 到達 / False: 拒否 / None: 再送が必要）
+
+    ネットワークエラー・タイムアウト・5xx・408・429 は再送が必要とみなす。
+    応答が失われただけで前回の送信が反映済みの場合、再送は 400（更新済み）になるため、
+    2回目以降の 400 は到達済みとみなす。
+    """
+    url = f"{config['portal_url']}/api/runner/report"
+    headers = {
+        "X-Machine-Key": config["machine_key"],
+        "Content-Type": "application/json",
+    }
+    run_id = payload.get("run_id")
+    started = time.time()
+    http_status: Optional[int] = None
+    try:
+        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        http_status = response.status_code
+        if http_status == 200:
+            log(f"{description} reported: {payload.get('status')}")
+            return True
+        if http_status == 400 and attempt > 1:
+            log(f"{description} already applied (retry got 400): {run_id}")
+            return True
+        if http_status < 500 and http_status not in (408, 429):
+            log(f"{description} rejected: {http_status} - {response.text[:200]}")
+            return False
+        log(f"{description} failed: {http_status} - {response.text[:200]}")
+    except requests.RequestException as e:
+        log(f"Network error during {description.lower()} report: {e}")
+    finally:
+        _trace.record(
+            "report" if not payload.get("followup") else "followup_report",
+            run_id,
+            status=payload.get("status"),
+            error=mask_paths(payload.get("error_message")),
+            http_status=http_status,
+            attempt=attempt,
+            latency_ms=round((time.time() - started) * 1000, 1),
+        )
+    return None
+
+
+@dataclass
+class PendingReport:
+    config: dict[str, Any]
+    payload: dict[str, Any]
+    description: str
+    on_delivered: Optional[Callable[[], None]]
+    attempt: int
+    deadline: float
+    next_at: float
+    delay: float = 1.0
+
+
+class ReportOutbox:
+    """届かなかった report をワーカーの外で再送する
+
+    report_retry_sec（デフォルト: 600）の間、間隔を倍にしながら（最大30秒）再送する。
+    同じ run の report は追加順に送る（followup が最初の report を追い越さないように）。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: list[PendingReport] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def has(self, run_id: Optional[str]) -> bool:
+        with self._lock:
+            return any(p.payload.get("run_id") == run_id for p in self._pending)
+
+    def put(
+        self,
+        config: dict[str, Any],
+        payload: dict[str, Any],
+        description: str,
+        on_delivered: Optional[Callable[[], None]],
+        attempt: int,
+    ) -> None:
+        now = time.time()
+        pending = PendingReport(
+            config=config,
+            payload=payload,
+            description=description,
+            on_delivered=on_delivered,
+            attempt=attempt,
+            deadline=now + config.get("report_retry_sec", 600),
+            next_at=now + 1.0 if attempt else now,
+        )
+        if attempt:
+            pending.delay = 2.0
+        log(f"{description} report queued for retry: {payload.get('run_id')}")
+        with self._lock:
+            self._pending.append(pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="report-outbox", daemon=True)
+                self._thread.start()
+
+    def _next(self) -> Optional[PendingReport]:
+        """run ごとの先頭のうち、次に送る時刻が最も早いもの"""
+        with self._lock:
+            if not self._pending:
+                self._thread = None
+                return None
+            heads: dict[Optional[str], PendingReport] = {}
+            for pending in self._pending:
+                heads.setdefault(pending.payload.get("run_id"), pending)
+            return min(heads.values(), key=lambda p: p.next_at)
+
+    def _run(self) -> None:
+        while True:
+            pending = self._next()
+            if pending is None:
+                return
+            wait = pending.next_at - time.time()
+            if wait > 0:
+                time.sleep(min(wait, 1.0))  # 後から追加された report を待たせすぎない
+                continue
+            pending.attempt += 1
+            result = _send_report(pending.config, pending.payload, pending.description, pending.attempt)
+            if result is None:
+                if time.time() + pending.delay <= pending.deadline:
+                    pending.next_at = time.time() + pending.delay
+                    pending.delay = min(pending.delay * 2, 30.0)
+                    continue
+                log(
+                    f"Giving up {pending.description.lower()} report after {pending.attempt} attempts: "
+                    f"{pending.payload.get('run_id')}"
+                )
+                result = False
+            with self._lock:
+                self._pending.remove(pending)
+            _report_done()
+            if result and pending.on_delivered:
+                try:
+                    pending.on_delivered()
+                except Exception as e:
+                    log(f"Error after report delivered: {e}")
+
+
+_report_outbox = ReportOutbox()
+
+
+def report_result(
+    config: dict[str, Any],
+    run_id: str,
+    status: str,
+    summary: Optional[str] = None,
+    error_message: Optional[str] = None,
+    log_path: Optional[str] = None,
+    log_url: Optional[str] = None,
+    output_excerpt: Optional[str] = None,
+    metrics: Optional[dict[str, float]] = None,
+    on_delivered: Optional[Callable[[], None]] = None,
+) -> bool:
+    """実行結果を報告（False は拒否または再送待ち。届いた時点で on_delivered を呼ぶ）"""
+    payload = {
+        "run_id": run_id,
+        "status": status,
+        "summary": summary,
+        "error_message": error_message,
+        "log_path": log_path,
+        "log_url": log_url,
+        "output_excerpt": output_excerpt,
+        "metrics": metrics,
+    }
+    return _post_report(config, payload, "Result", on_delivered)
+
+
+def report_outcome(
+    config: dict[str, Any],
+    run_id: str,
+    exit_code: int,
+    resource_usage: dict[str, Any],
+) -> bool:
+    """起動のみで success 報告済みの run に、実際の終了結果を追加報告する"""
+    set_log_run_id(run_id)
+    duration_sec = resource_usage.get("duration_sec")
+    payload = {
+        "run_id": run_id,
+        "followup": True,
+        "status": "success" if exit_code == 0 else "failed",
+        "error_message": None if exit_code == 0 else f"Exit code: {exit_code}",
+        "exit_code": exit_code,
+        "duration_ms": int(duration_sec * 1000) if duration_sec is not None else None,
+        "resource_usage": resource_usage,
+        "metrics": _metrics.finish(run_id),
+    }
+
+    _trace.record("followup", run_id, exit_code=exit_code, resource_usage=resource_usage)
+    _history.record(
+        run_id,
+        finished_at=time.time(),
+        status=payload["status"],
+        exit_code=exit_code,
+        duration_ms=payload["duration_ms"],
+        error=payload["error_message"],
+        **_usage_columns(resource_usage),
+    )
+    return _post_report(config, payload, f"Outcome (exit code: {exit_code})")
+
+
+# ---------------------------------------------------------------------------
+# 実行トレース
+# trace_path 設定時のみ、claim 応答・実行タイムライン・report を JSONL で記録する。
+# bench/replay_trace.py で fake_portal に流し直し、同じ負荷でループを比較できる。
+# パスやトークンは残さない（target はハッシュ、run_config / payload はキー名のみ）。
+# ---------------------------------------------------------------------------
+def _path_pattern(sep: str) -> str:
+    """sep 区切りのパスの残り（ディレクトリ名は空白を含んでもよい）
+
+    最後の要素は空白を含む場合、拡張子の付いた語まで、なければ行末・引用符までを含める。
+    """
+    word = r"""[^\\/\s"'|<>*?:]"""
+    folder = rf"{sep}{word}+(?:[ ]+{word}+)*(?={sep})"
+    last = (
+        rf"{sep}(?:(?:{word}+[ ]+){{0,8}}?{word}*\.[A-Za-z0-9]{{1,8}}(?![A-Za-z0-9])"
+        rf"|(?:{word}+[ ]+){{0,8}}{word}+(?=[\"'|<>\r\n]|$)"
+        rf"|{word}*)"
+    )
+    return rf"(?:{folder})*{last}"
+
+
+# ドライブ・UNC（\\ と / の両方の区切り）と、POSIX の絶対パス・~/（URL や相対パスの / は除く）
+_PATH_PATTERN = re.compile(
+    rf"(?:(?<![A-Za-z0-9])[A-Za-z]:|\\\\[^\\/\s\"'|<>]+){_path_pattern(r'[\\/]')}"
+    rf"|(?<![\w.:/~-])~?(?=/[^\s/])(?:{_path_pattern('/')})",
+    re.M,
+)
+
+
+def mask_paths(text: Optional[str], limit: int = 200) -> Optional[str]:
+    """エラーメッセージ等からファイルパスを伏せる"""
+    if not text:
+        return text
+    return _PATH_PATTERN.sub("<path>", text)[:limit]
+
+
+def _fingerprint(value: str) -> str:
+    """値を再現可能なハッシュに置き換える（拡張子だけは残す）"""
+    suffix = Path(value).suffix
+    digest = hashlib.sha256(value.encode("utf-8")).hexdigest()[:12]
+    return f"sha256:{digest}{suffix if len(suffix) <= 6 else ''}"
+
+
+def sanitize_task(task: dict[str, Any]) -> dict[str, Any]:
+    """トレース用に claim 応答から機密になり得る値を取り除く"""
+    return {
+        "tool_type": task.get("tool_type"),
+        "tool_name": task.get("tool_name"),
+        "priority": task.get("priority", 0),
+        "requested_at": task.get("requested_at"),
+        "target": _fingerprint(task["target"]) if task.get("target") else None,
+        "run_config_keys": sorted((task.get("run_config") or {}).keys()),
+        "payload_keys": sorted((task.get("payload") or {}).keys()),
+    }
+
+
+class TraceRecorder:
+    """トレースイベントを JSONL に追記する（未設定時は何もしない）"""
+
+    def __init__(self) -> None:
+        self._path: Optional[Path] = None
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict[str, Any]) -> None:
+        trace_path = config.get("trace_path")
+        self._path = Path(trace_path) if trace_path else None
+        if self._path:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            log(f"Recording execution trace: {self._path}")
+
+    def record(self, event: str, run_id: Optional[str], **fields: Any) -> None:
+        if self._path is None:
+            return
+        line = json.dumps(
+            {"ts": round(time.time(), 3), "event": event, "run_id": run_id, **fields},
+            ensure_ascii=False,
+            default=str,
+        )
+        with self._lock:
+            try:
+                with open(self._path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass  # トレースの失敗で実行を止めない
+
+
+_trace = TraceRecorder()
+
+
+# ---------------------------------------------------------------------------
+# 起動時間の計測
+# プロセス起動から最初の claim までの各フェーズを記録する。最初の claim 応答で
+# 1行ログと trace の startup イベントを出し、--startup-profile 時は内訳を JSON に書き出す。
+# ---------------------------------------------------------------------------
+def _process_age_sec() -> float:
+    """プロセス起動からの経過秒（取得できなければ 0 = モジュール読み込み時点を起点にする）"""
+    try:
+        if IS_WINDOWS:
+            creation, exit_, kernel, user = (ctypes.c_ulonglong() for _ in range(4))
+            now = ctypes.c_ulonglong()
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetProcessTimes(
+                kernel32.GetCurrentProcess(),
+                ctypes.byref(creation), ctypes.byref(exit_), ctypes.byref(kernel), ctypes.byref(user),
+            )
+            kernel32.GetSystemTimeAsFileTime(ctypes.byref(now))
+            return max(0.0, (now.value - creation.value) / 1e7)
+        with open("/proc/self/stat", encoding="ascii") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", encoding="ascii") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+class StartupProfile:
+    """起動フェーズの到達時刻（プロセス起動からの秒）"""
+
+    def __init__(self) -> None:
+        self._t0 = time.perf_counter() - _process_age_sec()
+        self.marks: dict[str, float] = {"imports": self.elapsed()}
+        self.output_dir: Optional[Path] = None  # --startup-profile 時の出力先
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return round(time.perf_counter() - self._t0, 3)
+
+    def mark(self, name: str) -> None:
+        """最初の到達だけを記録する"""
+        with self._lock:
+            self.marks.setdefault(name, self.elapsed())
+
+    def report(self) -> None:
+        """最初の claim 応答後に1回だけ出力する"""
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+            marks = dict(sorted(self.marks.items(), key=lambda kv: kv[1]))
+        first_claim = marks.get("first_claim_response")
+        log(f"Startup: first claim after {first_claim:.2f}s" if first_claim is not None else "Startup: no claim yet")
+        _trace.record("startup", None, phases=marks)
+        if self.output_dir is None:
+            return
+        for name, sec in marks.items():
+            log(f"  {sec:8.3f}s  {name}")
+        path = self.output_dir / f"startup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path.write_text(
+                json.dumps({"pid": os.getpid(), "time_to_first_claim_sec": first_claim, "phases": marks}, indent=2),
+                encoding="utf-8",
+            )
+            log(f"Startup profile written: {path}")
+        except OSError as e:
+            log(f"Failed to write startup profile: {e}")
+
+
+_startup = StartupProfile()
+
+
+# ---------------------------------------------------------------------------
+# スパン（分散トレース）
+# claim 応答の trace_id（ポータルが run ID から生成）を run 全体で共有し、
+# claim / 実行対象の解決 / venv 検出 / 起動 / 最初の出力 / プロセス終了 / ログ確定 / report を
+# run ごとに OTLP/JSON（ExportTraceServiceRequest）で書き出す。
+# otlp_path: JSONL ファイル（1行 = 1 run）、otlp_endpoint: OTLP/HTTP コレクタ（/v1/traces）
+# ---------------------------------------------------------------------------
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+class SpanExporter:
+    """run ごとのスパンを OTLP/JSON でファイル / コレクタに送る（未設定時は何もしない）"""
+
+    def __init__(self) -> None:
+        self._path: Optional[Path] = None
+        self._endpoint: Optional[str] = None
+        self._headers: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._resource: list[dict[str, Any]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self._path is not None or self._endpoint is not None
+
+    def configure(self, config: dict[str, Any]) -> None:
+        otlp_path = config.get("otlp_path")
+        self._path = Path(otlp_path) if otlp_path else None
+        self._endpoint = config.get("otlp_endpoint")
+        self._headers = {"Content-Type": "application/json", **config.get("otlp_headers", {})}
+        self._resource = _otlp_attributes({
+            "service.name": "tc-portal-runner",
+            "host.name": os.environ.get("COMPUTERNAME", "unknown"),
+        })
+        if self._path:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            log(f"Exporting spans to {self._path}")
+        if self._endpoint:
+            log(f"Exporting spans to {self._endpoint}")
+
+    def export(self, spans: list[dict[str, Any]]) -> None:
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": self._resource},
+                "scopeSpans": [{"scope": {"name": "tc-portal-runner"}, "spans": spans}],
+            }]
+        }
+        body = json.dumps(request, ensure_ascii=False)
+        if self._path:
+            with self._lock:
+                try:
+                    with open(self._path, "a", encoding="utf-8") as f:
+                        f.write(body + "\n")
+                except OSError:
+                    pass  # スパンの失敗で実行を止めない
+        if self._endpoint:
+            threading.Thread(target=self._post, args=(body,), daemon=True).start()
+
+    def _post(self, body: str) -> None:
+        try:
+            response = requests.post(self._endpoint, data=body.encode("utf-8"), headers=self._headers, timeout=10)
+            if response.status_code >= 300:
+                log(f"Span export failed: {response.status_code} - {response.text[:100]}")
+        except requests.RequestException as e:
+            log(f"Span export error: {e}")
+
+
+_span_exporter = SpanExporter()
+
+
+class RunSpans:
+    """1つの run のスパン。run のルートスパンの子として記録し、finish() でまとめて送る"""
+
+    def __init__(self, run_id: str, trace_id: Optional[str], started_ns: int) -> None:
+        if not trace_id or len(trace_id) != 32:
+            # trace_id を返さない古いポータルでは run ID から作る
+            trace_id = hashlib.sha256(run_id.encode("utf-8")).hexdigest()[:32]
+        self.trace_id = trace_id
+        self.run_id = run_id
+        self.root_id = os.urandom(8).hex()
+        self.started_ns = started_ns
+        self._spans: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        name: str,
+        start_ns: int,
+        end_ns: Optional[int] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+        error: Optional[str] = None,
+        **attributes: Any,
+    ) -> None:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": os.urandom(8).hex(),
+            "parentSpanId": self.root_id,
+            "name": name,
+            "kind": kind,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(end_ns or time.time_ns()),
+            "attributes": _otlp_attributes(attributes),
+            "status": {"code": 2, "message": mask_paths(error)} if error else {"code": 0},
+        }
+        with self._lock:
+            self._spans.append(span)
+
+    def finish(self, status: str, **attributes: Any) -> None:
+        """ルートスパン（claim 開始〜report 完了）を閉じて送る"""
+        root = {
+            "traceId": self.trace_id,
+            "spanId": self.root_id,
+            "name": "run",
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.started_ns),
+            "endTimeUnixNano": str(time.time_ns()),
+            "attributes": _otlp_attributes({"run.id": self.run_id, "run.status": status, **attributes}),
+            "status": {"code": 2} if status == "failed" else {"code": 0},
+        }
+        with self._lock:
+            spans, self._spans = [root, *self._spans], []
+        _span_exporter.export(spans)
+
+
+class _NoSpans:
+    """スパン無効時の代役（呼び出し側で分岐しないため）"""
+
+    def add(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def finish(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+_NO_SPANS = _NoSpans()
+
+
+def run_spans(task: dict[str, Any]) -> RunSpans | _NoSpans:
+    return task.get("_spans") or _NO_SPANS
+
+
+def _ns(ts: float) -> int:
+    return int(ts * 1e9)
+
+
+def watch_first_output(spans: RunSpans | _NoSpans, output: Path, process: "ProcessTree") -> None:
+    """ログファイルが伸びた時点（最初の出力）までを first_output スパンとして記録する"""
+    if isinstance(spans, _NoSpans):
+        return
+    try:
+        size = output.stat().st_size
+    except OSError:
+        return
+
+    def poll() -> None:
+        while process.poll() is None:
+            try:
+                if output.stat().st_size > size:
+                    spans.add("first_output", _ns(process.started_at))
+                    return
+            except OSError:
+                return
+            time.sleep(0.02)
+
+    threading.Thread(target=poll, name="first-output", daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# 実行履歴（SQLite）
+# run ごとの tool / 種別 / target / 時刻 / 終了コード / リソース使用量 / ログ位置を
+# ローカルの SQLite（history_db）に残す。書き込みは専用スレッドでまとめて行い、
+# history_retention_days を過ぎた行は日次集計（件数・失敗数・所要時間のヒストグラム）に畳む。
+# `agent.py stats` で tool ごとのパーセンタイルと週ごとの失敗率を表示する。
+# ---------------------------------------------------------------------------
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    tool_name TEXT,
+    tool_type TEXT,
+    target TEXT,
+    priority INTEGER,
+    requested_at REAL,
+    claimed_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    reported_at REAL,
+    status TEXT,
+    exit_code INTEGER,
+    duration_ms INTEGER,
+    duration_bucket INTEGER,
+    cpu_user_sec REAL,
+    cpu_kernel_sec REAL,
+    peak_memory_mb REAL,
+    log_path TEXT,
+    log_offset_start INTEGER,
+    log_offset_end INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_finished ON runs (finished_at);
+CREATE INDEX IF NOT EXISTS idx_runs_tool_finished ON runs (tool_name, finished_at);
+CREATE TABLE IF NOT EXISTS runs_daily (
+    day TEXT NOT NULL,
+    tool_name TEXT NOT NULL,
+    tool_type TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    max_duration_ms INTEGER,
+    histogram TEXT NOT NULL,
+    PRIMARY KEY (day, tool_name, tool_type)
+);
+"""
+HISTORY_COLUMNS = {
+    "tool_name", "tool_type", "target", "priority", "requested_at", "claimed_at", "started_at",
+    "finished_at", "reported_at", "status", "exit_code", "duration_ms", "duration_bucket",
+    "cpu_user_sec", "cpu_kernel_sec", "peak_memory_mb", "log_path", "log_offset_start",
+    "log_offset_end", "error",
+}
+# 所要時間のヒストグラム: 2^(1/8) 刻み（誤差 ±5% 程度）
+HISTOGRAM_STEPS_PER_DOUBLING = 8
+
+
+def duration_bucket(duration_ms: int) -> int:
+    return int(math.log2(max(duration_ms, 1)) * HISTOGRAM_STEPS_PER_DOUBLING)
+
+
+def bucket_ms(bucket: int) -> float:
+    """バケットの代表値（中央）"""
+    return 2 ** ((bucket + 0.5) / HISTOGRAM_STEPS_PER_DOUBLING)
+
+
+def history_db_path(config: dict[str, Any]) -> Optional[Path]:
+    """実行履歴 DB のパス（history_db: false なら None）"""
+    db = config.get("history_db", str(Path(__file__).parent / "run_history.db"))
+    return Path(db) if db else None
+
+
+def _parse_iso(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts).date().isoformat()
+
+
+class RunHistory:
+    """実行履歴の書き込み（専用スレッドでバッチ書き込み）"""
+
+    def __init__(self) -> None:
+        self._path: Optional[Path] = None
+        self._queue: "queue.Queue[Optional[tuple[str, dict[str, Any]]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._flush_sec = 5.0
+        self._retention_days = 90
+        self._daily_retention_days = 730
+        self._model_days = 90
+
+    def configure(self, config: dict[str, Any]) -> None:
+        self._path = history_db_path(config)
+        if self._path is None:
+            return
+        self._flush_sec = config.get("history_flush_sec", 5)
+        self._retention_days = config.get("history_retention_days", 90)
+        self._daily_retention_days = config.get("history_daily_retention_days", 730)
+        self._model_days = config.get("duration_model_days", 90)
+        self._thread = threading.Thread(target=self._run, name="run-history", daemon=True)
+        self._thread.start()
+
+    def record(self, run_id: Optional[str], **fields: Any) -> None:
+        """run の列を更新する（未設定時は何もしない。書き込みは後でまとめて行う）"""
+        if self._thread is None or not run_id:
+            return
+        if fields.get("duration_ms") is not None:
+            fields["duration_bucket"] = duration_bucket(fields["duration_ms"])
+        self._queue.put((run_id, fields))
+
+    def close(self) -> None:
+        """未書き込み分を書き出してスレッドを止める"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self) -> None:
+        try:
+            conn = open_history_db(self._path)
+        except sqlite3.Error as e:
+            log(f"Run history disabled: {e}")
+            self._thread = None
+            return
+        log(f"Run history: {self._path}")
+        try:
+            _durations.load(conn, self._model_days)
+        except sqlite3.Error as e:
+            log(f"Failed to load duration model: {e}")
+        self._downsample(conn)
+        last_downsample = time.time()
+        pending: dict[str, dict[str, Any]] = {}
+        deadline = time.time() + self._flush_sec
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                if item is None:
+                    stopping = True
+                else:
+                    run_id, fields = item
+                    pending.setdefault(run_id, {}).update(fields)
+                    if len(pending) < 100:
+                        continue
+            except queue.Empty:
+                pass
+            if pending:
+                self._flush(conn, pending)
+                pending = {}
+            deadline = time.time() + self._flush_sec
+            if time.time() - last_downsample > 86400:
+                self._downsample(conn)
+                last_downsample = time.time()
+        conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, pending: dict[str, dict[str, Any]]) -> None:
+        try:
+            with conn:
+                for run_id, fields in pending.items():
+                    cols = [c for c in fields if c in HISTORY_COLUMNS]
+                    if not cols:
+                        continue
+                    conn.execute(
+                        f"INSERT INTO runs (run_id, {', '.join(cols)}) VALUES (?{', ?' * len(cols)}) "
+                        f"ON CONFLICT(run_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in cols)}",
+                        [run_id, *(fields[c] for c in cols)],
+                    )
+        except sqlite3.Error as e:
+            log(f"Failed to write run history: {e}")
+
+    def _downsample(self, conn: sqlite3.Connection) -> None:
+        """保持期間を過ぎた行を日次集計に畳み、日次集計も期限切れを消す"""
+        cutoff = time.time() - self._retention_days * 86400
+        try:
+            rows = conn.execute(
+                "SELECT tool_name, tool_type, finished_at, status, duration_ms, duration_bucket FROM runs "
+                "WHERE finished_at < ?",
+                (cutoff,),
+            ).fetchall()
+            daily: dict[tuple[str, str, str], dict[str, Any]] = {}
+            for tool_name, tool_type, finished_at, status, duration_ms, bucket in rows:
+                key = (_day(finished_at), tool_name or "", tool_type or "")
+                agg = daily.setdefault(key, {"runs": 0, "failures": 0, "max": None, "hist": {}})
+                agg["runs"] += 1
+                agg["failures"] += status == "failed"
+                if duration_ms is not None:
+                    agg["max"] = max(agg["max"] or 0, duration_ms)
+                    agg["hist"][str(bucket)] = agg["hist"].get(str(bucket), 0) + 1
+            with conn:
+                for (day, tool_name, tool_type), agg in daily.items():
+                    existing = conn.execute(
+                        "SELECT runs, failures, max_duration_ms, histogram FROM runs_daily "
+                        "WHERE day = ? AND tool_name = ? AND tool_type = ?",
+                        (day, tool_name, tool_type),
+                    ).fetchone()
+                    if existing:
+                        agg["runs"] += existing[0]
+                        agg["failures"] += existing[1]
+                        agg["max"] = max(agg["max"] or 0, existing[2] or 0) or None
+                        for bucket, count in json.loads(existing[3]).items():
+                            agg["hist"][bucket] = agg["hist"].get(bucket, 0) + count
+                    conn.execute(
+                        "INSERT OR REPLACE INTO runs_daily VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (day, tool_name, tool_type, agg["runs"], agg["failures"], agg["max"], json.dumps(agg["hist"])),
+                    )
+                conn.execute("DELETE FROM runs WHERE finished_at < ?", (cutoff,))
+                conn.execute(
+                    "DELETE FROM runs_daily WHERE day < ?",
+                    (_day(time.time() - self._daily_retention_days * 86400),),
+                )
+            if rows:
+                log(f"Run history: downsampled {len(rows)} run(s) older than {self._retention_days} days")
+        except sqlite3.Error as e:
+            log(f"Failed to downsample run history: {e}")
+
+
+def open_history_db(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(HISTORY_SCHEMA)
+    return conn
+
+
+_history = RunHistory()
+
+
+def _usage_columns(resource_usage: dict[str, Any]) -> dict[str, Any]:
+    return {k: resource_usage[k] for k in ("cpu_user_sec", "cpu_kernel_sec", "peak_memory_mb") if k in resource_usage}
+
+
+def _file_size(path: Optional[Path]) -> Optional[int]:
+    try:
+        return path.stat().st_size if path is not None else None
+    except OSError:
+        return None
+
+
+def _percentile(histogram: dict[int, int], q: float) -> Optional[float]:
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return bucket_ms(bucket)
+    return None
+
+
+def _fmt_ms(ms: Optional[float]) -> str:
+    if ms is None:
+        return "-"
+    if ms < 1000:
+        return f"{ms:.0f}ms"
+    if ms < 60000:
+        return f"{ms / 1000:.1f}s"
+    return f"{ms / 60000:.1f}m"
+
+
+def history_stats(db_path: Path, weeks: int = 8, tool: Optional[str] = None) -> None:
+    """tool ごとの所要時間パーセンタイルと週ごとの失敗率を表示する（agent.py stats）"""
+    if not db_path.exists():
+        print(f"Run history not found: {db_path}")
+        return
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=10)
+    since = time.time() - weeks * 7 * 86400
+    since_day = _day(since)
+    tool_filter = " AND tool_name = ?" if tool else ""
+    params: list[Any] = [tool] if tool else []
+
+    hist: dict[str, dict[int, int]] = {}
+    totals: dict[str, list[int]] = {}  # tool -> [runs, failures]
+    max_ms: dict[str, int] = {}
+    weekly: dict[tuple[str, str], list[int]] = {}
+
+    def add(tool_name: str, week: str, runs: int, failures: int) -> None:
+        t = totals.setdefault(tool_name, [0, 0])
+        t[0] += runs
+        t[1] += failures
+        w = weekly.setdefault((tool_name, week), [0, 0])
+        w[0] += runs
+        w[1] += failures
+
+    # 保持期間内の生データ（バケット単位で集計して返す）
+    for tool_name, week, bucket, runs, failures, longest in conn.execute(
+        "SELECT tool_name, strftime('%Y-W%W', finished_at, 'unixepoch', 'localtime'), duration_bucket, "
+        "count(*), sum(status = 'failed'), max(duration_ms) FROM runs "
+        f"WHERE finished_at >= ?{tool_filter} GROUP BY 1, 2, 3",
+        [since, *params],
+    ):
+        add(tool_name, week, runs, failures)
+        if bucket is not None:
+            h = hist.setdefault(tool_name, {})
+            h[bucket] = h.get(bucket, 0) + runs
+            max_ms[tool_name] = max(max_ms.get(tool_name, 0), longest or 0)
+    # 日次集計に畳まれた分
+    for tool_name, week, runs, failures, longest, histogram in conn.execute(
+        "SELECT tool_name, strftime('%Y-W%W', day), runs, failures, max_duration_ms, histogram FROM runs_daily "
+        f"WHERE day >= ?{tool_filter}",
+        [since_day, *params],
+    ):
+        add(tool_name, week, runs, failures)
+        h = hist.setdefault(tool_name, {})
+        for bucket, count in json.loads(histogram).items():
+            h[int(bucket)] = h.get(int(bucket), 0) + count
+        max_ms[tool_name] = max(max_ms.get(tool_name, 0), longest or 0)
+    conn.close()
+
+    if not totals:
+        print(f"No runs in the last {weeks} week(s)")
+        return
+    print(f"Runs in the last {weeks} week(s): {db_path}")
+    print(f"{'Tool':<32} {'Runs':>7} {'Fail%':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for tool_name in sorted(totals, key=lambda t: -totals[t][0]):
+        runs, failures = totals[tool_name]
+        h = hist.get(tool_name, {})
+        longest = max_ms.get(tool_name)
+        # バケットの代表値が実測の最大を超えないように丸める
+        p50, p90, p99 = (
+            min(p, longest) if p is not None and longest else p
+            for p in (_percentile(h, q) for q in (0.5, 0.9, 0.99))
+        )
+        print(
+            f"{tool_name[:32]:<32} {runs:>7} {failures / runs * 100:>5.1f}% "
+            f"{_fmt_ms(p50):>8} {_fmt_ms(p90):>8} {_fmt_ms(p99):>8} {_fmt_ms(longest):>8}"
+        )
+
+    week_labels = sorted({week for _, week in weekly})
+    print()
+    print("Failure rate by week (failed / runs)")
+    print(f"{'Tool':<32} " + " ".join(f"{w:>10}" for w in week_labels))
+    for tool_name in sorted(totals, key=lambda t: -totals[t][0]):
+        cells = []
+        for week in week_labels:
+            runs, failures = weekly.get((tool_name, week), [0, 0])
+            cells.append(f"{failures}/{runs}".rjust(10) if runs else f"{'-':>10}")
+        print(f"{tool_name[:32]:<32} " + " ".join(cells))
+
+
+# ---------------------------------------------------------------------------
+# 所要時間モデル（ETA / 遅延検知 / 適応タイムアウト）
+# 成功した run の所要時間を tool ごとのヒストグラム（実行履歴と同じ 2^(1/8) 刻み）で持ち、
+# claim 時に p50 / p90 / p99 を見積もる。起動時に history_db の直近分から復元し、
+# 以降は run の完了ごとに加算する。見積もりは ETA としてハートビートでポータルに送り、
+# p99 を超えた run は遅延として通知する。duration_timeout 有効時はタイムアウトにも使う。
+# ---------------------------------------------------------------------------
+class DurationModel:
+    """tool ごとの所要時間分布"""
+
+    def __init__(self) -> None:
+        self._hist: dict[str, dict[int, int]] = {}
+        self._lock = threading.Lock()
+        self.min_runs = 20
+
+    def load(self, conn: sqlite3.Connection, days: int) -> None:
+        """実行履歴の直近 days 日分（成功のみ）から分布を復元する"""
+        loaded: dict[str, dict[int, int]] = {}
+        for tool_name, bucket, runs in conn.execute(
+            "SELECT tool_name, duration_bucket, count(*) FROM runs "
+            "WHERE finished_at >= ? AND status = 'success' AND duration_bucket IS NOT NULL GROUP BY 1, 2",
+            (time.time() - days * 86400,),
+        ):
+            loaded.setdefault(tool_name, {})[bucket] = runs
+        with self._lock:
+            # 読み込み中に完了した run の分も残す
+            for tool_name, hist in self._hist.items():
+                merged = loaded.setdefault(tool_name, {})
+                for bucket, runs in hist.items():
+                    merged[bucket] = merged.get(bucket, 0) + runs
+            self._hist = loaded
+        log(f"Duration model: {len(loaded)} tool(s) from the last {days} days")
+
+    def add(self, tool_name: str, duration_ms: int) -> None:
+        bucket = duration_bucket(duration_ms)
+        with self._lock:
+            hist = self._hist.setdefault(tool_name, {})
+            hist[bucket] = hist.get(bucket, 0) + 1
+
+    def estimate(self, tool_name: str) -> Optional[dict[str, Any]]:
+        """p50 / p90 / p99（ミリ秒）。成功が min_runs 件未満なら None"""
+        with self._lock:
+            hist = dict(self._hist.get(tool_name) or {})
+        runs = sum(hist.values())
+        if runs < self.min_runs:
+            return None
+        return {
+            "runs": runs,
+            "p50_ms": int(_percentile(hist, 0.5)),
+            "p90_ms": int(_percentile(hist, 0.9)),
+            "p99_ms": int(_percentile(hist, 0.99)),
+        }
+
+
+_durations = DurationModel()
+
+
+def run_timeout(task: dict[str, Any], config: dict[str, Any]) -> float:
+    """run の実行タイムアウト（秒）
+
+    duration_timeout.enabled 時は p99 × multiplier（min_sec 以上）。
+    いずれの場合も execution_timeout を超えない。
+    """
+    timeout = config.get("execution_timeout", 3600)
+    adaptive = config.get("duration_timeout") or {}
+    estimate = task.get("_estimate")
+    if not adaptive.get("enabled") or estimate is None:
+        return timeout
+    if estimate["runs"] < adaptive.get("min_runs", 50):
+        return timeout
+    derived = max(estimate["p99_ms"] / 1000 * adaptive.get("multiplier", 3), adaptive.get("min_sec", 300))
+    return min(timeout, derived)
+
+
+def run_estimates() -> list[dict[str, Any]]:
+    """ハートビートで送る ETA / 遅延（前回送信から変わった run のみ）
+
+    ETA は経過時間に応じて p50 → p90 → p99 と先送りし、p99 を超えたら遅延とする。
+    """
+    now = time.time()
+    updates: list[dict[str, Any]] = []
+    with _active_runs_lock:
+        actives = list(_active_runs.values())
+    for active in actives:
+        estimate = active.task.get("_estimate")
+        if estimate is None:
+            continue
+        elapsed_ms = (now - active.started_at) * 1000
+        state = next((q for q in ("p50_ms", "p90_ms", "p99_ms") if elapsed_ms <= estimate[q]), "slow")
+        if active.estimate_sent == state:
+            continue
+        if state == "slow" and active.slow_at is None:
+            active.slow_at = now
+            log(
+                f"Run slow: {active.run_id} ({active.task.get('tool_name')}) running {elapsed_ms / 1000:.0f}s, "
+                f"p99 {estimate['p99_ms'] / 1000:.0f}s"
+            )
+            _trace.record("slow", active.run_id, elapsed_ms=int(elapsed_ms), p99_ms=estimate["p99_ms"])
+        active.estimate_sent = state
+        finish_ms = estimate["p99_ms"] if state == "slow" else estimate[state]
+        updates.append({
+            "run_id": active.run_id,
+            "expected_finish_at": datetime.fromtimestamp(active.started_at + finish_ms / 1000, timezone.utc).isoformat(),
+            "slow": state == "slow",
+        })
+    return updates
+
+
+def forget_estimates(updates: list[dict[str, Any]]) -> None:
+    """送信に失敗した ETA を次のハートビートで送り直す"""
+    with _active_runs_lock:
+        for update in updates:
+            active = _active_runs.get(update["run_id"])
+            if active is not None:
+                active.estimate_sent = None
+
+
+# ---------------------------------------------------------------------------
+# ラン ログの保持・圧縮
+# create_log_file は log_dir/YYYY-MM-DD/run-{id}.log（開始日のフォルダ）に書く。
+# log_retention.enabled 時は専用スレッドが interval_min ごとに log_dir を走査し、
+#   1. compress_after_hours を過ぎた確定済みログを gzip（run-{id}.log.gz、mtime は元のまま）
+#   2. max_age_days を過ぎたログを削除
+#   3. 合計が max_total_mb を超えていれば古い順に削除
+# する。旧形式（log_dir 直下）のログは圧縮時に日付フォルダへ移す。実行中の run のログには触れない。
+# 圧縮後もログ検索・ログ配信から読める（検索インデックスのパスも付け替える）。
+# ---------------------------------------------------------------------------
+_LOG_DATE_DIR = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_RUN_LOG_NAME = re.compile(r"^run-(.+?)\.log(\.gz)?$")
+
+
+def run_log_dir(log_dir: Path, when: float) -> Path:
+    """ラン ログの日付フォルダ"""
+    return log_dir / datetime.fromtimestamp(when).strftime("%Y-%m-%d")
+
+
+def log_run_id(path: Path) -> Optional[str]:
+    """run-{id}.log / run-{id}.log.gz の run_id"""
+    m = _RUN_LOG_NAME.match(path.name)
+    return m.group(1) if m else None
+
+
+def iter_run_logs(log_dir: Path) -> Any:
+    """log_dir 直下と日付フォルダのラン ログを (path, size, mtime) で列挙する"""
+    dirs = [log_dir]
+    while dirs:
+        current = dirs.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if current == log_dir and _LOG_DATE_DIR.match(entry.name):
+                        dirs.append(Path(entry.path))
+                elif _RUN_LOG_NAME.match(entry.name):
+                    stat = entry.stat()
+                    yield Path(entry.path), stat.st_size, stat.st_mtime
+            except OSError:
+                continue  # 走査中に圧縮・削除された
+
+
+def open_run_log(path: Path) -> Any:
+    """ラン ログをテキストで開く（.gz は展開しながら読む）"""
+    if path.suffix == ".gz":
+        return gzip.open(str(path), "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def find_run_log(log_dir: Path, run_id: str) -> Optional[Path]:
+    """run_id のログを探す（実行中 → 日付フォルダの新しい順 → log_dir 直下）"""
+    with _active_runs_lock:
+        active = _active_runs.get(run_id)
+        log_file = active.task.get("_log_file") if active is not None else None
+    if log_file is not None:
+        return log_file
+    try:
+        dirs = sorted((e.name for e in os.scandir(log_dir) if _LOG_DATE_DIR.match(e.name)), reverse=True)
+    except OSError:
+        return None
+    for folder in [*(log_dir / name for name in dirs), log_dir]:
+        for name in (f"run-{run_id}.log", f"run-{run_id}.log.gz"):
+            path = folder / name
+            if path.is_file():
+                return path
+    return None
+
+
+def compress_run_log(path: Path, dest_dir: Path) -> Path:
+    """ログを dest_dir/{name}.gz に圧縮し、元ファイルを削除する（mtime は引き継ぐ）"""
+    stat = path.stat()
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    dest = dest_dir / f"{path.name}.gz"
+    tmp = dest.with_name(dest.name + ".tmp")
+    try:
+        with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+        os.utime(tmp, (stat.st_atime, stat.st_mtime))
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    try:
+        path.unlink()
+    except OSError:
+        dest.unlink(missing_ok=True)  # 元ファイルが開かれている（Windows）。次回に回す
+        raise
+    return dest
+
+
+def _remove_empty_log_dirs(log_dir: Path, keep: str) -> None:
+    for entry in os.scandir(log_dir):
+        if entry.is_dir() and _LOG_DATE_DIR.match(entry.name) and entry.name != keep:
+            try:
+                os.rmdir(entry.path)
+            except OSError:
+                pass  # 空でない
+
+
+_log_dir_lock: Any = None
+
+
+def lock_log_dir(log_dir: Path) -> bool:
+    """log_dir/.agent.lock を排他ロックする（エージェントは終了まで保持。取れなければ False）
+
+    `logs prune` は、ロックが取れない（エージェントが同じ log_dir で動いている）間は実行しない。
+    """
+    global _log_dir_lock
+    try:
+        log_dir.mkdir(parents=True, exist_ok=True)
+        f = open(log_dir / ".agent.lock", "a+b")
+    except OSError:
+        return False
+    try:
+        if IS_WINDOWS:
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _log_dir_lock = f
+    return True
+
+
+# 1リクエストで送る run 数（ポータル側の上限と同じ）
+LOG_PATHS_BATCH = 500
+
+
+def report_log_paths(config: dict[str, Any], moves: dict[str, Optional[str]]) -> bool:
+    """圧縮・削除したラン ログの新しいパスをポータルに送る（runs.log_path。削除は None）
+
+    送れた run は moves から取り除く（失敗した分は次回に送る）。
+    """
+    url = f"{config['portal_url']}/api/runner/log-paths"
+    headers = {"X-Machine-Key": config["machine_key"], "Content-Type": "application/json"}
+    while moves:
+        batch = list(moves.items())[:LOG_PATHS_BATCH]
+        body = {"moves": [{"run_id": run_id, "log_path": path} for run_id, path in batch]}
+        try:
+            response = requests.post(url, headers=headers, json=body, timeout=30)
+        except requests.RequestException as e:
+            log(f"Log path update error: {e}")
+            return False
+        if response.status_code != 200:
+            log(f"Log path update failed: {response.status_code} - {response.text[:100]}")
+            return False
+        for run_id, _ in batch:
+            moves.pop(run_id, None)
+    return True
+
+
+def prune_run_logs(
+    log_dir: Path,
+    policy: dict[str, Any],
+    active_ids: set[str],
+    on_change: Any = None,
+    dry_run: bool = False,
+) -> dict[str, int]:
+    """log_retention の1回分。on_change(旧パス, 新パス or None) で移動・削除を通知する"""
+    now = time.time()
+    compress_hours = policy.get("compress_after_hours", 24)
+    max_age_days = policy.get("max_age_days")
+    max_total_mb = policy.get("max_total_mb")
+    result = {"compressed": 0, "deleted": 0, "freed_bytes": 0, "kept": 0, "total_bytes": 0, "failed": 0}
+
+    def remove(path: Path, size: int) -> None:
+        if not dry_run:
+            path.unlink()
+            if on_change:
+                on_change(path, None)
+        result["deleted"] += 1
+        result["freed_bytes"] += size
+
+    kept: list[tuple[float, Path, int]] = []
+    # 圧縮先の日付フォルダを同じ走査で拾い直さないよう、先に列挙しきる
+    for path, size, mtime in list(iter_run_logs(log_dir)):
+        if log_run_id(path) in active_ids:
+            kept.append((math.inf, path, size))  # 予算超過でも削除しない
+            continue
+        try:
+            if max_age_days and mtime < now - max_age_days * 86400:
+                remove(path, size)
+                continue
+            if compress_hours is not None and path.suffix != ".gz" and mtime < now - compress_hours * 3600:
+                if not dry_run:
+                    # 日付フォルダ（run の開始日）のログはその場で圧縮し、旧形式（log_dir 直下）だけ最終更新日のフォルダへ移す
+                    dest_dir = path.parent if path.parent != log_dir else run_log_dir(log_dir, mtime)
+                    new_path = compress_run_log(path, dest_dir)
+                    new_size = new_path.stat().st_size
+                    if on_change:
+                        on_change(path, new_path)
+                    path, size = new_path, new_size
+                result["compressed"] += 1
+        except OSError as e:
+            log(f"Log retention: {path.name}: {e}")
+            result["failed"] += 1
+        kept.append((mtime, path, size))
+
+    total = sum(size for _, _, size in kept)
+    if max_total_mb:
+        budget = max_total_mb * 1024 * 1024
+        kept.sort(key=lambda item: item[0])
+        while kept and total > budget and kept[0][0] != math.inf:
+            _, path, size = kept.pop(0)
+            try:
+                remove(path, size)
+                total -= size
+            except OSError as e:
+                log(f"Log retention: {path.name}: {e}")
+                result["failed"] += 1
+    if not dry_run:
+        _remove_empty_log_dirs(log_dir, keep=run_log_dir(log_dir, now).name)
+    result["kept"] = len(kept)
+    result["total_bytes"] = total
+    return result
+
+
+class LogRetention:
+    """log_retention の定期実行（専用スレッド）"""
+
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+        # ポータルに未送信の runs.log_path の変更（run_id → 新しいパス or None）
+        self._moves: dict[str, Optional[str]] = {}
+
+    def configure(self, config: dict[str, Any]) -> None:
+        policy = config.get("log_retention") or {}
+        if not policy.get("enabled") or not config.get("log_dir"):
+            return
+        self._thread = threading.Thread(target=self._run, args=(config, policy), name="log-retention", daemon=True)
+        self._thread.start()
+
+    def _moved(self, old: Path, new: Optional[Path]) -> None:
+        _log_indexer.moved(old, new)
+        run_id = log_run_id(old)
+        if run_id:
+            self._moves[run_id] = str(new) if new else None
+
+    def _run(self, config: dict[str, Any], policy: dict[str, Any]) -> None:
+        log_dir = Path(config["log_dir"])
+        interval = max(1, policy.get("interval_min", 60)) * 60
+        delay = 60  # 起動直後の claim / 索引の同期と重ならないよう少し待つ
+        while not _shutdown_event.wait(delay):
+            delay = interval
+            started = time.monotonic()
+            with _active_runs_lock:
+                active_ids = set(_active_runs)
+            try:
+                result = prune_run_logs(log_dir, policy, active_ids, on_change=self._moved)
+            except OSError as e:
+                log(f"Log retention failed: {e}")
+            else:
+                report_log_paths(config, self._moves)
+                if result["compressed"] or result["deleted"] or result["failed"]:
+                    log(
+                        f"Log retention: {result['compressed']} compressed, {result['deleted']} deleted "
+                        f"({result['freed_bytes'] / 1024 / 1024:.1f}MB), {result['failed']} failed; "
+                        f"{result['kept']} kept ({result['total_bytes'] / 1024 / 1024:.1f}MB) "
+                        f"in {time.monotonic() - started:.1f}s"
+                    )
+
+
+_log_retention = LogRetention()
+
+
+# ---------------------------------------------------------------------------
+# ログ検索インデックス
+# log_dir の run-*.log を、語 → ファイル の転置インデックス（ローカル SQLite, log_index_db）に
+# 登録する。finalize_log 後に専用スレッドで追加し、起動時に未登録・更新・削除分を取り込む。
+# `agent.py logs search` はインデックスで候補ファイルを絞ってから該当行だけを読む。
+# 語は英数字の連続（小文字化）と、かな・漢字の2文字ずつ（日本語は分かち書きがないため）。
+# 5桁以下の数字だけの語（行番号・時刻・件数）は索引を肥大させるだけなので登録しない。
+# 検索語の端にある英数字の語はログ側でより長い語の一部かもしれないので、前方一致（postings の範囲）
+# ・後方一致 / 部分一致（英数字の語の一覧 terms）で候補を探す（"Timeout" で "TimeoutExpired" も探す）。
+# ---------------------------------------------------------------------------
+LOG_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    run_id TEXT,
+    tool_name TEXT,
+    started_at REAL,
+    finished_at REAL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    truncated INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_docs_started ON docs (started_at);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+_TOKEN_PATTERN = re.compile(r"[0-9a-z_]{2,64}|[\u3040-\u30ff\u3400-\u9fff\uff66-\uff9f]{2,}")
+LOG_INDEX_MAX_TERMS = 200_000  # 1ファイルの語数の上限（超えた分は検索時に全文を読む）
+_LOG_HEADER_TIME = re.compile(r"^(Start|Finished): (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})$", re.MULTILINE)
+
+
+def log_terms(text: str) -> set[str]:
+    """インデックス / 検索語の分割（英数字の語と、かな・漢字のバイグラム）"""
+    terms: set[str] = set()
+    for token in set(_TOKEN_PATTERN.findall(text.lower())):
+        if token.isascii():
+            if len(token) >= 6 or not token.isdigit():
+                terms.add(token)
+        else:
+            terms.update(token[i:i + 2] for i in range(len(token) - 1))
+    return terms
+
+
+def query_terms(query: str) -> list[tuple[str, str]]:
+    """検索語の分割。(語, 一致方法) のリスト
+
+    query の途中の英数字の語はログ側でも語全体なので "exact"。query の末尾に接する語は "prefix"、
+    先頭に接する語は "suffix"、両端に接する（query が1語だけの）語は "infix"。
+    かな・漢字のバイグラムは部分文字列でも索引にあるので常に "exact"。
+    """
+    text = query.lower()
+    terms: set[tuple[str, str]] = set()
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if not token.isascii():
+            terms.update((token[i:i + 2], "exact") for i in range(len(token) - 1))
+            continue
+        if token.isdigit() and len(token) < 6:
+            continue  # 索引にない（端の語でも長い数字の一部かもしれない）
+        at_start, at_end = match.start() == 0, match.end() == len(text)
+        mode = "infix" if at_start and at_end else "suffix" if at_start else "prefix" if at_end else "exact"
+        terms.add((token, mode))
+    return sorted(terms)
+
+
+def log_index_path(config: dict[str, Any]) -> Optional[Path]:
+    """ログ検索インデックスのパス（log_dir 未設定・log_index_db: false なら None）"""
+    if not config.get("log_dir"):
+        return None
+    db = config.get("log_index_db", str(Path(__file__).parent / "log_index.db"))
+    return Path(db) if db else None
+
+
+def open_log_index(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(LOG_INDEX_SCHEMA)
+    # 語の一覧がない索引（追加前に作られたもの）は postings から作る
+    if conn.execute("SELECT 1 FROM terms LIMIT 1").fetchone() is None:
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO terms SELECT DISTINCT term FROM postings WHERE term NOT GLOB '*[^0-9a-z_]*'"
+            )
+    return conn
+
+
+def _local_ts(value: str) -> Optional[float]:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+
+def index_log_file(conn: sqlite3.Connection, path: Path) -> None:
+    """ラン ログを1件登録する（登録済みなら置き換える。呼び出し側でトランザクション）"""
+    stat = path.stat()
+    run_id = log_run_id(path)
+    meta: dict[str, Any] = {}
+    terms: set[str] = set()
+    truncated = False
+    with open_run_log(path) as f:
+        # ヘッダー（Tool / Start）とフッター（Finished）は先頭・末尾のチャンクにある
+        carry = ""
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            text = carry + chunk
+            cut = text.rfind("\n") + 1
+            carry, text = text[cut:], text[:cut]
+            if not meta:
+                tool = re.search(r"^Tool: (.*)$", text[:4096], re.MULTILINE)
+                meta["tool_name"] = tool.group(1) if tool else None
+            for kind, value in _LOG_HEADER_TIME.findall(text[:4096] + text[-4096:]):
+                meta["started_at" if kind == "Start" else "finished_at"] = _local_ts(value)
+            if not truncated:
+                terms.update(log_terms(text))
+                truncated = len(terms) > LOG_INDEX_MAX_TERMS
+        if carry and not truncated:
+            terms.update(log_terms(carry))
+    row = conn.execute("SELECT doc_id FROM docs WHERE path = ?", (str(path),)).fetchone()
+    if row:
+        conn.execute("DELETE FROM postings WHERE doc_id = ?", (row[0],))
+        conn.execute("DELETE FROM docs WHERE doc_id = ?", (row[0],))
+    doc_id = conn.execute(
+        "INSERT INTO docs (path, run_id, tool_name, started_at, finished_at, size, mtime, truncated) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            str(path), run_id, meta.get("tool_name"),
+            meta.get("started_at") or stat.st_mtime, meta.get("finished_at") or stat.st_mtime,
+            stat.st_size, stat.st_mtime, int(truncated),
+        ),
+    ).lastrowid
+    if not truncated:
+        conn.executemany("INSERT INTO postings VALUES (?, ?)", ((term, doc_id) for term in terms))
+        conn.executemany("INSERT OR IGNORE INTO terms VALUES (?)", ((term,) for term in terms if term.isascii()))
+
+
+def sync_log_index(conn: sqlite3.Connection, log_dir: Path) -> tuple[int, int]:
+    """log_dir との差分（未登録・更新・削除）を取り込む。(登録数, 削除数) を返す"""
+    known = {
+        path: (size, mtime)
+        for path, size, mtime in conn.execute("SELECT path, size, mtime FROM docs")
+    }
+    added = 0
+    for path, size, mtime in iter_run_logs(log_dir):
+        if known.pop(str(path), None) == (size, mtime):
+            continue
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        try:
+            conn.execute("SAVEPOINT doc")
+            index_log_file(conn, path)
+            conn.execute("RELEASE doc")
+            added += 1
+        except (OSError, sqlite3.Error) as e:
+            conn.execute("ROLLBACK TO doc")
+            conn.execute("RELEASE doc")
+            log(f"Failed to index {path.name}: {e}")
+        if added % 100 == 0:
+            conn.commit()
+    conn.commit()
+    with conn:
+        for path in known:
+            row = conn.execute("SELECT doc_id FROM docs WHERE path = ?", (path,)).fetchone()
+            conn.execute("DELETE FROM postings WHERE doc_id = ?", (row[0],))
+            conn.execute("DELETE FROM docs WHERE doc_id = ?", (row[0],))
+    return added, len(known)
+
+
+def move_indexed_log(conn: sqlite3.Connection, old: Path, new: Optional[Path]) -> None:
+    """圧縮・削除されたログのパスを付け替える（new=None なら削除。呼び出し側でトランザクション）"""
+    row = conn.execute("SELECT doc_id FROM docs WHERE path = ?", (str(old),)).fetchone()
+    if row is None:
+        if new is not None:
+            index_log_file(conn, new)
+        return
+    if new is None:
+        conn.execute("DELETE FROM postings WHERE doc_id = ?", (row[0],))
+        conn.execute("DELETE FROM docs WHERE doc_id = ?", (row[0],))
+        return
+    stat = new.stat()
+    conn.execute(
+        "UPDATE docs SET path = ?, size = ?, mtime = ? WHERE doc_id = ?",
+        (str(new), stat.st_size, stat.st_mtime, row[0]),
+    )
+
+
+class LogIndexer:
+    """確定したラン ログを専用スレッドでインデックスに追加する"""
+
+    def __init__(self) -> None:
+        # ("add", ログ, None) / ("move", 旧パス, 新パス or None)（log_retention による圧縮・削除）
+        self._queue: "queue.Queue[Optional[tuple[str, Path, Optional[Path]]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, config: dict[str, Any]) -> None:
+        path = log_index_path(config)
+        if path is None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(path, Path(config["log_dir"])), name="log-indexer", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, log_file: Optional[Path]) -> None:
+        if self._thread is not None and log_file is not None:
+            self._queue.put(("add", log_file, None))
+
+    def moved(self, old: Path, new: Optional[Path]) -> None:
+        if self._thread is not None:
+            self._queue.put(("move", old, new))
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self, path: Path, log_dir: Path) -> None:
+        try:
+            conn = open_log_index(path)
+            added, removed = sync_log_index(conn, log_dir)
+        except (OSError, sqlite3.Error) as e:
+            log(f"Log index disabled: {e}")
+            self._thread = None
+            return
+        log(f"Log index: {path} ({added} added, {removed} removed)")
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, log_file, moved_to = item
+            try:
+                with conn:
+                    if kind == "add":
+                        index_log_file(conn, log_file)
+                    else:
+                        move_indexed_log(conn, log_file, moved_to)
+            except (OSError, sqlite3.Error) as e:
+                log(f"Failed to index {log_file.name}: {e}")
+        conn.close()
+
+
+_log_indexer = LogIndexer()
+
+
+def _parse_local_date(value: Optional[str]) -> Optional[float]:
+    """--since / --until（YYYY-MM-DD または YYYY-MM-DD HH:MM）"""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise SystemExit(f"Invalid date: {value} (expected YYYY-MM-DD or 'YYYY-MM-DD HH:MM')")
+
+
+def search_logs(
+    index_path: Path,
+    query: str,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    tool: Optional[str] = None,
+    limit: int = 50,
+    max_lines: int = 5,
+) -> None:
+    """query を含む行を、新しい run から順に表示する（agent.py logs search）
+
+    大文字小文字は区別しない。語の途中からの query も探す（端の語は前方・後方・部分一致で候補を絞る）。
+    語に分割できない短い query はインデックスを使わず全件を読む。
+    """
+    if not index_path.exists():
+        print(f"Log index not found: {index_path} (run `agent.py logs index` first)")
+        return
+    conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True, timeout=10)
+    started = time.perf_counter()
+    needle = query.lower()
+    terms = query_terms(query)
+    where = ["1 = 1"]
+    params: list[Any] = []
+    if since is not None:
+        where.append("finished_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("started_at < ?")
+        params.append(until)
+    if tool:
+        where.append("tool_name = ?")
+        params.append(tool)
+    try:
+        has_vocab = conn.execute("SELECT 1 FROM terms LIMIT 1").fetchone() is not None
+    except sqlite3.OperationalError:
+        has_vocab = False  # 語の一覧がない古い索引（読み取り専用で開くので作れない）
+    postings: list[str] = []
+    for term, mode in terms:
+        if mode == "exact":
+            postings.append("SELECT doc_id FROM postings WHERE term = ?")
+            params.append(term)
+        elif mode == "prefix":
+            # 語は [0-9a-z_] なので term + "\x7f" 未満が term で始まる語
+            postings.append("SELECT doc_id FROM postings WHERE term >= ? AND term < ?")
+            params.extend([term, term + "\x7f"])
+        elif has_vocab:
+            pattern = term.replace("_", "\\_")
+            postings.append(
+                "SELECT doc_id FROM postings WHERE term IN "
+                "(SELECT term FROM terms WHERE term LIKE ? ESCAPE '\\')"
+            )
+            params.append(f"%{pattern}" if mode == "suffix" else f"%{pattern}%")
+    if postings:
+        # 全語を含むファイル（語数上限で索引が不完全なファイルは常に候補）
+        where.append(f"(doc_id IN ({' INTERSECT '.join(postings)}) OR truncated = 1)")
+    candidates = conn.execute(
+        f"SELECT path, run_id, tool_name, started_at FROM docs WHERE {' AND '.join(where)} "
+        "ORDER BY started_at DESC",
+        params,
+    ).fetchall()
+    conn.close()
+    index_ms = (time.perf_counter() - started) * 1000
+
+    matched = 0
+    scanned = 0
+    for path, run_id, tool_name, started_at in candidates:
+        if matched >= limit:
+            break
+        hits: list[tuple[int, str]] = []
+        count = 0
+        try:
+            with open_run_log(Path(path)) as f:
+                scanned += 1
+                for lineno, line in enumerate(f, 1):
+                    if needle in line.lower():
+                        count += 1
+                        if len(hits) < max_lines:
+                            hits.append((lineno, line.rstrip()))
+        except OSError:
+            continue
+        if not count:
+            continue
+        matched += 1
+        when = datetime.fromtimestamp(started_at).strftime("%Y-%m-%d %H:%M") if started_at else "-"
+        print(f"{when}  {tool_name or '-'}  {run_id or '-'}  ({count} line(s))  {path}")
+        for lineno, text in hits:
+            print(f"  {lineno:>6}: {text[:200]}")
+    total_ms = (time.perf_counter() - started) * 1000
+    more = " (limit reached)" if matched >= limit else ""
+    print(
+        f"\n{matched} run(s){more}; {len(candidates)} candidate file(s) from index in {index_ms:.1f}ms, "
+        f"{scanned} read, total {total_ms:.0f}ms"
+    )
+
+
+# ---------------------------------------------------------------------------
+# ログ配信（HTTP）
+# log_server_port 設定時、ラン ログの末尾と追記分を返す小さな HTTP サーバーを起動する。
+#   GET /runs/{run_id}/log?tail=N            末尾 N 行（mmap で末尾から改行を数える。全体は読まない）
+#   GET /runs/{run_id}/log?since=O&wait=S    オフセット O 以降の追記分。なければ S 秒まで待つ（追従表示用）
+#   GET /runs/{run_id}/view                  上の2つで末尾を表示し続ける HTML
+# 認証はポータルが発行する署名付き URL（exp と sig = HMAC-SHA256(署名鍵, "run_id:exp")）か、
+# X-Machine-Key ヘッダー。ポート番号はハートビートで送り、署名鍵はその応答（log_secret）で受け取る。
+# ---------------------------------------------------------------------------
+LOG_SERVER_MAX_CHUNK = 1 << 20  # since 1回で返す上限（バイト）
+LOG_SERVER_MAX_WAIT = 30
+_RUN_ID_PATTERN = re.compile(r"^[0-9A-Za-z-]{1,64}$")
+
+
+def _tail_start(buf: Any, size: int, lines: int) -> int:
+    """buf（bytes / mmap）の末尾 lines 行の開始位置。足りなければ -1"""
+    pos = size - 1 if buf[size - 1:size] == b"\n" else size  # 末尾の改行は行に含める
+    for _ in range(lines):
+        pos = buf.rfind(b"\n", 0, pos)
+        if pos < 0:
+            return -1
+    return pos + 1
+
+
+def tail_offset(path: Path, lines: int) -> tuple[int, int]:
+    """末尾 lines 行の開始オフセットとファイルサイズ（mmap で末尾から改行を探す）"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or lines <= 0:
+            return size, size
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            return max(_tail_start(mm, size, lines), 0), size
+
+
+def gzip_tail(path: Path, lines: int, limit: int = LOG_SERVER_MAX_CHUNK) -> tuple[bytes, int]:
+    """圧縮済みログの末尾 lines 行（最大 limit バイト）と展開後のサイズ
+
+    gzip は末尾から読めないため全体を展開するが、保持するのは末尾 limit バイトだけ。
+    """
+    buf = b""
+    size = 0
+    with gzip.open(str(path), "rb") as f:
+        while chunk := f.read(1 << 20):
+            size += len(chunk)
+            buf = (buf + chunk)[-limit:]
+    if not buf or lines <= 0:
+        return b"", size
+    start = _tail_start(buf, len(buf), lines)
+    if start < 0:
+        # 先頭まで遡った。limit で切れているなら最初の不完全な行を落とす
+        start = 0 if size == len(buf) else buf.find(b"\n") + 1
+    return buf[start:], size
+
+
+def read_range(path: Path, start: int, limit: int = LOG_SERVER_MAX_CHUNK) -> tuple[bytes, int]:
+    """start 以降を最大 limit バイト読む（途中で切る場合は行末で切る）。(内容, 次のオフセット)
+
+    .gz は展開後のオフセット。
+    """
+    with (gzip.open(str(path), "rb") if path.suffix == ".gz" else open(path, "rb")) as f:
+        f.seek(start)
+        data = f.read(limit)
+    if len(data) == limit:
+        cut = data.rfind(b"\n") + 1
+        if cut > 0:
+            data = data[:cut]
+    return data, start + len(data)
+
+
+def sign_log_url(secret: str, run_id: str, exp: int) -> str:
+    """ポータルの buildRunnerLogViewUrl() と同じ署名"""
+    return hmac.new(secret.encode(), f"{run_id}:{exp}".encode(), hashlib.sha256).hexdigest()
+
+
+LOG_VIEW_HTML = """<!doctype html>
+<html lang="ja"><head><meta charset="utf-8"><title>run log</title>
+<style>body{margin:0;font:13px/1.4 Consolas,monospace;background:#111;color:#ddd}
+#s{position:sticky;top:0;background:#222;padding:4px 8px;color:#9c9}pre{margin:0;padding:8px;white-space:pre-wrap}</style>
+</head><body><div id="s">loading…</div><pre id="o"></pre><script>
+const q = location.search, base = location.pathname.replace(/view$/, "log"), o = document.getElementById("o"),
+  s = document.getElementById("s");
+async function get(params) {
+  const r = await fetch(base + q + (q ? "&" : "?") + params);
+  if (!r.ok) throw new Error(r.status + " " + (await r.text()));
+  return [await r.text(), +r.headers.get("X-Log-Offset"), r.headers.get("X-Log-Complete") === "1"];
+}
+(async () => {
+  try {
+    let [text, offset, done] = await get("tail=500");
+    o.textContent = text;
+    while (!done) {
+      s.textContent = "following… (" + offset + " bytes)";
+      const atBottom = innerHeight + scrollY >= document.body.scrollHeight - 20;
+      [text, offset, done] = await get("since=" + offset + "&wait=25");
+      if (text) o.append(text);
+      if (text && atBottom) scrollTo(0, document.body.scrollHeight);
+    }
+    s.textContent = "finished (" + offset + " bytes)";
+  } catch (e) { s.textContent = "error: " + e.message; }
+})();
+</script></body></html>
+"""
+
+
+class _LogRequestHandler(BaseHTTPRequestHandler):
+    server_version = "TCPortalRunnerLog/1.0"
+    config: dict[str, Any] = {}
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # アクセスログは出さない（ポーリングで agent.log が埋まるため）
+
+    def _send(self, code: int, body: bytes, content_type: str = "text/plain; charset=utf-8",
+              headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, run_id: str, params: dict[str, str]) -> bool:
+        header = self.headers.get("X-Machine-Key")
+        if header:
+            return hmac.compare_digest(header, self.config["machine_key"])
+        secret = _log_server.secret
+        try:
+            exp = int(params.get("exp", ""))
+        except ValueError:
+            return False
+        if secret is None or exp < time.time():
+            return False
+        return hmac.compare_digest(params.get("sig", ""), sign_log_url(secret, run_id, exp))
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "runs" or parts[2] not in ("log", "view") or not _RUN_ID_PATTERN.match(parts[1]):
+            self._send(404, b"not found")
+            return
+        run_id = parts[1]
+        if not self._authorized(run_id, params):
+            self._send(403, b"forbidden")
+            return
+        if parts[2] == "view":
+            self._send(200, LOG_VIEW_HTML.encode(), "text/html; charset=utf-8")
+            return
+        path = find_run_log(Path(self.config["log_dir"]), run_id)
+        if path is None:
+            self._send(404, b"log not found")
+            return
+        try:
+            if path.suffix == ".gz":
+                # 圧縮済み＝確定済み。追従はしない
+                if "since" in params:
+                    data, offset = read_range(path, int(params["since"]))
+                else:
+                    data, offset = gzip_tail(path, min(int(params.get("tail", 200)), 100_000))
+                complete = True
+            elif "since" in params:
+                data, offset, complete = self._follow(run_id, path, int(params["since"]), float(params.get("wait", 0)))
+            else:
+                start, _size = tail_offset(path, min(int(params.get("tail", 200)), 100_000))
+                data, offset = read_range(path, start)
+                complete = not self._active(run_id)
+        except FileNotFoundError:
+            self._send(404, b"log not found")
+            return
+        except (ValueError, OSError) as e:
+            self._send(400, str(e).encode())
+            return
+        self._send(200, data, headers={"X-Log-Offset": str(offset), "X-Log-Complete": "1" if complete else "0"})
+
+    @staticmethod
+    def _active(run_id: str) -> bool:
+        with _active_runs_lock:
+            return run_id in _active_runs
+
+    def _follow(self, run_id: str, path: Path, since: int, wait: float) -> tuple[bytes, int, bool]:
+        """since 以降の追記分。まだなければ実行中の間は wait 秒まで待つ（ロングポーリング）"""
+        deadline = time.monotonic() + min(max(wait, 0.0), LOG_SERVER_MAX_WAIT)
+        while True:
+            active = self._active(run_id)
+            size = path.stat().st_size
+            if size > since:
+                data, offset = read_range(path, since)
+                return data, offset, not active and offset >= size
+            if not active or time.monotonic() >= deadline or _shutdown_event.is_set():
+                return b"", since, not active
+            time.sleep(0.25)
+
+
+class LogServer:
+    """ラン ログ配信サーバー（log_server_port 未設定時は起動しない）"""
+
+    def __init__(self) -> None:
+        self.port: Optional[int] = None
+        self.secret: Optional[str] = None  # 署名鍵（ハートビートの応答で受け取る）
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self, config: dict[str, Any]) -> None:
+        port = config.get("log_server_port")
+        if not port or not config.get("log_dir"):
+            return
+        handler = type("LogRequestHandler", (_LogRequestHandler,), {"config": config})
+        try:
+            self._server = ThreadingHTTPServer((config.get("log_server_host", "0.0.0.0"), port), handler)
+        except OSError as e:
+            log(f"Log server disabled: {e}")
+            return
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="log-server", daemon=True).start()
+        log(f"Log server listening on port {self.port}")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+_log_server = LogServer()
+
+
+# ---------------------------------------------------------------------------
+# run メトリクス・進捗（スクリプト → ポータル）
+# run のプロセスには環境変数 TC_PORTAL_METRICS でファイルパスを渡す。スクリプトはそこへ
+# 1行1オブジェクトの JSON を追記する（例: {"rows": 500, "bytes": 120000}）。
+# 数値は加算するカウンタとして集計する。progress（0〜100）と message は進捗で、最後の値を使う。
+# tee ラッパーは出力の "##tc-progress 42% メッセージ" 行を進捗としてこのファイルに書く。
+# 実行中は ProgressReporter がまとめて送り、終了時のカウンタは report で送る。
+# 追記だけなので、子プロセスが複数でも同じファイルに書いてよい。
+# ---------------------------------------------------------------------------
+METRICS_ENV = "TC_PORTAL_METRICS"
+METRICS_MAX_KEYS = 50
+
+
+@dataclass
+class RunMetrics:
+    path: Path
+    values: dict[str, float] = field(default_factory=dict)
+    progress: Optional[float] = None
+    message: Optional[str] = None
+    offset: int = 0
+    sent: Optional[dict[str, Any]] = None  # 最後に送った状態
+    reported: bool = False  # report 済み（起動のみの run）。途中経過は送らず、最終値は followup で送る
+
+    def state(self) -> dict[str, Any]:
+        state: dict[str, Any] = {}
+        if self.values:
+            state["metrics"] = dict(self.values)
+        if self.progress is not None or self.message is not None:
+            state["progress"] = self.progress
+            state["message"] = self.message
+        return state
+
+
+class MetricsChannel:
+    """run ごとのメトリクスファイルの払い出しと集計"""
+
+    def __init__(self) -> None:
+        self._dir = Path(tempfile.gettempdir()) / "tc-portal-metrics"
+        self._runs: dict[str, RunMetrics] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict[str, Any]) -> None:
+        if config.get("metrics_dir"):
+            self._dir = Path(config["metrics_dir"])
+        # 異常終了で残ったファイルを掃除する（同じフォルダを使う別インスタンスの実行中の run は残す）
+        cutoff = time.time() - 7 * 86400
+        try:
+            for path in self._dir.glob("*.jsonl"):
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+        except OSError:
+            pass
+
+    def open(self, run_id: str) -> Path:
+        """run のメトリクスファイルのパス（ファイルはスクリプトが追記で作る）"""
+        with self._lock:
+            metrics = self._runs.get(run_id)
+            if metrics is None:
+                self._dir.mkdir(parents=True, exist_ok=True)
+                metrics = self._runs[run_id] = RunMetrics(self._dir / f"{run_id}.jsonl")
+                metrics.path.unlink(missing_ok=True)
+            return metrics.path
+
+    @staticmethod
+    def _poll(metrics: RunMetrics) -> None:
+        """前回以降に追記された完全な行を集計する（書きかけの行は次回）"""
+        try:
+            with open(metrics.path, "rb") as f:
+                f.seek(metrics.offset)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b"\n") + 1
+        metrics.offset += end
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            progress = record.pop("progress", None)
+            message = record.pop("message", None)
+            if isinstance(progress, (int, float)) and not isinstance(progress, bool) and math.isfinite(progress):
+                metrics.progress = min(max(float(progress), 0.0), 100.0)
+            if isinstance(message, str):
+                metrics.message = message[:200] or None
+            for key, value in record.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    continue
+                key = str(key)[:64]
+                if key in metrics.values or len(metrics.values) < METRICS_MAX_KEYS:
+                    metrics.values[key] = metrics.values.get(key, 0) + value
+
+    def updates(self) -> list[dict[str, Any]]:
+        """進捗・メトリクス（前回送信から変わった run のみ）。間の変化は最新の値にまとまる"""
+        updates: list[dict[str, Any]] = []
+        with self._lock:
+            for run_id, metrics in self._runs.items():
+                if metrics.reported:
+                    continue
+                self._poll(metrics)
+                state = metrics.state()
+                if state and state != metrics.sent:
+                    metrics.sent = state
+                    updates.append({"run_id": run_id, **state})
+        return updates
+
+    def forget(self, updates: list[dict[str, Any]]) -> None:
+        """送信できなかった分を次回に送り直す"""
+        with self._lock:
+            for update in updates:
+                metrics = self._runs.get(update["run_id"])
+                if metrics is not None:
+                    metrics.sent = None
+
+    def stop_updates(self, run_id: str) -> None:
+        """report 後の途中経過を送らない（ポータルも running 以外の run の進捗は受け付けない）"""
+        with self._lock:
+            metrics = self._runs.get(run_id)
+            if metrics is not None:
+                metrics.reported = True
+
+    def finish(self, run_id: str) -> Optional[dict[str, float]]:
+        """最終値を返し、ファイルを削除する（メトリクスを書かなかった run は None）"""
+        with self._lock:
+            metrics = self._runs.pop(run_id, None)
+            if metrics is None:
+                return None
+            self._poll(metrics)
+        try:
+            metrics.path.unlink(missing_ok=True)
+        except OSError:
+            pass  # まだ子孫プロセスが開いている（Windows）。次回起動以降の掃除に任せる
+        return metrics.values or None
+
+
+_metrics = MetricsChannel()
+
+
+class ProgressReporter:
+    """実行中 run の進捗・メトリクスを progress_interval_sec ごとにまとめて送る"""
+
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, config: dict[str, Any]) -> None:
+        interval = config.get("progress_interval_sec", 5)
+        if not interval or interval <= 0:
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(config, max(1.0, interval)), name="progress", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, config: dict[str, Any], interval: float) -> None:
+        url = f"{config['portal_url']}/api/runner/progress"
+        headers = {"X-Machine-Key": config["machine_key"], "Content-Type": "application/json"}
+        while not _shutdown_event.wait(interval):
+            updates = _metrics.updates()
+            if not updates:
+                continue
+            try:
+                response = requests.post(url, headers=headers, json={"updates": updates}, timeout=10)
+                if response.status_code != 200:
+                    log(f"Progress update failed: {response.status_code} - {response.text[:100]}")
+                    _metrics.forget(updates)
+            except requests.RequestException as e:
+                log(f"Progress update error: {e}")
+                _metrics.forget(updates)
+
+
+_progress = ProgressReporter()
+
+
+# ---------------------------------------------------------------------------
+# 結果キャッシュ（入力が変わっていない run の実行を省略する）
+# run_config.cache = {"inputs": [glob, ...], "output_dir": ..., "base_dir": ...} を持つ
+# python_runner / bat は、入力ファイルと実行するスクリプト / BAT の内容・target・run_config・payload のハッシュをキーに、
+# 成功時の output_dir の中身をローカルのストア（result_cache.dir の blobs/<sha256 先頭2桁>/<sha256>）に残す。
+# 同じキーの run は実行せずに出力を書き戻し、success（summary に "(cached)"）として報告する。
+# 入力のハッシュは (size, mtime) が前回と同じなら索引の値を使い、変わったファイルだけ読む。
+# ストアが max_mb を超えたら、最後に使われたのが古いエントリから消す。
+# ---------------------------------------------------------------------------
+
+RESULT_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    tool_name TEXT,
+    files TEXT NOT NULL,          -- JSON: [[output_dir からの相対パス, sha256, size], ...]
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_used ON entries(used_at);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+"""
+CACHEABLE_TOOL_TYPES = ("python_runner", "bat")
+# mtime がハッシュ時点からこの秒数以内のファイルは (size, mtime) を索引に残さない
+# （同じ時刻のうちに書き換えられると mtime が変わらず、古いハッシュを使ってしまうため。FAT は 2 秒単位）
+_HASH_SETTLE_SEC = 2
+
+
+@dataclass
+class CacheSpec:
+    inputs: list[str]
+    output_dir: Path
+    code: list[Path] = field(default_factory=list)
+
+
+def cache_code_files(task: dict[str, Any], config: dict[str, Any]) -> list[Path]:
+    """実行するスクリプト / BAT / モジュールのファイル（execute_python_runner・execute_bat と同じ解決）
+
+    import 先のモジュールは含まない（変更を検知したいものは inputs に書く）。
+    """
+    target = os.path.expandvars(task.get("target") or "")
+    if task.get("tool_type") == "bat" and target:
+        return [Path(target)]
+    if not target:
+        script = (task.get("run_config") or {}).get("script")
+        if not script:
+            return []
+        script_path = Path(script)
+        if not script_path.is_absolute() and config.get("scripts_base_path"):
+            script_path = Path(config["scripts_base_path"]) / script
+        return [script_path]
+    if "|" in target:
+        project_path, module_name = (part.strip() for part in target.split("|", 1))
+        module = Path(project_path, *module_name.split("."))
+        return [module.with_suffix(".py"), module / "__main__.py"]
+    if ".venv" in target and ("Scripts\\python.exe" in target or "Scripts/python.exe" in target):
+        separator = "Scripts\\python.exe " if "Scripts\\python.exe " in target else "Scripts/python.exe "
+        venv, _, script = target.partition(separator)
+        return [Path(venv).parent / script.strip()] if script.strip() else []
+    return [Path(target)]
+
+
+def cache_spec(task: dict[str, Any], config: dict[str, Any]) -> Optional[CacheSpec]:
+    """run_config.cache を解決する（未指定なら None、不正なら ValueError）
+
+    パスは環境変数を展開し、相対パスは base_dir からとする。
+    """
+    spec = (task.get("run_config") or {}).get("cache")
+    if not spec:
+        return None
+    if task.get("tool_type") not in CACHEABLE_TOOL_TYPES:
+        raise ValueError(f"run_config.cache is not supported for {task.get('tool_type')}")
+    if not isinstance(spec, dict) or not spec.get("output_dir") or not isinstance(spec.get("inputs"), list):
+        raise ValueError('run_config.cache must be {"inputs": [...], "output_dir": ...}')
+    base_dir = os.path.expandvars(spec["base_dir"]) if spec.get("base_dir") else None
+
+    def resolve(value: Any) -> str:
+        path = os.path.expandvars(str(value))
+        if os.path.isabs(path):
+            return path
+        if base_dir is None:
+            raise ValueError(f"run_config.cache: relative path requires base_dir: {value}")
+        return os.path.join(base_dir, path)
+
+    return CacheSpec(
+        [resolve(p) for p in spec["inputs"]], Path(resolve(spec["output_dir"])), cache_code_files(task, config)
+    )
+
+
+def cache_input_files(spec: CacheSpec) -> list[Path]:
+    """inputs の glob に一致するファイル（フォルダは中身すべて。output_dir の中は除く）"""
+    files: set[Path] = set()
+    for pattern in spec.inputs:
+        for match in glob.glob(pattern, recursive=True):
+            path = Path(match)
+            if path.is_dir():
+                files.update(p for p in path.rglob("*") if p.is_file())
+            elif path.is_file():
+                files.add(path)
+    return sorted(p for p in files if not p.is_relative_to(spec.output_dir))
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """run_config.cache の索引（SQLite）とコンテンツアドレス型ストア
+
+    保存・書き戻し・削除は同じロックの中で行う（書き戻し中の blob を削除で消さないため）。
+    """
+
+    def __init__(self) -> None:
+        self.dir: Optional[Path] = None
+        self._max_bytes = 2048 * 1024 * 1024
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict[str, Any]) -> None:
+        settings = config.get("result_cache", {})
+        if settings is False:
+            return
+        settings = settings or {}
+        self.dir = Path(settings.get("dir") or Path(__file__).parent / "result_cache")
+        self._max_bytes = int(settings.get("max_mb", 2048) * 1024 * 1024)
+
+    def _open(self) -> sqlite3.Connection:
+        assert self.dir is not None
+        self.dir.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.dir / "cache.db"), timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(RESULT_CACHE_SCHEMA)
+        return conn
+
+    def _blob(self, digest: str) -> Path:
+        assert self.dir is not None
+        return self.dir / "blobs" / digest[:2] / digest
+
+    def _input_digests(self, files: list[Path]) -> list[tuple[str, str]]:
+        """(パス, sha256)。(size, mtime) が索引と同じファイルは読まない"""
+        stats = {str(path): path.stat() for path in files}
+        with self._lock:
+            conn = self._open()
+            try:
+                known = {}
+                for path in stats:
+                    row = conn.execute("SELECT size, mtime_ns, digest FROM file_hashes WHERE path = ?", (path,)).fetchone()
+                    if row is not None:
+                        known[path] = row
+            finally:
+                conn.close()
+
+        digests, updates = [], []
+        for path, st in stats.items():
+            row = known.get(path)
+            if row is not None and row[:2] == (st.st_size, st.st_mtime_ns):
+                digests.append((path, row[2]))
+                continue
+            digest = file_digest(Path(path))
+            digests.append((path, digest))
+            if st.st_mtime < time.time() - _HASH_SETTLE_SEC:
+                updates.append((path, st.st_size, st.st_mtime_ns, digest))
+        if updates:
+            with self._lock:
+                conn = self._open()
+                try:
+                    with conn:
+                        conn.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", updates)
+                finally:
+                    conn.close()
+        return digests
+
+    def key(self, task: dict[str, Any], spec: CacheSpec) -> tuple[str, int]:
+        """キャッシュキー（sha256）と入力ファイル数（実行するスクリプト自体の内容もキーに含める）"""
+        inputs = cache_input_files(spec)
+        code = [path for path in spec.code if path.is_file() and path not in inputs]
+        digests = self._input_digests(inputs + code)
+        key = hashlib.sha256()
+        key.update(json.dumps(
+            {
+                "tool_type": task.get("tool_type"),
+                "target": task.get("target"),
+                "run_config": task.get("run_config"),
+                "payload": task.get("payload"),
+            },
+            sort_keys=True, ensure_ascii=False, default=str,
+        ).encode("utf-8"))
+        for path, digest in digests:
+            key.update(f"\n{path}\0{digest}".encode("utf-8"))
+        return key.hexdigest(), len(inputs)
+
+    def restore(self, key: str, spec: CacheSpec) -> Optional[int]:
+        """キーのエントリがあれば出力を書き戻してファイル数を返す（なければ None）
+
+        output_dir の既存ファイルは同名のものだけ置き換える（キャッシュにないファイルは消さない）。
+        """
+        with self._lock:
+            conn = self._open()
+            try:
+                row = conn.execute("SELECT files FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                files = json.loads(row[0])
+                for rel, digest, _size in files:
+                    dest = spec.output_dir / rel
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = dest.with_name(dest.name + ".tc-cache-tmp")
+                    shutil.copyfile(self._blob(digest), tmp)
+                    os.replace(tmp, dest)
+                with conn:
+                    conn.execute("UPDATE entries SET used_at = ? WHERE key = ?", (time.time(), key))
+                return len(files)
+            finally:
+                conn.close()
+
+    def store(self, key: str, spec: CacheSpec, tool_name: Optional[str]) -> Optional[int]:
+        """output_dir の中身をキーのエントリとして保存する（上限を超える出力は保存せず None）"""
+        outputs = sorted(p for p in spec.output_dir.rglob("*") if p.is_file() and not p.name.endswith(".tc-cache-tmp"))
+        total = sum(p.stat().st_size for p in outputs)
+        if total > self._max_bytes:
+            log(f"Result cache: outputs too large to store ({total / 1024 / 1024:.1f}MB)")
+            return None
+        with self._lock:
+            conn = self._open()
+            try:
+                files, blobs = [], []
+                for path in outputs:
+                    digest = file_digest(path)
+                    size = path.stat().st_size
+                    blob = self._blob(digest)
+                    if not blob.exists():
+                        blob.parent.mkdir(parents=True, exist_ok=True)
+                        tmp = blob.with_suffix(".tmp")
+                        shutil.copyfile(path, tmp)
+                        os.replace(tmp, blob)
+                    files.append([path.relative_to(spec.output_dir).as_posix(), digest, size])
+                    blobs.append((digest, size))
+                now = time.time()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, tool_name, json.dumps(files, ensure_ascii=False), total, now, now),
+                    )
+                    conn.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?)", blobs)
+                    self._evict(conn)
+                return len(files)
+            finally:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """ストアが max_mb を超えていれば、使われた時刻の古いエントリから消す（参照のなくなった blob も）"""
+        sizes = dict(conn.execute("SELECT digest, size FROM blobs"))
+        total = sum(sizes.values())
+        if total <= self._max_bytes:
+            return
+        entries = [(key, {f[1] for f in json.loads(files)}) for key, files in conn.execute(
+            "SELECT key, files FROM entries ORDER BY used_at"
+        )]
+        refs: dict[str, int] = {}
+        for _key, digests in entries:
+            for digest in digests:
+                refs[digest] = refs.get(digest, 0) + 1
+        unused = [digest for digest in sizes if digest not in refs]
+        evicted = 0
+        for key, digests in entries[:-1]:  # 今保存したエントリ（最新）は残す
+            if total - sum(sizes[d] for d in unused) <= self._max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            evicted += 1
+            for digest in digests:
+                refs[digest] -= 1
+                if refs[digest] == 0:
+                    unused.append(digest)
+        for digest in unused:
+            total -= sizes[digest]
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._blob(digest).unlink(missing_ok=True)
+        if evicted:
+            log(f"Result cache: evicted {evicted} entries ({total / 1024 / 1024:.1f}MB kept)")
+
+
+_result_cache = ResultCache()
+
+
+def execute_cached(
+    task: dict[str, Any],
+    config: dict[str, Any],
+    log_file: Optional[Path],
+    execute: Any,
+) -> tuple[str, Optional[str], Optional[str]]:
+    """run_config.cache があれば、入力が同じ成功結果を書き戻して execute を省略する"""
+    try:
+        spec = cache_spec(task, config)
+    except ValueError as e:
+        return "failed", None, str(e)
+    if spec is None or _result_cache.dir is None:
+        return execute(task, config, log_file)
+
+    run_id = task["run_id"]
+    spans = run_spans(task)
+    lookup_started = time.time_ns()
+    try:
+        key, inputs = _result_cache.key(task, spec)
+        restored = _result_cache.restore(key, spec)
+    except (OSError, sqlite3.Error, ValueError) as e:
+        # 書き戻しの途中で失敗しても、実行すれば出力は上書きされる
+        log(f"Result cache unavailable, executing: {e}")
+        append_to_log(log_file, f"[Cache] Unavailable: {e}\n")
+        return execute(task, config, log_file)
+    spans.add("cache_lookup", lookup_started, **{"cache.hit": restored is not None, "cache.inputs": inputs})
+
+    if restored is not None:
+        task["_cached"] = True
+        log(f"Result cache hit: {key[:12]} ({inputs} inputs), restored {restored} files to {spec.output_dir}")
+        append_to_log(log_file, f"[Cache] Hit {key[:12]} ({inputs} inputs): restored {restored} files to {spec.output_dir}\n")
+        return "success", f"Restored {restored} output files (cached)", None
+    append_to_log(log_file, f"[Cache] Miss {key[:12]} ({inputs} inputs)\n")
+
+    status, summary, error = execute(task, config, log_file)
+    with _active_runs_lock:
+        active = _active_runs.get(run_id)
+        process = active.process if active else None
+    # 起動のみで返った run（ログなし BAT）・キャンセルされた run の出力は残さない
+    if status != "success" or process is None or process.poll() is None or is_cancel_requested(run_id):
+        return status, summary, error
+    try:
+        # 実行中に入力が変わった場合、出力がどちらの入力のものか分からないため残さない
+        if _result_cache.key(task, spec)[0] != key:
+            log("Result cache: inputs changed during the run, not stored")
+        else:
+            stored = _result_cache.store(key, spec, task.get("tool_name"))
+            if stored is not None:
+                append_to_log(log_file, f"\n[Cache] Stored {stored} files as {key[:12]}\n")
+    except (OSError, sqlite3.Error, ValueError) as e:
+        log(f"Result cache store failed: {e}")
+    return status, summary, error
+
+
+# ---------------------------------------------------------------------------
+# プロセスツリー管理
+# Windows: ジョブオブジェクトに登録し、孫プロセスまでまとめて終了する
+# POSIX: 新しいセッション（プロセスグループ）で起動し、killpg で終了する
+# ---------------------------------------------------------------------------
+def _assign_job_object(process: subprocess.Popen) -> Any:
+    """起動直後のプロセスをジョブオブジェクトに登録する（以降の子孫も自動で所属）"""
+    if not (IS_WINDOWS and HAS_WIN32):
+        return None
+    try:
+        job = win32job.CreateJobObject(None, "")
+        handle = win32api.OpenProcess(
+            win32con.PROCESS_SET_QUOTA | win32con.PROCESS_TERMINATE, False, process.pid
+        )
+        try:
+            win32job.AssignProcessToJobObject(job, handle)
+        finally:
+            win32api.CloseHandle(handle)
+        return job
+    except Exception as e:
+        log(f"Warning: Failed to assign job object (PID: {process.pid}): {e}")
+        return None
+
+
+class ProcessTree:
+    """子プロセスとその子孫をひとまとめに待機・終了するためのハンドル"""
+
+    def __init__(self, process: subprocess.Popen, job: Any = None) -> None:
+        self.process = process
+        self.pid = process.pid
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._job = job
+        self._rusage: Any = None
+        self._reap_lock = threading.Lock()
+
+    @classmethod
+    def spawn(
+        cls,
+        cmd: list[str] | str,
+        cwd: Optional[str | Path] = None,
+        new_console: bool = True,
+        **kwargs: Any,
+    ) -> "ProcessTree":
+        """プロセスを起動し、ツリー単位で終了できる状態にして返す"""
+        if IS_WINDOWS:
+            if new_console:
+                kwargs.setdefault("creationflags", subprocess.CREATE_NEW_CONSOLE)
+        else:
+            kwargs.setdefault("start_new_session", True)
+        process = subprocess.Popen(cmd, cwd=cwd, **kwargs)
+        return cls(process, _assign_job_object(process))
+
+    def _reap(self) -> Optional[int]:
+        """POSIX: wait4 で回収し、子プロセスの rusage を保持する（非ブロッキング）"""
+        with self._reap_lock:
+            if self.process.returncode is None:
+                try:
+                    pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+                except ChildProcessError:
+                    return self.process.poll()
+                if pid == 0:
+                    return None
+                self._rusage = rusage
+                self.process.returncode = os.waitstatus_to_exitcode(status)
+            return self.process.returncode
+
+    def poll(self) -> Optional[int]:
+        code = self.process.poll() if IS_WINDOWS else self._reap()
+        if code is not None and self.finished_at is None:
+            self.finished_at = time.time()
+        return code
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if IS_WINDOWS:
+            code = self.process.wait(timeout=timeout)
+        else:
+            # Popen.wait(timeout) と同様のバックオフ付きポーリング
+            deadline = None if timeout is None else time.monotonic() + timeout
+            delay = 0.0005
+            while (code := self._reap()) is None:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(self.process.args, timeout)
+                delay = min(delay * 2, 0.05)
+                time.sleep(delay)
+        if self.finished_at is None:
+            self.finished_at = time.time()
+        return code
+
+    def resource_usage(self) -> dict[str, Any]:
+        """終了後のリソース使用量（取得できた項目のみ）
+
+        Windows はジョブオブジェクトの集計値なので孫プロセスも含む。
+        """
+        usage: dict[str, Any] = {}
+        if self.finished_at is not None:
+            usage["duration_sec"] = round(self.finished_at - self.started_at, 3)
+        if IS_WINDOWS and self._job is not None:
+            try:
+                acct = win32job.QueryInformationJobObject(
+                    self._job, win32job.JobObjectBasicAccountingInformation
+                )
+                usage["cpu_user_sec"] = round(int(acct["TotalUserTime"]) / 1e7, 3)
+                usage["cpu_kernel_sec"] = round(int(acct["TotalKernelTime"]) / 1e7, 3)
+                usage["process_count"] = int(acct["TotalProcesses"])
+                ext = win32job.QueryInformationJobObject(
+                    self._job, win32job.JobObjectExtendedLimitInformation
+                )
+                usage["peak_memory_mb"] = round(int(ext["PeakJobMemoryUsed"]) / 1048576, 1)
+            except Exception as e:
+                log(f"Warning: Failed to query job accounting (PID: {self.pid}): {e}")
+        elif self._rusage is not None:
+            usage["cpu_user_sec"] = round(self._rusage.ru_utime, 3)
+            usage["cpu_kernel_sec"] = round(self._rusage.ru_stime, 3)
+            usage["peak_memory_mb"] = round(self._rusage.ru_maxrss / 1024, 1)
+        return usage
+
+    def _signal_tree(self, force: bool) -> None:
+        if IS_WINDOWS:
+            if force and self._job is not None:
+                try:
+                    win32job.TerminateJobObject(self._job, 1)
+                    return
+                except Exception as e:
+                    log(f"TerminateJobObject failed (PID: {self.pid}): {e}")
+            # /F なしは WM_CLOSE 送信（コンソールは CTRL_CLOSE_EVENT）で終了を促す
+            cmd = ["taskkill", "/PID", str(self.pid), "/T"]
+            if force:
+                cmd.append("/F")
+            subprocess.run(
+                cmd,
+                capture_output=True,
+                creationflags=subprocess.CREATE_NO_WINDOW,
+            )
+        else:
+            try:
+                os.killpg(self.pid, signal.SIGKILL if force else signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def terminate_tree(self, grace: float = 10.0) -> None:
+        """猶予付きでプロセスツリー全体を終了する
+
+        まず穏当な終了を要求し、grace 秒待っても残っていれば強制終了する。
+        親が先に終了しても孫が残っている可能性があるため、強制終了は必ず送る。
+        """
+        log(f"Terminating process tree (PID: {self.pid}, grace: {grace}s)")
+        if self.poll() is None:
+            self._signal_tree(force=False)
+            try:
+                self.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                log(f"Process tree did not exit within {grace}s, force-killing (PID: {self.pid})")
+        self._signal_tree(force=True)
+        try:
+            self.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            log(f"Warning: Process still alive after force kill (PID: {self.pid})")
+
+
+# ---------------------------------------------------------------------------
+# 実行スロット管理
+# 実行中の run を run_id 単位で保持し、ワーカースレッドで処理する。
+# ポーリングループは実行中もハートビートを継続し、キャンセル要求を受け取れる。
+#
+# スロットはリソースクラス単位で管理する。デスクトップを占有する GUI 系と
+# ヘッドレスな CPU 系で別々の同時実行数を持ち、claim 時には今すぐ開始できる
+# tool_type だけを要求する（GUI 待ちが後続のヘッドレス実行を塞がない）。
+# ---------------------------------------------------------------------------
+@dataclass
+class ActiveRun:
+    run_id: str
+    task: dict[str, Any]
+    resource_class: Optional[str] = None
+    thread: Optional[threading.Thread] = None
+    process: Optional[ProcessTree] = None
+    cancel_requested: threading.Event = field(default_factory=threading.Event)
+    cancel_reason: str = "Canceled from portal"
+    started_at: float = field(default_factory=time.time)
+    estimate_sent: Optional[str] = None  # ハートビートで送った ETA の段階（p50_ms / p90_ms / p99_ms / slow）
+    slow_at: Optional[float] = None
+
+
+_active_runs: dict[str, ActiveRun] = {}
+_active_runs_lock = threading.Lock()
+
+
+ALL_TOOL_TYPES = ["python_runner", "pad", "exe", "excel", "sheet", "folder", "bi", "bat"]
+
+
+def load_resource_classes(config: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """resource_classes 設定を正規化する
+
+    未設定の場合は全 tool_type を1クラス（max_concurrent_runs スロット）で扱う。
+    例: {"gui": {"slots": 1, "tool_types": ["excel", ...]},
+         "cpu": {"slots": 4, "tool_types": ["python_runner", "bat"]}}
+    """
+    raw = config.get("resource_classes")
+    if not raw:
+        return {
+            "default": {
+                "slots": max(1, int(config.get("max_concurrent_runs", 1))),
+                "tool_types": list(ALL_TOOL_TYPES),
+            }
+        }
+    classes: dict[str, dict[str, Any]] = {}
+    for name, spec in raw.items():
+        classes[name] = {
+            "slots": max(0, int(spec.get("slots", 1))),
+            "tool_types": list(spec.get("tool_types", [])),
+        }
+    return classes
+
+
+def resource_class_for(tool_type: str, classes: dict[str, dict[str, Any]]) -> Optional[str]:
+    """tool_type が属するリソースクラス名（未定義なら None）"""
+    for name, spec in classes.items():
+        if tool_type in spec["tool_types"]:
+            return name
+    return None
+
+
+def active_run_count(resource_class: Optional[str] = None) -> int:
+    """実行中の run 数（= 使用中スロット数）。クラス指定時はそのクラスのみ"""
+    with _active_runs_lock:
+        if resource_class is None:
+            return len(_active_runs)
+        return sum(1 for a in _active_runs.values() if a.resource_class == resource_class)
+
+
+def claimable_tool_types(classes: dict[str, dict[str, Any]]) -> list[str]:
+    """空きスロットのあるクラスに属する tool_type 一覧（今すぐ開始できるもの）"""
+    types: list[str] = []
+    for name, spec in classes.items():
+        if active_run_count(name) < spec["slots"]:
+            types.extend(spec["tool_types"])
+    return types
+
+
+def is_cancel_requested(run_id: Optional[str]) -> bool:
+    """run にキャンセル要求が届いているか"""
+    return cancel_reason(run_id) is not None
+
+
+def cancel_reason(run_id: Optional[str]) -> Optional[str]:
+    """キャンセル要求が届いていれば報告するエラーメッセージ（なければ None）"""
+    with _active_runs_lock:
+        active = _active_runs.get(run_id or "")
+    return active.cancel_reason if active is not None and active.cancel_requested.is_set() else None
+
+
+def attach_run_process(
+    run_id: Optional[str], process: ProcessTree, config: dict[str, Any]
+) -> None:
+    """run に実行中プロセスを紐付ける（キャンセル時のツリー終了対象）"""
+    with _active_runs_lock:
+        active = _active_runs.get(run_id or "")
+        if active is None:
+            return
+        active.process = process
+        cancelled = active.cancel_requested.is_set()
+    # 起動直前にキャンセルが届いていた場合は即座に終了
+    if cancelled:
+        process.terminate_tree(config.get("terminate_grace_sec", 10))
+
+
+def spawn_for_run(
+    task: dict[str, Any],
     config: dict[str, Any],
-    run_id: str,
-    status: str,
-    summary: Optional[str] = None,
-    error_message: Optional[str] = None,
-    log_path: Optional[str] = None,
-    log_url: Optional[str] = None,
-) -> bool:
-    """実行結果を報告"""
-    url = f"{config['portal_url']}/api/runner/report"
-    headers = {
-        "X-Machine-Key": config["machine_key"],
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "run_id": run_id,
-        "status": status,
-        "summary": summary,
-        "error_message": error_message,
-        "log_path": log_path,
-        "log_url": log_url,
-    }
+    cmd: list[str] | str,
+    cwd: Optional[str | Path] = None,
+    output: Optional[Path] = None,
+    **kwargs: Any,
+) -> ProcessTree:
+    """run 用のプロセスを起動し、キャンセル対象として登録する
+
+    output: 出力が追記されるログファイル（最初の出力までの時間をスパンに記録する）
+    """
+    spawn_started = time.time_ns()
+    if task.get("run_id"):
+        kwargs.setdefault("env", {**os.environ, METRICS_ENV: str(_metrics.open(task["run_id"]))})
+    process = ProcessTree.spawn(cmd, cwd=cwd, **kwargs)
+    spans = run_spans(task)
+    spans.add("spawn", spawn_started, **{"process.pid": process.pid})
+    if output is not None:
+        task["_output_offset"] = _file_size(output)  # 報告する出力の抜粋の開始位置
+        watch_first_output(spans, output, process)
+    _trace.record("spawn", task.get("run_id"))
+    _history.record(
+        task.get("run_id"),
+        started_at=process.started_at,
+        log_offset_start=_file_size(output),
+    )
+    attach_run_process(task.get("run_id"), process, config)
+    return process
+
+
+def cancel_run(run_id: str, config: dict[str, Any], reason: Optional[str] = None) -> None:
+    """ポータルからのキャンセル要求を処理する
+
+    実行中ならプロセスツリーを猶予付きで終了し、ワーカーが canceled を報告する。
+    このエージェントで実行中でない run（再起動前の取り残し等）は即 canceled を報告する。
+    reason: 報告するエラーメッセージ（エージェント自身が止める場合）
+    """
+    with _active_runs_lock:
+        active = _active_runs.get(run_id)
+        if active is not None:
+            if active.cancel_requested.is_set():
+                return  # 処理中
+            if reason:
+                active.cancel_reason = reason
+            active.cancel_requested.set()
+        process = active.process if active else None
+    _trace.record("cancel", run_id, active=active is not None)
+
+    if active is None:
+        log(f"Cancel requested for inactive run: {run_id} — reporting canceled")
+        report_result(config, run_id, "canceled", error_message="Canceled (run not active on runner)")
+        return
 
+    log(f"Cancel requested: {run_id}")
+    if process is not None:
+        # 猶予待ちでポーリングループを止めないよう別スレッドで終了させる
+        threading.Thread(
+            target=process.terminate_tree,
+            args=(config.get("terminate_grace_sec", 10),),
+            daemon=True,
+        ).start()
+
+
+# ---------------------------------------------------------------------------
+# バックグラウンド完了監視
+# 起動直後に success を返すタスク（ログなし BAT, EXE）の終了を1本のスレッドで
+# まとめて監視し、実際の終了コード・所要時間・リソース使用量を追加報告する
+# ---------------------------------------------------------------------------
+class ProcessWatcher:
+    """fire-and-forget プロセスの終了監視"""
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self._interval = interval
+        self._watched: dict[str, tuple[ProcessTree, dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, run_id: str, process: ProcessTree, config: dict[str, Any]) -> None:
+        with self._lock:
+            self._watched[run_id] = (process, config)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name="process-watcher", daemon=True
+                )
+                self._thread.start()
+        log(f"Watching background process: {run_id} (PID: {process.pid})")
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._watched)
+
+    def _loop(self) -> None:
+        while not _shutdown_event.is_set():
+            with self._lock:
+                items = list(self._watched.items())
+                if not items:
+                    self._thread = None
+                    return
+            for run_id, (process, config) in items:
+                max_sec = config.get("background_watch_max_sec", 86400)
+                code = process.poll()
+                if code is None:
+                    if time.time() - process.started_at > max_sec:
+                        log(f"Stop watching {run_id}: still running after {max_sec}s")
+                        with self._lock:
+                            self._watched.pop(run_id, None)
+                        _metrics.finish(run_id)
+                    continue
+                with self._lock:
+                    self._watched.pop(run_id, None)
+                # 再送で監視ループを止めないよう別スレッドで報告
+                threading.Thread(
+                    target=report_outcome,
+                    args=(config, run_id, code, process.resource_usage()),
+                    daemon=True,
+                ).start()
+            _shutdown_event.wait(self._interval)
+
+
+_process_watcher = ProcessWatcher()
+
+
+def _run_worker(active: ActiveRun, config: dict[str, Any]) -> None:
+    set_log_run_id(active.run_id)
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        if response.status_code == 200:
-            log(f"Result reported: {status}")
-            return True
-        else:
-            log(f"Report failed: {response.status_code} - {response.text}")
-            return False
-    except requests.RequestException as e:
-        log(f"Network error during report: {e}")
-        return False
+        # ユーザー環境変数（OneDrive 等）はパス展開・子プロセスに必要なので読み込みを待つ
+        if not _user_env_ready.wait(timeout=30):
+            log("Warning: User env vars still loading — running anyway")
+        process_task(active.task, config)
+    except Exception as e:
+        log(f"Error in run worker ({active.run_id}): {e}")
+    finally:
+        with _active_runs_lock:
+            _active_runs.pop(active.run_id, None)
+
+
+def start_run(
+    task: dict[str, Any],
+    config: dict[str, Any],
+    resource_class: Optional[str] = None,
+) -> None:
+    """タスクをワーカースレッドで開始し、スロットを確保する"""
+    active = ActiveRun(run_id=task["run_id"], task=task, resource_class=resource_class)
+    with _active_runs_lock:
+        _active_runs[active.run_id] = active
+    active.thread = threading.Thread(
+        target=_run_worker,
+        args=(active, config),
+        name=f"run-{active.run_id[:8]}",
+        daemon=True,
+    )
+    active.thread.start()
 
 
 def execute_python_runner(task: dict[str, Any], config: dict[str, Any], log_file: Optional[Path] = None) -> tuple[str, Optional[str], Optional[str]]:
@@ -232,6 +3184,8 @@ def execute_python_runner(task: dict[str, Any], config: dict[str, Any], log_file
     run_config = task.get("run_config") or {}
     script = run_config.get("script")
     args = run_config.get("args", [])
+    spans = run_spans(task)
+    resolve_started = time.time_ns()
 
     # target フィールドが設定されている場合
     if target:
@@ -248,8 +3202,11 @@ def execute_python_runner(task: dict[str, Any], config: dict[str, Any], log_file
                 return "failed", None, f"Project path not found: {project_path}"
 
             # 仮想環境のPythonを探す
+            venv_started = time.time_ns()
             venv_python = project_path / ".venv" / "Scripts" / "python.exe"
-            if venv_python.exists():
+            venv_found = venv_python.exists()
+            spans.add("detect_venv", venv_started, **{"venv.found": venv_found})
+            if venv_found:
                 python_exe = str(venv_python)
                 log(f"Using venv Python: {python_exe}")
             else:
@@ -280,7 +3237,10 @@ def execute_python_runner(task: dict[str, Any], config: dict[str, Any], log_file
             # プロジェクトルートは .venv の親ディレクトリ
             project_path = Path(parts[0]).parent
 
-            if not Path(venv_python_path).exists():
+            venv_started = time.time_ns()
+            venv_found = Path(venv_python_path).exists()
+            spans.add("detect_venv", venv_started, **{"venv.found": venv_found})
+            if not venv_found:
                 return "failed", None, f"Venv Python not found: {venv_python_path}"
 
             python_exe = venv_python_path
@@ -322,43 +3282,52 @@ def execute_python_runner(task: dict[str, Any], config: dict[str, Any], log_file
         log(f"Executing: {' '.join(cmd)}")
     else:
         return "failed", None, "Script path not configured (target or run_config.script)"
+    spans.add("resolve_target", resolve_started)
 
     try:
-        # ログファイルがある場合: コンソール表示 + ログ書き込み（Tee）
-        if log_file:
-            append_to_log(log_file, f"[Command] {' '.join(cmd)}\n")
-            append_to_log(log_file, f"[Working Directory] {cwd}\n\n")
-            append_to_log(log_file, "[Output]\n")
+        shards, parallel = fanout_shards(task, config)
+    except (TypeError, ValueError) as e:
+        return "failed", None, str(e)
+    if shards:
+        log(f"Fanout: {len(shards)} shards, {parallel} parallel")
+        display_name = f"{display_name} ({len(shards)} shards)"
 
-            # Python tee ラッパーで出力を画面とログの両方に表示
+    try:
+        # ログファイルがある場合・fanout: コンソール表示 + ログ書き込み（Tee）
+        if log_file or shards:
+            if log_file:
+                append_to_log(log_file, f"[Command] {' '.join(cmd)}\n")
+                append_to_log(log_file, f"[Working Directory] {cwd}\n")
+                if shards:
+                    append_to_log(log_file, f"[Fanout] {len(shards)} shards, {parallel} parallel\n")
+                append_to_log(log_file, "\n[Output]\n")
+
+            # Python tee ラッパーで出力を画面とログの両方に表示（fanout のシャードもこの下で起動する）
             tee_python = _get_console_python()
-            tee_code = _build_tee_script(cmd, str(cwd), str(log_file))
-            process = subprocess.Popen(
-                [tee_python, "-u", "-c", tee_code],
-                creationflags=subprocess.CREATE_NEW_CONSOLE,
+            tee_code = _build_tee_script(
+                cmd, str(cwd), str(log_file) if log_file else None, output_limits(task, config), shards, parallel
             )
+            process = spawn_for_run(task, config, [tee_python, "-u", "-c", tee_code], output=log_file)
 
             # プロセスの完了を待つ
-            timeout = config.get("execution_timeout", 3600)
+            timeout = run_timeout(task, config)
             returncode = process.wait(timeout=timeout)
         else:
             # 新しいコンソールウィンドウで実行（出力が見える）
-            process = subprocess.Popen(
-                cmd,
-                cwd=cwd,
-                creationflags=subprocess.CREATE_NEW_CONSOLE,
-            )
+            process = spawn_for_run(task, config, cmd, cwd=cwd)
 
             # プロセスの完了を待つ
-            timeout = config.get("execution_timeout", 3600)
+            timeout = run_timeout(task, config)
             returncode = process.wait(timeout=timeout)
 
         if returncode == 0:
             return "success", f"Python completed: {display_name}", None
+        elif shards:
+            return "failed", None, f"Exit code: {returncode} (failed shards are listed in the log)"
         else:
             return "failed", None, f"Exit code: {returncode}"
     except subprocess.TimeoutExpired:
-        process.kill()
+        process.terminate_tree(config.get("terminate_grace_sec", 10))
         return "failed", None, "Execution timed out"
     except Exception as e:
         return "failed", None, str(e)
@@ -503,30 +3472,162 @@ def _bring_to_front(hwnd: int) -> bool:
             pass
 
 
-def bring_window_to_front(pid: int, timeout: float = 10.0) -> bool:
-    """プロセスIDからウィンドウを探して最前面に表示"""
-    if not HAS_WIN32:
+# ---------------------------------------------------------------------------
+# ウィンドウ前面表示（非同期）
+# 起動直後に結果を報告できるよう、ウィンドウ検索と前面表示は専用スレッドで行う。
+# WinEvent フック（EVENT_OBJECT_SHOW / NAMECHANGE）で新しいウィンドウを即座に検知し、
+# 取りこぼしや既存ウィンドウは定期的な EnumWindows でも拾う。
+# ---------------------------------------------------------------------------
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_NAMECHANGE = 0x800C
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+OBJID_WINDOW = 0
+
+
+@dataclass
+class FocusRequest:
+    label: str
+    pid: Optional[int] = None
+    title_part: Optional[str] = None
+    requested_at: float = field(default_factory=time.time)
+    timeout: float = 10.0
+
+    def matches(self, hwnd: int) -> bool:
+        """トップレベルの可視ウィンドウがこの要求の対象か"""
+        try:
+            if not win32gui.IsWindowVisible(hwnd):
+                return False
+            if self.pid is not None:
+                if win32gui.GetWindow(hwnd, win32con.GW_OWNER):
+                    return False
+                _, p = win32process.GetWindowThreadProcessId(hwnd)
+                return p == self.pid
+            if self.title_part:
+                return self.title_part.lower() in win32gui.GetWindowText(hwnd).lower()
+        except Exception:
+            pass
         return False
 
-    end_time = time.time() + timeout
-    hwnd = None
 
-    while time.time() < end_time:
-        hwnd = _find_main_window(pid)
-        if hwnd:
-            break
-        time.sleep(0.1)
+class WindowFocuser:
+    """ウィンドウの出現を待って最前面に表示する（呼び出し元はブロックしない）"""
 
-    if not hwnd:
-        log("Window not found within timeout")
-        return False
+    def __init__(self, poll_interval: float = 0.25) -> None:
+        self._poll_interval = poll_interval
+        self._pending: list[FocusRequest] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
 
-    if _bring_to_front(hwnd):
-        log(f"Window brought to front (hwnd={hwnd})")
-        return True
-    else:
-        log("Failed to bring window to front")
-        return False
+    def request(self, req: FocusRequest) -> None:
+        if not HAS_WIN32:
+            return
+        with self._lock:
+            self._pending.append(req)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="window-focuser", daemon=True
+                )
+                self._thread.start()
+
+    def _handle_window(self, hwnd: int, source: str) -> None:
+        with self._lock:
+            matched = [r for r in self._pending if r.matches(hwnd)]
+            for r in matched:
+                self._pending.remove(r)
+        for r in matched:
+            elapsed = time.time() - r.requested_at
+            if _bring_to_front(hwnd):
+                log(f"[focus] {r.label}: window brought to front (hwnd={hwnd}, {elapsed:.2f}s, via {source})")
+            else:
+                log(f"[focus] {r.label}: failed to bring window to front (hwnd={hwnd})")
+
+    def _sweep(self) -> bool:
+        """既存ウィンドウを走査し、期限切れの要求を破棄する。要求が残っていれば True"""
+        with self._lock:
+            pending = list(self._pending)
+        for r in pending:
+            hwnd = _find_main_window(r.pid) if r.pid is not None else _find_window_by_title(r.title_part or "")
+            if hwnd:
+                self._handle_window(hwnd, "poll")
+        now = time.time()
+        with self._lock:
+            expired = [r for r in self._pending if now - r.requested_at > r.timeout]
+            for r in expired:
+                self._pending.remove(r)
+            remaining = bool(self._pending)
+        for r in expired:
+            log(f"[focus] {r.label}: window not found within {r.timeout:.0f}s")
+        return remaining
+
+    def _install_hook(self) -> tuple[Any, Any]:
+        """WinEvent フックを登録する（失敗時はポーリングのみで動作）"""
+        from ctypes import wintypes
+
+        proc_type = ctypes.WINFUNCTYPE(
+            None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+            wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD,
+        )
+
+        def callback(_hook: Any, _event: int, hwnd: int, id_object: int, id_child: int, _tid: int, _time: int) -> None:
+            if hwnd and id_object == OBJID_WINDOW and id_child == 0:
+                try:
+                    self._handle_window(hwnd, "hook")
+                except Exception as e:
+                    log(f"[focus] hook callback error: {e}")
+
+        proc = proc_type(callback)
+        user32 = ctypes.windll.user32
+        user32.SetWinEventHook.restype = wintypes.HANDLE
+        hook = user32.SetWinEventHook(
+            EVENT_OBJECT_SHOW, EVENT_OBJECT_NAMECHANGE, None, proc, 0, 0,
+            WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS,
+        )
+        if not hook:
+            raise OSError("SetWinEventHook failed")
+        return hook, proc  # proc はフック解除まで参照を保持する必要がある
+
+    def _run(self) -> None:
+        hook = proc = None
+        try:
+            hook, proc = self._install_hook()
+        except Exception as e:
+            log(f"[focus] WinEvent hook unavailable, polling only: {e}")
+
+        try:
+            while not _shutdown_event.is_set():
+                if not self._sweep():
+                    with self._lock:
+                        if not self._pending:
+                            self._thread = None
+                            return
+                if hook:
+                    # フックのコールバックはこのスレッドのメッセージループで配信される
+                    deadline = time.time() + self._poll_interval
+                    while time.time() < deadline:
+                        win32gui.PumpWaitingMessages()
+                        time.sleep(0.02)
+                else:
+                    time.sleep(self._poll_interval)
+        finally:
+            if hook:
+                ctypes.windll.user32.UnhookWinEvent(hook)
+            del proc
+
+
+_window_focuser = WindowFocuser()
+
+
+def request_window_focus(
+    label: str,
+    pid: Optional[int] = None,
+    title_part: Optional[str] = None,
+    timeout: float = 10.0,
+) -> None:
+    """ウィンドウの前面表示を依頼する（結果は [focus] ログに別途出力）"""
+    _window_focuser.request(
+        FocusRequest(label=label, pid=pid, title_part=title_part, timeout=timeout)
+    )
 
 
 def execute_exe(task: dict[str, Any], config: dict[str, Any]) -> tuple[str, Optional[str], Optional[str]]:
@@ -543,24 +3644,24 @@ def execute_exe(task: dict[str, Any], config: dict[str, Any]) -> tuple[str, Opti
     log(f"Executing EXE: {exe_path}")
 
     try:
-        # EXEはバックグラウンドで起動（結果追跡なし）
-        process = subprocess.Popen([str(exe_path)], cwd=exe_path.parent)
+        # EXEはバックグラウンドで起動（終了は ProcessWatcher が追跡）
+        process = spawn_for_run(
+            task, config, [str(exe_path)], cwd=exe_path.parent, new_console=False
+        )
 
-        # ウィンドウを最前面に表示
-        if HAS_WIN32:
-            bring_window_to_front(process.pid)
+        # ウィンドウを最前面に表示（非同期。結果は [focus] ログ）
+        request_window_focus(exe_path.name, pid=process.pid)
 
         return "success", "EXE launched", None
     except Exception as e:
         return "failed", None, str(e)
 
 
-def _find_window_by_title(title_part: str, timeout: float = 10.0) -> Optional[int]:
-    """ウィンドウタイトルの一部からウィンドウを検索"""
+def _find_window_by_title(title_part: str) -> Optional[int]:
+    """ウィンドウタイトルの一部から可視ウィンドウを1回だけ検索"""
     if not HAS_WIN32:
         return None
 
-    end_time = time.time() + timeout
     hwnd_found = None
 
     def enum_cb(hwnd: int, _: Any) -> bool:
@@ -575,17 +3676,42 @@ def _find_window_by_title(title_part: str, timeout: float = 10.0) -> Optional[in
                 pass
         return True
 
-    while time.time() < end_time:
-        hwnd_found = None
-        try:
-            win32gui.EnumWindows(enum_cb, None)
-        except Exception:
-            pass
-        if hwnd_found:
-            return hwnd_found
-        time.sleep(0.2)
+    try:
+        win32gui.EnumWindows(enum_cb, None)
+    except Exception:
+        pass
+    return hwnd_found
 
-    return None
+
+def execute_standin(task: dict[str, Any], config: dict[str, Any]) -> tuple[str, Optional[str], Optional[str]]:
+    """トレース再生用の代役実行（replay_standins 有効時のみ）
+
+    run_config.standin = {"duration_sec", "exit_code", "launch_only"} に従って
+    指定時間だけ sleep するプロセスを起動する。スロット・キャンセル・完了監視の
+    経路は実際の実行と同じものを通る。
+    """
+    spec = task["run_config"]["standin"]
+    duration = float(spec.get("duration_sec", 0))
+    exit_code = int(spec.get("exit_code", 0))
+    cmd = [sys.executable, "-c", f"import sys, time; time.sleep({duration}); sys.exit({exit_code})"]
+    process = spawn_for_run(task, config, cmd, new_console=False)
+    if spec.get("launch_only"):
+        return "success", "Standin launched", None
+    try:
+        returncode = process.wait(timeout=run_timeout(task, config))
+    except subprocess.TimeoutExpired:
+        process.terminate_tree(config.get("terminate_grace_sec", 10))
+        return "failed", None, "Execution timed out"
+    if returncode == 0:
+        return "success", "Standin completed", None
+    return "failed", None, f"Exit code: {returncode}"
+
+
+def _bat_command(bat_path: Path) -> list[str]:
+    """BAT 実行コマンド（Windows 以外ではベンチマーク用にシェルスクリプトとして実行）"""
+    if IS_WINDOWS:
+        return ["cmd", "/c", str(bat_path)]
+    return ["sh", str(bat_path)]
 
 
 def execute_bat(task: dict[str, Any], config: dict[str, Any], log_file: Optional[Path] = None) -> tuple[str, Optional[str], Optional[str]]:
@@ -607,21 +3733,18 @@ def execute_bat(task: dict[str, Any], config: dict[str, Any], log_file: Optional
     try:
         # ログファイルがある場合: コンソール表示 + ログ書き込み（Tee）
         if log_file:
-            append_to_log(log_file, f"[Command] cmd /c {bat_path}\n")
+            bat_cmd = _bat_command(bat_path)
+            append_to_log(log_file, f"[Command] {' '.join(bat_cmd)}\n")
             append_to_log(log_file, f"[Working Directory] {bat_path.parent}\n\n")
             append_to_log(log_file, "[Output]\n")
 
             # Python tee ラッパーで出力を画面とログの両方に表示
-            bat_cmd = ["cmd", "/c", str(bat_path)]
             tee_python = _get_console_python()
-            tee_code = _build_tee_script(bat_cmd, str(bat_path.parent), str(log_file))
-            process = subprocess.Popen(
-                [tee_python, "-u", "-c", tee_code],
-                creationflags=subprocess.CREATE_NEW_CONSOLE,
-            )
+            tee_code = _build_tee_script(bat_cmd, str(bat_path.parent), str(log_file), output_limits(task, config))
+            process = spawn_for_run(task, config, [tee_python, "-u", "-c", tee_code], output=log_file)
 
             # プロセスの完了を待つ
-            timeout = config.get("execution_timeout", 3600)
+            timeout = run_timeout(task, config)
             returncode = process.wait(timeout=timeout)
 
             if returncode == 0:
@@ -629,16 +3752,14 @@ def execute_bat(task: dict[str, Any], config: dict[str, Any], log_file: Optional
             else:
                 return "failed", None, f"Exit code: {returncode}"
         else:
-            # BATファイルを実行（実行後自動で閉じる）
-            process = subprocess.Popen(
-                ["cmd", "/c", str(bat_path)],
-                cwd=bat_path.parent,
-                creationflags=subprocess.CREATE_NEW_CONSOLE,
+            # BATファイルを実行（実行後自動で閉じる。終了は ProcessWatcher が追跡）
+            process = spawn_for_run(
+                task, config, _bat_command(bat_path), cwd=bat_path.parent
             )
 
             return "success", f"BAT executed: {bat_path.name}", None
     except subprocess.TimeoutExpired:
-        process.kill()
+        process.terminate_tree(config.get("terminate_grace_sec", 10))
         return "failed", None, "Execution timed out"
     except Exception as e:
         return "failed", None, str(e)
@@ -677,14 +3798,10 @@ def execute_file(task: dict[str, Any], config: dict[str, Any]) -> tuple[str, Opt
         # os.startfile で関連付けされたアプリで開く
         os.startfile(str(target_path))
 
-        # ウィンドウを最前面に表示
-        if HAS_WIN32:
-            # フォルダ名またはファイル名（拡張子なし）でウィンドウを検索
-            search_name = target_path.name if is_folder else target_path.stem
-            hwnd = _find_window_by_title(search_name, timeout=10.0)
-            if hwnd:
-                _bring_to_front(hwnd)
-                log(f"Window brought to front (hwnd={hwnd})")
+        # ウィンドウを最前面に表示（非同期。結果は [focus] ログ）
+        # フォルダ名またはファイル名（拡張子なし）でウィンドウを検索
+        search_name = target_path.name if is_folder else target_path.stem
+        request_window_focus(target_path.name, title_part=search_name)
 
         if is_folder:
             return "success", f"Folder opened: {target_path.name}", None
@@ -695,12 +3812,12 @@ def execute_file(task: dict[str, Any], config: dict[str, Any]) -> tuple[str, Opt
 
 
 def create_log_file(config: dict[str, Any], run_id: str, tool_name: str) -> Optional[Path]:
-    """ログファイルを作成し、メタデータを書き込む"""
+    """ログファイルを作成し、メタデータを書き込む（log_dir/YYYY-MM-DD/run-{id}.log）"""
     log_dir = config.get("log_dir")
     if not log_dir:
         return None
 
-    log_dir_path = Path(log_dir)
+    log_dir_path = run_log_dir(Path(log_dir), time.time())
     log_dir_path.mkdir(parents=True, exist_ok=True)
 
     log_file = log_dir_path / f"run-{run_id}.log"
@@ -742,37 +3859,58 @@ def process_task(task: dict[str, Any], config: dict[str, Any]) -> None:
     tool_type = task["tool_type"]
     tool_name = task.get("tool_name", "Unknown")
 
-    log(f"Processing task: {tool_name} (type: {tool_type}, run_id: {run_id})")
+    log(f"Processing task: {tool_name} (type: {tool_type}, run_id: {run_id}, priority: {task.get('priority', 0)})")
+    estimate = task.get("_estimate")
+    if estimate is not None:
+        log(
+            f"Estimate: p50 {estimate['p50_ms'] / 1000:.0f}s / p99 {estimate['p99_ms'] / 1000:.0f}s "
+            f"({estimate['runs']} runs), timeout {run_timeout(task, config):.0f}s"
+        )
 
     # ログファイルを作成
     log_file = create_log_file(config, run_id, tool_name)
     log_path: Optional[str] = str(log_file) if log_file else None
+    task["_log_file"] = log_file  # ログ配信が実行中の run のログを探す
 
     status = "failed"
     summary: Optional[str] = None
     error: Optional[str] = None
+    _trace.record("start", run_id)
+    task_started = time.time()
+    _history.record(run_id, started_at=task_started, log_path=log_path)
 
     try:
         # ツールタイプに応じた実行
-        if tool_type == "python_runner":
-            status, summary, error = execute_python_runner(task, config, log_file)
+        if config.get("replay_standins") and (task.get("run_config") or {}).get("standin"):
+            status, summary, error = execute_standin(task, config)
+        elif tool_type == "python_runner":
+            status, summary, error = execute_cached(task, config, log_file, execute_python_runner)
         elif tool_type == "pad":
             status, summary, error = execute_pad(task, config)
             if status == "running":
                 # PADはコールバック待ちのため、ここでは報告しない
                 log("PAD flow started, waiting for callback...")
+                run_spans(task).finish("running", **{"tool.type": tool_type, "run.awaiting_callback": True})
                 return
         elif tool_type == "exe":
             status, summary, error = execute_exe(task, config)
         elif tool_type in ("excel", "sheet", "folder", "bi"):
             status, summary, error = execute_file(task, config)
         elif tool_type == "bat":
-            status, summary, error = execute_bat(task, config, log_file)
+            status, summary, error = execute_cached(task, config, log_file, execute_bat)
         else:
             error = f"Unsupported tool type: {tool_type}"
     except Exception as e:
         error = f"Unexpected error in process_task: {e}"
         log(f"ERROR: {error}")
+    _trace.record("executed", run_id, status=status)
+    excerpt = output_excerpt(log_file, task.get("_output_offset"), output_limits(task, config))
+
+    # ポータルからのキャンセル（またはドレインの打ち切り）で終了した場合は canceled として報告
+    reason = cancel_reason(run_id)
+    if reason is not None:
+        status, summary, error = "canceled", None, reason
+        log(f"Run canceled: {run_id}")
 
     # エラーメッセージをログファイルにも記録（デバッグ用）
     if error:
@@ -780,11 +3918,57 @@ def process_task(task: dict[str, Any], config: dict[str, Any]) -> None:
     if summary:
         append_to_log(log_file, f"\n[Summary] {summary}\n")
 
+    # 起動からプロセス終了まで（起動のみのタスクは起動直後に返るため記録しない）
+    spans = run_spans(task)
+    with _active_runs_lock:
+        active = _active_runs.get(run_id)
+        process = active.process if active else None
+    if process is not None and process.finished_at is not None:
+        spans.add(
+            "process",
+            _ns(process.started_at),
+            _ns(process.finished_at),
+            **{"process.exit_code": process.poll()},
+        )
+
+    # 実行履歴（起動のみで返ったプロセスの終了結果は report_outcome で上書きする）
+    exit_code = process.poll() if process is not None else None
+    history = dict(status=status, exit_code=exit_code, error=error, log_offset_end=_file_size(log_file))
+    if process is None or exit_code is not None:
+        finished_at = process.finished_at if process is not None and process.finished_at else time.time()
+        started_at = process.started_at if process is not None else task_started
+        history.update(finished_at=finished_at, duration_ms=int((finished_at - started_at) * 1000))
+        if process is not None:
+            history.update(_usage_columns(process.resource_usage()))
+        if status == "success" and not task.get("_cached"):  # キャッシュからの復元は所要時間に含めない
+            _durations.add(tool_name, history["duration_ms"])
+    _history.record(run_id, **history)
+
     # ログファイルを終了（try/finally で必ず実行）
+    phase_started = time.time_ns()
     finalize_log(log_file, status)
+    if log_file:
+        spans.add("finalize_log", phase_started)
+    _log_indexer.add(log_file)
 
     # 結果を報告
-    report_result(config, run_id, status, summary, error, log_path=log_path)
+    phase_started = time.time_ns()
+    # 起動のみで返ったプロセスのメトリクスは report_outcome で送る
+    if process is None or process.poll() is not None:
+        metrics = _metrics.finish(run_id)
+    else:
+        metrics = None
+        _metrics.stop_updates(run_id)
+    reported = report_result(
+        config, run_id, status, summary, error, log_path=log_path, output_excerpt=excerpt, metrics=metrics,
+        on_delivered=lambda: _history.record(run_id, reported_at=time.time()),
+    )
+    spans.add("report", phase_started, kind=SPAN_KIND_CLIENT, error=None if reported else "report not delivered")
+    spans.finish(status, **{"tool.type": tool_type, "tool.name": tool_name})
+
+    # 起動のみで返ったプロセスは終了を監視し、実際の結果を追加報告する
+    if status == "success" and process is not None and process.poll() is None:
+        _process_watcher.watch(run_id, process, config)
 
 
 # ---------------------------------------------------------------------------
@@ -918,21 +4102,204 @@ def _get_console_python() -> str:
     return sys.executable
 
 
-def _build_tee_script(cmd: list[str], cwd: str, log_path: str) -> str:
-    """コンソール表示 + ログ書き込みを行う Python ワンライナーを生成"""
+# 出力の上限（暴走した print ループでディスクを埋めない）
+# ログへは max_log_mb まで書き、それ以降は末尾 tail_kb だけをメモリのリングバッファに残して
+# 「何バイト捨てたか」と一緒に書き出す。末尾は出力が続く間も約1秒ごとにログの同じ位置へ書き直すので、
+# タイムアウト・キャンセルで tee ごと強制終了されても直前の末尾は残る。パイプはバイト単位のチャンクで読むので、
+# 改行のない巨大な1行でもメモリは増えない。報告にはログの先頭・末尾を抜粋して付ける。
+# run_config.fanout 指定時は同じ tee が N 個のシャードを並列数の上限付きで順に起動し、
+# 出力を "[shard i] " 付きの行にまとめ、終了コード・進捗（シャードの平均）を集計する。
+OUTPUT_LIMIT_DEFAULTS = {"max_log_mb": 200, "tail_kb": 256, "excerpt_head_kb": 2, "excerpt_tail_kb": 4}
+
+_TEE_SCRIPT = """\
+import codecs,collections,json,os,queue,re,signal,subprocess,sys,threading,time
+M=os.environ.get('TC_PORTAL_METRICS')
+PROGRESS=re.compile(r'^##tc-progress[ \\t]+([0-9]+(?:\\.[0-9]+)?)%?(?:[ \\t]+(.*?))?[ \\t]*\\r?$',re.M)
+f=open(LOG,'a',encoding='utf-8',newline='') if LOG else None
+written=dropped=ring_len=flushed=0;tail_at=None;flushed_at=0.0
+ring=collections.deque()
+q=queue.Queue()
+N=len(SHARDS)
+def report(record):
+    if M:
+        with open(M,'a',encoding='utf-8') as m:m.write(json.dumps(record)+'\\n')
+def reader(i,p,prefix):
+    dec=codecs.getincrementaldecoder('utf-8')('replace');tail=pending=''
+    while True:
+        b=p.stdout.read1(65536);t=dec.decode(b,not b);s=tail+t
+        if '##tc-progress' in s:
+            for v,msg in PROGRESS.findall(s if not b else s[:s.rfind('\\n')+1]):q.put(('progress',i,float(v),msg))
+        tail=s[s.rfind('\\n')+1:][-1024:]
+        if not prefix:
+            if t:q.put(('out',t))
+        else:
+            s=pending+t;cut=s.rfind('\\n')+1 if b else len(s)
+            if not cut and len(s)>=65536:cut=len(s)
+            if cut:
+                text=''.join(prefix+l for l in s[:cut].splitlines(True))
+                q.put(('out',text if text.endswith('\\n') else text+'\\n'))
+            pending=s[cut:]
+        if not b:break
+    q.put(('exit',i,p.wait()))
+def start(i):
+    p=subprocess.Popen(CMD,cwd=CWD,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,env=dict(os.environ,**SHARDS[i][1]))
+    threading.Thread(target=reader,args=(i,p,SHARDS[i][0]),daemon=True).start()
+def out(t):
+    global written,dropped,ring_len,tail_at
+    sys.stdout.write(t.replace('\\r\\n','\\n'));sys.stdout.flush()
+    if f is None:return
+    n=len(t.encode('utf-8'))
+    if written<MAX_BYTES:
+        written+=n;f.write(t);f.flush()
+        if written<MAX_BYTES:return
+        t='';n=0
+    if tail_at is None:
+        # 上限に達した時点（max_log_mb: 0 なら最初の出力）で印を書き、末尾はこの位置に書き直す
+        f.write('\\n[Output limit reached: %d bytes written; only the last %d bytes are kept from here]\\n'%(written,TAIL_BYTES))
+        f.flush();tail_at=f.tell()
+    if not t:return
+    dropped+=n;ring.append(t);ring_len+=len(t)
+    while ring and ring_len-len(ring[0])>=TAIL_BYTES:ring_len-=len(ring.popleft())
+def flush_tail():
+    # 末尾はログの同じ位置に書き直す（強制終了されても最後に書いた時点までは残る）
+    global flushed,flushed_at
+    if dropped==flushed:return
+    tail=''.join(ring)[-TAIL_BYTES:] if TAIL_BYTES else ''
+    kept=len(tail.encode('utf-8'))
+    f.truncate(tail_at)
+    f.write('\\n[Output truncated: %d bytes dropped; last %d bytes follow]\\n'%(dropped-kept,kept)+tail);f.flush()
+    flushed=dropped;flushed_at=time.monotonic()
+def stop(*_):raise SystemExit(143)
+for name in ('SIGTERM','SIGBREAK'):
+    if hasattr(signal,name):signal.signal(getattr(signal,name),stop)
+codes=[None]*N;shard_progress=[0.0]*N;started=done=0
+while started<min(PARALLEL,N):start(started);started+=1
+try:
+    while done<N:
+        try:kind,*a=q.get(timeout=1)
+        except queue.Empty:kind=None
+        if dropped>flushed and time.monotonic()-flushed_at>=1:flush_tail()
+        if kind is None:continue
+        if kind=='out':out(a[0])
+        elif kind=='progress':
+            i,v,msg=a;shard_progress[i]=v
+            if N==1:report({'progress':v,'message':msg})
+            else:report({'progress':round(sum(shard_progress)/N,1),'message':'%d/%d shards done'%(done,N)})
+        else:
+            i,code=a;codes[i]=code;done+=1;shard_progress[i]=100.0
+            if N>1:
+                out('[Fanout] shard %d exited with %d (%d/%d done)\\n'%(i,code,done,N))
+                report({'progress':round(sum(shard_progress)/N,1),'message':'%d/%d shards done'%(done,N)})
+                if started<N:start(started);started+=1
+    failed=[(i,c) for i,c in enumerate(codes) if c]
+    if N>1:
+        out('[Fanout] %d shards, %d failed%s\\n'%(N,len(failed),': '+', '.join('shard %d (exit %d)'%x for x in failed) if failed else ''))
+        if failed:report({'shards_failed':len(failed)})
+finally:
+    if dropped:flush_tail()
+    if f is not None:f.close()
+sys.exit(failed[0][1] if failed else 0)
+"""
+
+
+def output_limits(task: dict[str, Any], config: dict[str, Any]) -> dict[str, Any]:
+    """出力の上限（config の output_limits に run_config.output_limits を重ねる）"""
+    run_config = task.get("run_config") or {}
+    return {**OUTPUT_LIMIT_DEFAULTS, **(config.get("output_limits") or {}), **(run_config.get("output_limits") or {})}
+
+
+def _build_tee_script(
+    cmd: list[str],
+    cwd: str,
+    log_path: Optional[str],
+    limits: dict[str, Any],
+    shards: Optional[list[tuple[str, dict[str, str]]]] = None,
+    parallel: int = 1,
+) -> str:
+    """コンソール表示 + ログ書き込み（上限付き）を行う Python スクリプトを生成
+
+    shards: (行頭の接頭辞, 追加の環境変数) のリスト。未指定なら cmd を1つだけ起動する
+    """
+    return (
+        f"CMD={cmd!r}\nCWD={cwd!r}\nLOG={log_path!r}\n"
+        f"MAX_BYTES={int(limits['max_log_mb'] * 1024 * 1024)}\nTAIL_BYTES={max(0, int(limits['tail_kb'] * 1024))}\n"
+        f"SHARDS={shards or [('', {})]!r}\nPARALLEL={max(1, parallel)}\n"
+        + _TEE_SCRIPT
+    )
+
+
+def fanout_shards(task: dict[str, Any], config: dict[str, Any]) -> tuple[list[tuple[str, dict[str, str]]], int]:
+    """run_config.fanout からシャード（接頭辞, 環境変数）と同時実行数を決める
+
+    fanout: 8 / ["A", "B", ...] / {"count": 8} / {"keys": [...], "max_parallel": 4}
+    同時実行数は max_parallel と config の fanout_max_parallel（未設定なら CPU コア数）の小さい方。
+    """
+    fanout = (task.get("run_config") or {}).get("fanout")
+    if not fanout:
+        return [], 1
+    if not isinstance(fanout, dict):
+        fanout = {"keys": fanout} if isinstance(fanout, list) else {"count": fanout}
+    keys = fanout.get("keys")
+    count = len(keys) if keys is not None else int(fanout.get("count", 0))
+    if count < 1:
+        raise ValueError(f"Invalid fanout: {task['run_config']['fanout']!r}")
+    shards = []
+    for i in range(count):
+        env = {"TC_SHARD_INDEX": str(i), "TC_SHARD_COUNT": str(count)}
+        if keys is not None:
+            key = keys[i]
+            env["TC_SHARD_KEY"] = key if isinstance(key, str) else json.dumps(key, ensure_ascii=False)
+        shards.append((f"[shard {i}] ", env))
+    parallel = min(count, fanout.get("max_parallel") or count, config.get("fanout_max_parallel") or os.cpu_count() or 1)
+    return shards, parallel
+
+
+def output_excerpt(log_file: Optional[Path], start: Optional[int], limits: dict[str, Any]) -> Optional[str]:
+    """ログの出力部分（start 以降）の先頭・末尾の抜粋。全体が収まるならそのまま返す"""
+    if log_file is None or start is None:
+        return None
+    head_bytes = int(limits["excerpt_head_kb"] * 1024)
+    tail_bytes = int(limits["excerpt_tail_kb"] * 1024)
+    try:
+        with open(log_file, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            if end <= start:
+                return None
+            f.seek(start)
+            if end - start <= head_bytes + tail_bytes:
+                return f.read().decode("utf-8", "replace").strip("\n") or None
+            head = f.read(head_bytes)
+            f.seek(end - tail_bytes)
+            tail = f.read()
+    except OSError:
+        return None
+    # 行の途中で切らない（半分以上を失うほど行が長い場合はそのまま）
+    cut = head.rfind(b"\n")
+    if cut >= len(head) // 2:
+        head = head[:cut]
+    cut = tail.find(b"\n", 0, len(tail) - 1)
+    if 0 <= cut < len(tail) // 2:
+        tail = tail[cut + 1:]
+    omitted = end - start - len(head) - len(tail)
     return (
-        "import subprocess,sys\n"
-        f"p=subprocess.Popen({cmd!r},cwd={cwd!r},"
-        "stdout=subprocess.PIPE,stderr=subprocess.STDOUT,"
-        "text=True,encoding='utf-8',errors='replace')\n"
-        f"f=open({log_path!r},'a',encoding='utf-8')\n"
-        "for l in p.stdout:\n"
-        " sys.stdout.write(l);sys.stdout.flush();f.write(l)\n"
-        "f.close()\n"
-        "sys.exit(p.wait())\n"
+        head.decode("utf-8", "replace").rstrip("\n")
+        + f"\n… ({omitted} bytes omitted) …\n"
+        + tail.decode("utf-8", "replace").rstrip("\n")
     )
 
 
+def load_tray() -> bool:
+    """pystray / PIL を読み込む（未インストールなら False）"""
+    global pystray, Image, ImageDraw, HAS_TRAY
+    try:
+        import pystray
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return False
+    HAS_TRAY = True
+    return True
+
+
 def create_tray_icon(color: str = "green") -> "Image.Image":
     """システムトレイ用の円形アイコンを生成"""
     size = 64
@@ -964,6 +4331,10 @@ def hide_console_window() -> None:
 # ---------------------------------------------------------------------------
 _lincoln_process: Optional[subprocess.Popen] = None
 _lincoln_env: Optional[dict[str, str]] = None
+# Lincoln Supabase に届かない間はチェック間隔を伸ばす（ポーリングループを止めないため）
+_lincoln_failures = 0
+_lincoln_retry_at = 0.0
+LINCOLN_BACKOFF_MAX_SEC = 300
 
 
 def _load_lincoln_env(project_path: str) -> dict[str, str]:
@@ -983,8 +4354,8 @@ def _load_lincoln_env(project_path: str) -> dict[str, str]:
 
 def _register_lincoln_runner(
     supabase_url: str, supabase_key: str, machine_name: str
-) -> None:
-    """Lincoln Supabase の runners テーブルにマシンを登録/ハートビート"""
+) -> bool:
+    """Lincoln Supabase の runners テーブルにマシンを登録/ハートビート（到達できたか返す）"""
     url = f"{supabase_url}/rest/v1/runners"
     headers = {
         "apikey": supabase_key,
@@ -998,15 +4369,16 @@ def _register_lincoln_runner(
         "last_heartbeat": "now()",
     }
     try:
-        requests.post(url, headers=headers, json=payload, timeout=10)
+        resp = requests.post(url, headers=headers, json=payload, timeout=10)
+        return resp.status_code < 500
     except Exception:
-        pass
+        return False
 
 
 def _fetch_pending_lincoln_job(
     supabase_url: str, supabase_key: str, machine_name: str
-) -> Optional[dict[str, Any]]:
-    """Lincoln Supabase から自マシン宛の PENDING ジョブを1件取得"""
+) -> tuple[bool, Optional[dict[str, Any]]]:
+    """Lincoln Supabase から自マシン宛の PENDING ジョブを1件取得（到達できたか, ジョブ）"""
     url = f"{supabase_url}/rest/v1/jobs"
     headers = {
         "apikey": supabase_key,
@@ -1023,17 +4395,16 @@ def _fetch_pending_lincoln_job(
         resp = requests.get(url, headers=headers, params=params, timeout=10)
         if resp.ok:
             jobs = resp.json()
-            if jobs:
-                return jobs[0]
+            return True, jobs[0] if jobs else None
+        return resp.status_code < 500, None
     except Exception:
-        pass
-    return None
+        return False, None
 
 
 def _fetch_pending_lincoln_sync(
     supabase_url: str, supabase_key: str
-) -> bool:
-    """Lincoln Supabase に PENDING の calendar_sync_requests があるか確認"""
+) -> Optional[bool]:
+    """Lincoln Supabase に PENDING の calendar_sync_requests があるか確認（到達できなければ None）"""
     url = f"{supabase_url}/rest/v1/calendar_sync_requests"
     headers = {
         "apikey": supabase_key,
@@ -1048,9 +4419,27 @@ def _fetch_pending_lincoln_sync(
         resp = requests.get(url, headers=headers, params=params, timeout=10)
         if resp.ok:
             return len(resp.json()) > 0
+        return False if resp.status_code < 500 else None
     except Exception:
-        pass
-    return False
+        return None
+
+
+def _lincoln_reachable(reachable: bool) -> bool:
+    """チェック全体が Supabase に届いたかを記録し、届かなければ次のチェックまでバックオフする
+
+    失敗回数は最後のリクエストまで届いた時だけ戻す（登録だけ通って取得が止まる障害でも間隔を伸ばす）。
+    """
+    global _lincoln_failures, _lincoln_retry_at
+    if not reachable:
+        _lincoln_failures += 1
+        backoff = min(10 * 2 ** (_lincoln_failures - 1), LINCOLN_BACKOFF_MAX_SEC)
+        _lincoln_retry_at = time.time() + backoff
+        log(f"[lincoln] Supabase unreachable ({_lincoln_failures} in a row) — next check in {backoff}s")
+        return False
+    if _lincoln_failures:
+        log(f"[lincoln] Supabase reachable again after {_lincoln_failures} failure(s)")
+        _lincoln_failures = 0
+    return True
 
 
 def check_lincoln_jobs(config: dict[str, Any]) -> None:
@@ -1085,20 +4474,31 @@ def check_lincoln_jobs(config: dict[str, Any]) -> None:
             log("[lincoln] .env missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
             return
 
+    # Supabase 障害中はバックオフ（タイムアウト待ちでループを毎回止めない）
+    if time.time() < _lincoln_retry_at:
+        return
+
     # マシン名でハートビート登録 & ジョブ取得
+    # （登録の後に応答が止まった場合も、どのリクエストのタイムアウトでもバックオフに入る）
     machine_name = os.environ.get("COMPUTERNAME", "")
-    _register_lincoln_runner(
+    if not _register_lincoln_runner(
         _lincoln_env["SUPABASE_URL"],
         _lincoln_env["SUPABASE_SERVICE_ROLE_KEY"],
         machine_name,
-    )
+    ):
+        _lincoln_reachable(False)
+        return
 
     # 同期リクエストを先にチェック（軽量処理）
     has_sync = _fetch_pending_lincoln_sync(
         _lincoln_env["SUPABASE_URL"],
         _lincoln_env["SUPABASE_SERVICE_ROLE_KEY"],
     )
+    if has_sync is None:
+        _lincoln_reachable(False)
+        return
     if has_sync:
+        _lincoln_reachable(True)
         log("[lincoln] Found pending sync request — launching runner --sync")
         cmd = ["cmd", "/c", "npx", "tsx", "apps/runner/src/main.ts", "--sync"]
         try:
@@ -1114,12 +4514,12 @@ def check_lincoln_jobs(config: dict[str, Any]) -> None:
         return
 
     # 自マシン宛の PENDING ジョブを確認
-    job = _fetch_pending_lincoln_job(
+    reachable, job = _fetch_pending_lincoln_job(
         _lincoln_env["SUPABASE_URL"],
         _lincoln_env["SUPABASE_SERVICE_ROLE_KEY"],
         machine_name,
     )
-    if not job:
+    if not _lincoln_reachable(reachable) or not job:
         return
 
     # ジョブ発見 → Runner を起動
@@ -1168,14 +4568,296 @@ def graceful_shutdown(reason: str = "user request") -> None:
             pass
 
 
+# ---------------------------------------------------------------------------
+# ループ監視（ウォッチドッグ）
+# polling_loop が進捗を beat() で知らせ、別スレッドが途絶を検知したら
+# 全スレッドのスタックを diagnostics に書き出す（どこで止まっているかの特定用）。
+# stall_restart_sec 設定時は、それを超えたらエージェントを再起動する。
+# ---------------------------------------------------------------------------
+class StallWatchdog:
+    """ポーリングループの停止を検知してスタックダンプを残す"""
+
+    def __init__(self) -> None:
+        self._last_beat = time.monotonic()
+        self._phase = "starting"
+        self._dumped = False
+        self._thread: Optional[threading.Thread] = None
+        self.stall_count = 0
+
+    def beat(self, phase: str) -> None:
+        """ループの進捗を通知（属性の代入のみ）"""
+        self._last_beat = time.monotonic()
+        self._phase = phase
+
+    def start(self, config: dict[str, Any]) -> None:
+        dump_sec = config.get("stall_dump_sec", 120)
+        if not dump_sec:
+            log("Stall watchdog disabled")
+            return
+        restart_sec = config.get("stall_restart_sec", 0)
+        diag_dir = Path(config.get("diagnostics_dir") or Path(__file__).parent / "diagnostics")
+        self.beat("starting")
+        self._thread = threading.Thread(
+            target=self._loop,
+            args=(dump_sec, restart_sec, diag_dir),
+            name="stall-watchdog",
+            daemon=True,
+        )
+        self._thread.start()
+        log(f"Stall watchdog: dump after {dump_sec}s" + (f", restart after {restart_sec}s" if restart_sec else ""))
+
+    def _loop(self, dump_sec: float, restart_sec: float, diag_dir: Path) -> None:
+        check_interval = min(max(dump_sec / 4, 0.5), 10)
+        while not _shutdown_event.wait(check_interval):
+            phase = self._phase
+            stalled = time.monotonic() - self._last_beat
+            # 待機中（idle）は poll_interval だけ beat が来ないのが正常
+            if phase == "idle" or stalled < dump_sec:
+                self._dumped = False
+                continue
+            if not self._dumped:
+                self._dumped = True
+                self.stall_count += 1
+                self._dump(diag_dir, phase, stalled)
+            if restart_sec and stalled >= restart_sec:
+                restart_agent(f"polling loop stalled in '{phase}' for {stalled:.0f}s")
+
+    def _dump(self, diag_dir: Path, phase: str, stalled: float) -> None:
+        frames = sys._current_frames()
+        threads = {t.ident: t for t in threading.enumerate()}
+        lines = [
+            f"Polling loop stalled in '{phase}' for {stalled:.1f}s",
+            f"Time: {datetime.now().isoformat(timespec='seconds')}  PID: {os.getpid()}",
+            "",
+        ]
+        loop_top = None
+        for ident, frame in frames.items():
+            if ident == threading.get_ident():
+                continue
+            thread = threads.get(ident)
+            name = thread.name if thread else "unknown"
+            lines.append(f"--- Thread {name} ({ident}){' daemon' if thread and thread.daemon else ''} ---")
+            lines.extend(line.rstrip("\n") for line in traceback.format_stack(frame))
+            lines.append("")
+            if name == "polling-loop":
+                loop_top = f"{Path(frame.f_code.co_filename).name}:{frame.f_lineno} {frame.f_code.co_name}"
+
+        path = diag_dir / f"stall-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        try:
+            diag_dir.mkdir(parents=True, exist_ok=True)
+            path.write_text("\n".join(lines), encoding="utf-8")
+        except OSError as e:
+            log(f"Failed to write stall dump: {e}")
+            path = None
+        log(f"Warning: Polling loop stalled in '{phase}' for {stalled:.0f}s at {loop_top} — stacks: {path}")
+        _trace.record(
+            "stall_dump",
+            None,
+            phase=phase,
+            stalled_sec=round(stalled, 1),
+            loop_top=loop_top,
+            dump=path.name if path else None,
+            stall_count=self.stall_count,
+        )
+
+
+_watchdog = StallWatchdog()
+
+# supervisor.py 配下で起動された場合のドレイン要求ファイル（存在したら再起動の準備に入る。
+# 待ち時間の上限を過ぎると supervisor が中身を "abort" にし、実行中の run をキャンセルして報告する）
+SUPERVISOR_DRAIN_FILE = os.environ.get("TC_SUPERVISOR_DRAIN_FILE")
+DRAIN_ABORT_REASON = "Canceled: runner restarted by supervisor (drain timed out)"
+EXIT_RESTART = 75
+
+
+def _drain_abort_requested() -> bool:
+    try:
+        with open(SUPERVISOR_DRAIN_FILE or "", encoding="utf-8") as f:
+            return f.read().strip() == "abort"
+    except OSError:
+        return False
+
+
+def restart_agent(reason: str) -> None:
+    """同じ引数で新しいエージェントを起動し、このプロセスを即終了する
+
+    停止中のスレッドは join できないため os._exit で抜ける。実行中の run の子プロセスは残るが、
+    その結果は報告されない。supervisor.py 配下では終了コード 75 で抜け、親が起動し直す。
+    """
+    log(f"Restarting agent: {reason}")
+    _trace.record("restart", None, reason=reason)
+    _history.close()
+    if SUPERVISOR_DRAIN_FILE:
+        # supervisor.py 配下では再起動を親に任せる
+        os._exit(EXIT_RESTART)
+    if getattr(sys, "frozen", False):
+        cmd = [sys.executable, *sys.argv[1:]]
+    else:
+        cmd = [sys.executable, os.path.abspath(sys.argv[0]), *sys.argv[1:]]
+    kwargs: dict[str, Any] = {"close_fds": True}
+    if IS_WINDOWS:
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen(cmd, cwd=os.getcwd(), **kwargs)
+    except OSError as e:
+        log(f"Failed to restart agent: {e}")
+        return
+    os._exit(75)
+
+
+# ---------------------------------------------------------------------------
+# リモートプロファイル
+# ハートビートの command "profile" / "profile:<秒数>" で、全スレッドのスタックを
+# 一定間隔でサンプリングして collapsed stack（flamegraph.pl / speedscope 形式）に、
+# tracemalloc の割り当て上位をテキストに書き出す。出力先は log_dir（共有フォルダ）で、
+# パスは次のハートビートでポータルに通知する。
+# ---------------------------------------------------------------------------
+PROFILE_DEFAULT_SEC = 60
+PROFILE_MAX_SEC = 600
+
+
+def parse_profile_command(command: str) -> Optional[int]:
+    """"profile" / "profile:<秒数>" なら秒数を返す"""
+    name, _, arg = command.partition(":")
+    if name != "profile":
+        return None
+    try:
+        seconds = int(arg) if arg else PROFILE_DEFAULT_SEC
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SEC
+    return max(1, min(seconds, PROFILE_MAX_SEC))
+
+
+def _collapse_stack(thread_name: str, frame: Any) -> str:
+    """フレームを root;...;leaf 形式の1行にする"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name})")
+        frame = frame.f_back
+    names.append(f"thread:{thread_name}")
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """自プロセスのサンプリングプロファイラ（同時に1つだけ）"""
+
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.pending_path: Optional[str] = None  # ポータル未通知の出力先
+
+    def start(self, config: dict[str, Any], seconds: int) -> bool:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                log("Profile already running — ignored")
+                return False
+            self._thread = threading.Thread(
+                target=self._run, args=(config, seconds), name="profiler", daemon=True
+            )
+            self._thread.start()
+        log(f"Profiling agent for {seconds}s")
+        return True
+
+    def _run(self, config: dict[str, Any], seconds: int) -> None:
+        interval = config.get("profile_interval_ms", 10) / 1000
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(25)
+        me = threading.get_ident()
+        counts: dict[str, int] = {}
+        samples = 0
+        names: dict[int, str] = {}
+        names_at = 0.0
+        cpu_started = time.process_time()
+        started = time.monotonic()
+        deadline = started + seconds
+        try:
+            while time.monotonic() < deadline and not _shutdown_event.is_set():
+                frames = sys._current_frames()
+                now = time.monotonic()
+                if now - names_at >= 1 or not names.keys() >= frames.keys() - {me}:
+                    names = {t.ident: t.name for t in threading.enumerate() if t.ident}
+                    names_at = now
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    key = _collapse_stack(names.get(ident, str(ident)), frame)
+                    counts[key] = counts.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+            snapshot = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+        elapsed = time.monotonic() - started
+        cpu = time.process_time() - cpu_started
+
+        out_dir = Path(config.get("log_dir") or config.get("diagnostics_dir") or Path(__file__).parent / "diagnostics") / "profiles"
+        hostname = os.environ.get("COMPUTERNAME", "unknown")
+        base = out_dir / f"profile-{hostname}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        folded = base.with_suffix(".folded")
+        alloc = base.with_suffix(".alloc.txt")
+        stats = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics("lineno")
+        lines = [
+            f"Host: {hostname}  PID: {os.getpid()}",
+            f"Duration: {elapsed:.1f}s  Samples: {samples}  CPU: {cpu:.2f}s ({cpu / elapsed * 100 if elapsed else 0:.1f}%)",
+            f"Traced memory: {traced / 1024 / 1024:.1f} MiB (peak {peak / 1024 / 1024:.1f} MiB)"
+            + ("  ※プロファイル中の割り当てのみ" if started_tracing else ""),
+            "",
+            f"{'KiB':>10} {'count':>8}  location",
+        ]
+        for stat in stats[:30]:
+            where = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:>10.1f} {stat.count:>8}  {where.filename}:{where.lineno}")
+        try:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            folded.write_text(
+                "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items())),
+                encoding="utf-8",
+            )
+            alloc.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        except OSError as e:
+            log(f"Failed to write profile: {e}")
+            return
+        log(f"Profile written: {folded} ({samples} samples, CPU {cpu:.2f}s)")
+        _trace.record("profile", None, duration_sec=round(elapsed, 1), samples=samples, cpu_sec=round(cpu, 3))
+        self.pending_path = str(folded)
+
+
+_profiler = Profiler()
+
+
+def _record_loop_stall(config: dict[str, Any], started: float, phases: dict[str, float]) -> None:
+    """ループ1周の処理時間（待機を除く）が loop_stall_warn_sec を超えたら記録する"""
+    elapsed = time.time() - started
+    if elapsed < config.get("loop_stall_warn_sec", 5):
+        return
+    detail = ", ".join(f"{name} {sec:.1f}s" for name, sec in phases.items())
+    log(f"Warning: Polling loop stalled for {elapsed:.1f}s ({detail})")
+    _trace.record(
+        "loop_stall",
+        None,
+        duration_sec=round(elapsed, 3),
+        phases={name: round(sec, 3) for name, sec in phases.items()},
+    )
+
+
 def polling_loop(config: dict[str, Any]) -> None:
     """バックグラウンドポーリングループ"""
     poll_interval = config.get("poll_interval_sec", 10)
     heartbeat_interval = config.get("heartbeat_interval_sec", 30)
+    resource_classes = load_resource_classes(config)
 
     log(f"Portal URL: {config['portal_url']}")
     log(f"Poll interval: {poll_interval} seconds")
     log(f"Heartbeat interval: {heartbeat_interval} seconds")
+    for name, spec in resource_classes.items():
+        log(f"Resource class '{name}': {spec['slots']} slot(s) — {', '.join(spec['tool_types'])}")
+    log(f"Claim preferences: {get_claim_preferences(config) or 'none'}")
 
     # Lincoln Runner 統合
     lincoln_config = config.get("lincoln", {})
@@ -1186,70 +4868,259 @@ def polling_loop(config: dict[str, Any]) -> None:
         log("[lincoln] Lincoln Runner integration disabled")
 
     # 起動時にハートビートを送信（starting=True で古いコマンドを無視）
+    # 応答を待たずに claim を始める
     hostname = os.environ.get("COMPUTERNAME", "unknown")
     log(f"Hostname: {hostname}")
-    result = send_heartbeat(config, starting=True)
-    if result:
-        log("Initial heartbeat sent successfully")
-    else:
-        log("Warning: Initial heartbeat failed")
+
+    def initial_heartbeat() -> None:
+        if send_heartbeat(config, starting=True):
+            log("Initial heartbeat sent successfully")
+        else:
+            log("Warning: Initial heartbeat failed")
+        _startup.mark("initial_heartbeat")
+
+    threading.Thread(target=initial_heartbeat, name="initial-heartbeat", daemon=True).start()
 
     last_heartbeat = time.time()
+    draining = aborting = False
 
     while not _shutdown_event.is_set():
+        iteration_started = time.time()
+        phases: dict[str, float] = {}
         try:
             # 定期的にハートビートを送信
             now = time.time()
             if now - last_heartbeat >= heartbeat_interval:
+                _watchdog.beat("heartbeat")
                 hb_result = send_heartbeat(config)
                 # コマンドチェック
-                if isinstance(hb_result, dict) and hb_result.get("command") == "stop":
+                command = hb_result.get("command") if isinstance(hb_result, dict) else None
+                if command == "stop":
                     log("Received STOP command from portal")
                     graceful_shutdown("remote stop command")
                     return
+                if command:
+                    profile_sec = parse_profile_command(command)
+                    if profile_sec is not None:
+                        log(f"Received PROFILE command from portal ({profile_sec}s)")
+                        _profiler.start(config, profile_sec)
+                    else:
+                        log(f"Unknown command from portal: {command}")
+                # run 単位のキャンセル要求
+                if isinstance(hb_result, dict):
+                    for cancel_id in hb_result.get("cancel_run_ids") or []:
+                        cancel_run(cancel_id, config)
                 last_heartbeat = now
+                phases["heartbeat"] = time.time() - now
+
+            # supervisor からのドレイン要求: 新規の claim / Lincoln 起動を止め、
+            # 実行中の run と送信中の report が片付いたら終了する（ハートビートとキャンセルは継続）
+            if SUPERVISOR_DRAIN_FILE and not draining and os.path.exists(SUPERVISOR_DRAIN_FILE):
+                draining = True
+                log("[supervisor] Drain requested — waiting for active runs and reports")
+                _trace.record("drain", None, active_runs=active_run_count(), reports=reports_in_flight())
+            if draining:
+                if not aborting and _drain_abort_requested():
+                    aborting = True
+                    with _active_runs_lock:
+                        run_ids = list(_active_runs)
+                    log(f"[supervisor] Drain timed out — canceling {len(run_ids)} active run(s)")
+                    for run_id in run_ids:
+                        cancel_run(run_id, config, reason=DRAIN_ABORT_REASON)
+                if active_run_count() == 0 and reports_in_flight() == 0:
+                    graceful_shutdown("supervisor restart")
+                    return
+                _watchdog.beat("idle")
+                _shutdown_event.wait(poll_interval)
+                continue
+
+            # 空きスロットのある tool_type だけを要求（実行はワーカースレッド）
+            # 起動直後に溜まっている run を待たせないよう Lincoln より先に行う
+            phase_started = time.time()
+            while not _shutdown_event.is_set():
+                _watchdog.beat("claim")
+                tool_types = claimable_tool_types(resource_classes)
+                if not tool_types:
+                    break
+                task = claim_task(config, tool_types)
+                _startup.mark("first_claim_response")
+                if not task:
+                    break
+                _startup.mark("first_task_claimed")
+                resource_class = resource_class_for(task["tool_type"], resource_classes)
+                if resource_class is None or task["tool_type"] not in tool_types:
+                    # 古いポータルはフィルタを無視するため、claim 済みのものはそのまま実行する
+                    log(f"Warning: Claimed {task['tool_type']} without a free slot — running anyway")
+                start_run(task, config, resource_class)
+            phases["claim"] = time.time() - phase_started
+            _startup.report()
 
             # Lincoln ジョブ確認（PENDING があれば Runner 起動）
+            phase_started = time.time()
+            _watchdog.beat("lincoln")
             check_lincoln_jobs(config)
-
-            task = claim_task(config)
-            if task:
-                process_task(task, config)
+            phases["lincoln"] = time.time() - phase_started
         except Exception as e:
             log(f"Error in polling loop: {e}")
+        _record_loop_stall(config, iteration_started, phases)
 
         # shutdown_event.wait を使ってレスポンシブに待機
+        _watchdog.beat("idle")
         _shutdown_event.wait(poll_interval)
 
     log("Polling loop exited")
     stop_lincoln_runner()
 
 
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="TC Portal Runner Agent")
+    parser.add_argument("--config", help="設定ファイルのパス（省略時は config-{COMPUTERNAME}.json / config.json）")
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="起動から最初の claim までのフェーズ内訳を diagnostics/startup-*.json に書き出す",
+    )
+    sub = parser.add_subparsers(dest="command")
+    stats = sub.add_parser("stats", help="実行履歴から tool ごとの所要時間パーセンタイルと週ごとの失敗率を表示")
+    stats.add_argument("--weeks", type=int, default=8, help="集計する週数（既定 8）")
+    stats.add_argument("--tool", help="tool 名で絞り込む")
+    stats.add_argument("--db", help="実行履歴 DB のパス（省略時は設定の history_db）")
+    logs = sub.add_parser("logs", help="log_dir のラン ログを検索する").add_subparsers(dest="logs_command", required=True)
+    search = logs.add_parser("search", help="文字列を含む行を新しい run から表示（語単位で索引を引き、該当行を確認）")
+    search.add_argument("query", help="検索文字列（大文字小文字は区別しない）")
+    search.add_argument("--since", help="この日時以降に終了した run（YYYY-MM-DD または 'YYYY-MM-DD HH:MM'）")
+    search.add_argument("--until", help="この日時より前に開始した run")
+    search.add_argument("--tool", help="tool 名で絞り込む")
+    search.add_argument("--limit", type=int, default=50, help="表示する run 数の上限（既定 50）")
+    search.add_argument("--lines", type=int, default=5, help="run ごとに表示する行数（既定 5）")
+    index = logs.add_parser("index", help="索引を log_dir と同期する（エージェント停止中の取り込み用）")
+    index.add_argument("--rebuild", action="store_true", help="索引を作り直す")
+    prune = logs.add_parser("prune", help="log_retention の圧縮・削除を今すぐ1回実行する（enabled に関わらず）")
+    prune.add_argument("--dry-run", action="store_true", help="対象の件数だけ表示する")
+    return parser.parse_args(argv)
+
+
 def main() -> None:
     """エントリポイント: トレイアイコン + バックグラウンドポーリング"""
-    global _tray_icon
+    global _tray_icon, _agent_log_path, _log_format
+
+    args = parse_args()
+
+    if args.command == "stats":
+        db = Path(args.db) if args.db else history_db_path(load_config(args.config))
+        if db is None:
+            print("Run history is disabled (history_db: false)")
+            return
+        history_stats(db, weeks=args.weeks, tool=args.tool)
+        return
+    if args.command == "logs":
+        config = load_config(args.config)
+        index_path = log_index_path(config)
+        if args.logs_command == "prune":
+            if not config.get("log_dir"):
+                print("log_dir is not set")
+                return
+            # 実行中の run のログに触れないよう、エージェントが動いている間は実行しない（--dry-run は可）
+            if not args.dry_run and not lock_log_dir(Path(config["log_dir"])):
+                print("An agent is running on this log_dir — stop it first (log_retention.enabled runs the same pruning)")
+                return
+            conn = open_log_index(index_path) if index_path is not None and index_path.exists() else None
+            moves: dict[str, Optional[str]] = {}
+
+            def on_change(old: Path, new: Optional[Path]) -> None:
+                if conn is not None:
+                    with conn:
+                        move_indexed_log(conn, old, new)
+                run_id = log_run_id(old)
+                if run_id:
+                    moves[run_id] = str(new) if new else None
+
+            started = time.time()
+            result = prune_run_logs(
+                Path(config["log_dir"]), config.get("log_retention") or {}, set(), on_change, dry_run=args.dry_run
+            )
+            if conn is not None:
+                conn.close()
+            if not report_log_paths(config, moves):
+                print(f"Failed to update log_path on the portal for {len(moves)} run(s)")
+            print(
+                f"{'Would compress' if args.dry_run else 'Compressed'} {result['compressed']}, "
+                f"{'would delete' if args.dry_run else 'deleted'} {result['deleted']} "
+                f"({result['freed_bytes'] / 1024 / 1024:.1f}MB), {result['failed']} failed; "
+                f"{result['kept']} kept ({result['total_bytes'] / 1024 / 1024:.1f}MB) in {time.time() - started:.1f}s"
+            )
+            return
+        if index_path is None:
+            print("Log index is disabled (log_dir not set or log_index_db: false)")
+            return
+        if args.logs_command == "search":
+            search_logs(
+                index_path,
+                args.query,
+                since=_parse_local_date(args.since),
+                until=_parse_local_date(args.until),
+                tool=args.tool,
+                limit=args.limit,
+                max_lines=args.lines,
+            )
+        else:
+            if args.rebuild:
+                for suffix in ("", "-wal", "-shm"):
+                    Path(f"{index_path}{suffix}").unlink(missing_ok=True)
+            started = time.time()
+            conn = open_log_index(index_path)
+            added, removed = sync_log_index(conn, Path(config["log_dir"]))
+            conn.close()
+            print(f"Log index: {added} added, {removed} removed in {time.time() - started:.1f}s ({index_path})")
+        return
 
     log("TC Portal Runner Agent starting...")
 
     # タスクスケジューラ経由の場合、OneDrive等の環境変数をレジストリから補完
-    load_user_env_vars()
-
-    config = load_config()
+    # （レジストリの列挙は最初の claim と並行して行い、run の実行前に待ち合わせる）
+    threading.Thread(target=load_user_env_vars, name="user-env", daemon=True).start()
+
+    config = load_config(args.config)
+    if config.get("agent_log_path"):
+        _agent_log_path = Path(config["agent_log_path"])
+    _log_format = config.get("log_format", "text")
+    _trace.configure(config)
+    _span_exporter.configure(config)
+    _durations.min_runs = config.get("duration_model_min_runs", 20)
+    _history.configure(config)
+    _log_indexer.configure(config)
+    if config.get("log_dir") and not lock_log_dir(Path(config["log_dir"])):
+        log("Warning: Another agent holds the log_dir lock")
+    _log_server.start(config)
+    _log_retention.configure(config)
+    _metrics.configure(config)
+    _progress.start(config)
+    _result_cache.configure(config)
+    if args.startup_profile:
+        _startup.output_dir = Path(config.get("diagnostics_dir") or Path(__file__).parent / "diagnostics")
+    _startup.mark("config")
 
     log(f"Portal URL: {config['portal_url']}")
     log(f"Poll interval: {config.get('poll_interval_sec', 10)} seconds")
     log(f"Heartbeat interval: {config.get('heartbeat_interval_sec', 30)} seconds")
 
-    # コンソールウィンドウを非表示
-    hide_console_window()
-
     # ポーリングをバックグラウンドスレッドで開始
     poll_thread = threading.Thread(
         target=polling_loop,
         args=(config,),
+        name="polling-loop",
         daemon=True,
     )
     poll_thread.start()
+    _startup.mark("polling_started")
+    _watchdog.start(config)
+
+    # コンソールウィンドウを非表示
+    hide_console_window()
+
+    # トレイ（pystray / PIL）はポーリング開始後に読み込む
+    load_tray()
+    _startup.mark("tray_loaded")
 
     if HAS_TRAY:
         # システムトレイアイコンで起動（メインスレッド）
@@ -1287,6 +5158,8 @@ def main() -> None:
         except KeyboardInterrupt:
             graceful_shutdown("KeyboardInterrupt")
 
+    _history.close()
+    _log_indexer.close()
     log("TC Portal Runner Agent stopped.")
 
 
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Runner エージェントのエンドツーエンド スループット計測
+
+ローカルの fake_portal を起動してキューに合成タスクを積み、
+実際の agent.py をサブプロセスとして起動して処理させる。
+
+合成タスク（Linux ではそのまま普通のサブプロセスとして動く）:
+  - python_runner: task.py を実行（開始/終了時刻をマーカーファイルに追記）
+  - bat: 同等のシェルスクリプト（agent は Windows 以外では sh で実行する）
+
+出力:
+  - runs/min（エージェント起動〜最後の報告）
+  - claim → プロセス開始 の遅延（p50/p95/max）
+  - プロセス終了 → report 受信 の遅延（report lag）
+  - エージェント自身の CPU 時間 / run（Linux のみ /proc から取得）
+
+例:
+  python bench_throughput.py --runs 200 --mix python_runner=0.7,bat=0.3 --slots 4
+  python bench_throughput.py --runs 100 --min-runs-per-min 60 --max-claim-p95-ms 1500
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+from fake_portal import FakePortal  # noqa: E402
+
+AGENT_PATH = Path(__file__).resolve().parent.parent / "agent.py"
+
+TASK_SCRIPT = """\
+import sys, time
+run_id, marker, duration_ms, cpu_ms = sys.argv[1], sys.argv[2], float(sys.argv[3]), float(sys.argv[4])
+with open(marker, "a") as f:
+    f.write(f"{run_id} start {time.time()}\\n")
+end = time.perf_counter() + cpu_ms / 1000
+while time.perf_counter() < end:
+    pass
+time.sleep(duration_ms / 1000)
+with open(marker, "a") as f:
+    f.write(f"{run_id} end {time.time()}\\n")
+"""
+
+BAT_SCRIPT = """\
+echo "{run_id} start $(date +%s.%N)" >> "{marker}"
+sleep {duration_sec}
+echo "{run_id} end $(date +%s.%N)" >> "{marker}"
+"""
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values: list[float]) -> dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else None,
+    }
+
+
+def parse_mix(mix: str) -> list[tuple[str, float]]:
+    result = []
+    for part in mix.split(","):
+        tool_type, _, weight = part.partition("=")
+        result.append((tool_type.strip(), float(weight or 1)))
+    return result
+
+
+def read_proc_cpu_sec(pid: int) -> Optional[float]:
+    """Linux: /proc/<pid>/stat から utime+stime（秒）を読む"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        ticks = int(fields[11]) + int(fields[12])
+        return ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def read_markers(marker: Path) -> dict[str, dict[str, float]]:
+    result: dict[str, dict[str, float]] = {}
+    if not marker.exists():
+        return result
+    for line in marker.read_text().splitlines():
+        parts = line.split()
+        if len(parts) == 3:
+            result.setdefault(parts[0], {})[parts[1]] = float(parts[2])
+    return result
+
+
+def build_queue(portal: FakePortal, args: argparse.Namespace, work: Path, marker: Path) -> None:
+    task_py = work / "task.py"
+    task_py.write_text(TASK_SCRIPT)
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    for i in range(args.runs):
+        tool_type = rng.choices([m[0] for m in mix], weights=[m[1] for m in mix])[0]
+        run_id = f"bench-{i:05d}"
+        if tool_type == "bat":
+            script = work / f"{run_id}.bat"
+            script.write_text(BAT_SCRIPT.format(
+                run_id=run_id, marker=marker, duration_sec=args.duration_ms / 1000
+            ))
+            portal.enqueue("bat", str(script), run_id=run_id)
+        else:
+            portal.enqueue(
+                "python_runner",
+                str(task_py),
+                run_config={"args": [run_id, str(marker), str(args.duration_ms), str(args.cpu_ms)]},
+                run_id=run_id,
+            )
+
+
+def write_agent_config(args: argparse.Namespace, work: Path, portal_url: str, machine_key: str) -> Path:
+    config: dict[str, Any] = {
+        "portal_url": portal_url,
+        "machine_key": machine_key,
+        "poll_interval_sec": args.poll_interval,
+        "heartbeat_interval_sec": args.heartbeat_interval,
+        "execution_timeout": 600,
+        "python_exe": sys.executable,
+        "max_concurrent_runs": args.slots,
+        "agent_log_path": str(work / "agent.log"),
+        "history_db": str(work / "run_history.db"),
+    }
+    if not args.no_log_dir:
+        config["log_dir"] = str(work / "logs")
+        config["log_index_db"] = str(work / "log_index.db")
+    if args.resource_classes:
+        config["resource_classes"] = json.loads(args.resource_classes)
+    path = work / "config.json"
+    path.write_text(json.dumps(config, indent=2))
+    return path
+
+
+def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    work = Path(tempfile.mkdtemp(prefix="tc-runner-bench-"))
+    marker = work / "markers.txt"
+    portal = FakePortal(latency_ms=args.latency_ms)
+    portal_url = portal.start()
+    build_queue(portal, args, work, marker)
+    config_path = write_agent_config(args, work, portal_url, portal.machine_key)
+
+    agent_cmd = [sys.executable, str(AGENT_PATH), "--config", str(config_path)]
+    agent_started = time.time()
+    with open(work / "agent.stdout", "w") as out:
+        agent = subprocess.Popen(agent_cmd, stdout=out, stderr=subprocess.STDOUT)
+    try:
+        completed = portal.all_reported.wait(timeout=args.timeout)
+        agent_cpu = read_proc_cpu_sec(agent.pid)
+
+        # ハートビート経由の stop コマンドで停止（停止経路も計測対象）
+        portal.pending_command = "stop"
+        try:
+            agent.wait(timeout=args.heartbeat_interval * 2 + 10)
+        except subprocess.TimeoutExpired:
+            agent.terminate()
+            agent.wait(timeout=10)
+    finally:
+        if agent.poll() is None:
+            agent.kill()
+        portal.stop()
+
+    markers = read_markers(marker)
+    runs = list(portal.runs.values())
+    reported = [r for r in runs if r["reported_at"]]
+    claim_to_start = []
+    report_lag = []
+    for r in reported:
+        m = markers.get(r["run_id"], {})
+        if "start" in m and r["claimed_at"]:
+            claim_to_start.append((m["start"] - r["claimed_at"]) * 1000)
+        # 起動のみのタスクは followup 受信時刻で評価する
+        report_at = r["followup_at"] or r["reported_at"]
+        if "end" in m and report_at:
+            report_lag.append((report_at - m["end"]) * 1000)
+
+    last_report = max((r["followup_at"] or r["reported_at"] for r in reported), default=None)
+    first_claim = min((r["claimed_at"] for r in runs if r["claimed_at"]), default=None)
+    elapsed = (last_report - agent_started) if last_report else None
+    statuses: dict[str, int] = {}
+    for r in runs:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+
+    return {
+        "completed": completed,
+        "runs": len(runs),
+        "reported": len(reported),
+        "statuses": statuses,
+        "elapsed_sec": elapsed,
+        "runs_per_min": (len(reported) / elapsed * 60) if elapsed else None,
+        "time_to_first_claim_ms": ((first_claim - agent_started) * 1000) if first_claim else None,
+        "claim_to_start_ms": summarize(claim_to_start),
+        "report_lag_ms": summarize(report_lag),
+        "agent_cpu_sec": agent_cpu,
+        "agent_cpu_ms_per_run": (agent_cpu / len(reported) * 1000) if agent_cpu is not None and reported else None,
+        "requests": dict(portal.request_counts),
+        "work_dir": str(work),
+    }
+
+
+def fmt(value: Optional[float], unit: str = "") -> str:
+    return "-" if value is None else f"{value:,.1f}{unit}"
+
+
+def print_report(result: dict[str, Any]) -> None:
+    print("\n====== RUNNER THROUGHPUT ======")
+    print(f"Runs reported      : {result['reported']}/{result['runs']} {result['statuses']}")
+    print(f"Elapsed            : {fmt(result['elapsed_sec'], 's')}")
+    print(f"Runs / min         : {fmt(result['runs_per_min'])}")
+    print(f"Time to 1st claim  : {fmt(result['time_to_first_claim_ms'], 'ms')}")
+    for key, label in (("claim_to_start_ms", "Claim -> start"), ("report_lag_ms", "Exit -> report")):
+        s = result[key]
+        print(f"{label:<19}: p50 {fmt(s['p50'], 'ms')}  p95 {fmt(s['p95'], 'ms')}  max {fmt(s['max'], 'ms')}")
+    print(f"Agent CPU / run    : {fmt(result['agent_cpu_ms_per_run'], 'ms')}")
+    print(f"Requests           : {result['requests']}")
+    print(f"Work dir           : {result['work_dir']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runner end-to-end throughput benchmark")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--mix", default="python_runner=0.7,bat=0.3", help="tool_type=重み のカンマ区切り")
+    parser.add_argument("--duration-ms", type=float, default=200, help="各タスクの sleep 時間")
+    parser.add_argument("--cpu-ms", type=float, default=0, help="python_runner タスクのビジーループ時間")
+    parser.add_argument("--latency-ms", type=float, default=0, help="スタブの応答遅延")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--heartbeat-interval", type=float, default=5.0)
+    parser.add_argument("--slots", type=int, default=1, help="max_concurrent_runs")
+    parser.add_argument("--resource-classes", help="resource_classes 設定（JSON）")
+    parser.add_argument("--no-log-dir", action="store_true", help="log_dir なし（BAT は起動のみ + followup）")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    parser.add_argument("--min-runs-per-min", type=float, help="下回ったら exit 1")
+    parser.add_argument("--max-claim-p95-ms", type=float, help="claim→start p95 が超えたら exit 1")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+    failures = []
+    if not result["completed"]:
+        failures.append("not all runs were reported before timeout")
+    if args.min_runs_per_min is not None and (result["runs_per_min"] or 0) < args.min_runs_per_min:
+        failures.append(f"runs/min {fmt(result['runs_per_min'])} < {args.min_runs_per_min}")
+    p95 = result["claim_to_start_ms"]["p95"]
+    if args.max_claim_p95_ms is not None and (p95 is None or p95 > args.max_claim_p95_ms):
+        failures.append(f"claim->start p95 {fmt(p95)}ms > {args.max_claim_p95_ms}ms")
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
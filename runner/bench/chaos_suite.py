@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+Runner エージェントの障害注入シナリオ
+
+fake_portal の障害注入（inject）と実際の agent.py を使い、本番で実際に起きる障害から
+どれだけで復旧するかを計測・検証する。シナリオごとに agent を起動し直す。
+
+計測:
+  - recovery: 障害解除 〜 最初の正常応答（対象エンドポイント）
+  - lost: claim されたのに report が届かなかった run 数（常に 0 であること）
+  - loop stall: polling_loop 1周の処理時間の最大（trace の loop_stall、内訳 heartbeat / lincoln / claim）
+  - report: report_result が届くまでにかかった最大時間（再送を含む）
+
+シナリオ:
+  portal_5xx      Runner API が 503 を返し続ける
+  portal_hang     Runner API の応答が 30 秒保留される（ゲートウェイタイムアウト）
+  report_reset    report の処理後、応答前に接続がリセットされる
+  slow_dns        名前解決が毎回遅い（agent プロセス内の getaddrinfo を遅延）
+  lincoln_down    Lincoln Supabase が 503
+  lincoln_hang    Lincoln Supabase の応答が保留される
+  ignore_sigterm  キャンセルされた子プロセスが SIGTERM を無視する（POSIX のみ）
+
+例:
+  python chaos_suite.py
+  python chaos_suite.py --only portal_5xx,report_reset --json chaos.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+from fake_portal import FakePortal  # noqa: E402
+
+AGENT_PATH = Path(__file__).resolve().parent.parent / "agent.py"
+
+RUNNER_API = ("/api/runner/",)
+LINCOLN_API = ("/rest/v1/",)
+
+# agent の設定（障害の影響が短時間で見えるよう間隔を詰める）
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 2.0
+TERMINATE_GRACE = 2.0
+
+TASK_SCRIPT = """\
+import sys, time
+time.sleep(float(sys.argv[1]))
+"""
+
+STUBBORN_SCRIPT = """\
+import os, signal, sys, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+with open(sys.argv[1], "w") as f:
+    f.write(str(os.getpid()))
+time.sleep(120)
+"""
+
+# agent プロセス内で名前解決を遅らせる（遅延秒数はファイルで切り替え）
+SITECUSTOMIZE = """\
+import os, socket, time
+_delay_file = os.environ.get("TC_CHAOS_DNS_DELAY_FILE")
+if _delay_file:
+    _getaddrinfo = socket.getaddrinfo
+
+    def _slow_getaddrinfo(*args, **kwargs):
+        try:
+            with open(_delay_file) as f:
+                delay = float(f.read() or 0)
+        except (OSError, ValueError):
+            delay = 0.0
+        if delay:
+            time.sleep(delay)
+        return _getaddrinfo(*args, **kwargs)
+
+    socket.getaddrinfo = _slow_getaddrinfo
+"""
+
+
+class Harness:
+    """fake_portal + agent.py 1セット（シナリオごとに作り直す）"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.work = Path(tempfile.mkdtemp(prefix=f"tc-runner-chaos-{name}-"))
+        self.portal = FakePortal()
+        self.url = self.portal.start().replace("127.0.0.1", "localhost")
+        self.dns_delay_file = self.work / "dns_delay"
+        self.dns_delay_file.write_text("0")
+        self.trace_path = self.work / "trace.jsonl"
+        self.task_py = self.work / "task.py"
+        self.task_py.write_text(TASK_SCRIPT)
+        self.agent: Optional[subprocess.Popen] = None
+        self._feeding = threading.Event()
+        self._feeder: Optional[threading.Thread] = None
+        self._seq = 0
+
+    def start_agent(self) -> None:
+        lincoln_dir = self.work / "lincoln"
+        lincoln_dir.mkdir()
+        (lincoln_dir / ".env").write_text(
+            f"SUPABASE_URL={self.url}\nSUPABASE_SERVICE_ROLE_KEY=chaos-service-key\n"
+        )
+        (self.work / "sitecustomize.py").write_text(SITECUSTOMIZE)
+        config = {
+            "portal_url": self.url,
+            "machine_key": self.portal.machine_key,
+            "poll_interval_sec": POLL_INTERVAL,
+            "heartbeat_interval_sec": HEARTBEAT_INTERVAL,
+            "python_exe": sys.executable,
+            "max_concurrent_runs": 2,
+            "terminate_grace_sec": TERMINATE_GRACE,
+            "report_retry_sec": 300,
+            "loop_stall_warn_sec": 0.5,
+            "agent_log_path": str(self.work / "agent.log"),
+            "history_db": str(self.work / "run_history.db"),
+            "trace_path": str(self.trace_path),
+            "lincoln": {"enabled": True, "project_path": str(lincoln_dir)},
+        }
+        config_path = self.work / "config.json"
+        config_path.write_text(json.dumps(config, indent=2))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = str(self.work) + os.pathsep + env.get("PYTHONPATH", "")
+        env["TC_CHAOS_DNS_DELAY_FILE"] = str(self.dns_delay_file)
+        env["COMPUTERNAME"] = "chaos"
+        with open(self.work / "agent.stdout", "w") as out:
+            self.agent = subprocess.Popen(
+                [sys.executable, str(AGENT_PATH), "--config", str(config_path)],
+                stdout=out,
+                stderr=subprocess.STDOUT,
+                env=env,
+            )
+        self.wait_for(lambda: self._ok_since(0, "/api/runner/heartbeat") is not None, 20)
+
+    # -- 負荷 ---------------------------------------------------------------
+    def enqueue_task(self, duration_sec: float = 0.3) -> str:
+        self._seq += 1
+        return self.portal.enqueue(
+            "python_runner",
+            str(self.task_py),
+            run_config={"args": [str(duration_sec)]},
+            run_id=f"{self.name}-{self._seq:04d}",
+        )
+
+    def start_feeding(self, interval: float = 0.5) -> None:
+        """一定間隔で短いタスクを投入し続ける（障害中も report が発生するように）"""
+        self._feeding.set()
+
+        def loop() -> None:
+            while self._feeding.is_set():
+                self.enqueue_task()
+                time.sleep(interval)
+
+        self._feeder = threading.Thread(target=loop, daemon=True)
+        self._feeder.start()
+
+    def stop_feeding(self) -> None:
+        self._feeding.clear()
+        if self._feeder:
+            self._feeder.join()
+
+    # -- 計測 ---------------------------------------------------------------
+    def wait_for(self, condition: Callable[[], bool], timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if condition():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _ok_since(self, since: float, prefix: str) -> Optional[float]:
+        with self.portal.lock:
+            for ts, path, status in self.portal.request_log:
+                if ts >= since and path.startswith(prefix) and status is not None and status < 500:
+                    return ts
+        return None
+
+    def recovery_sec(self, fault_end: float, prefix: str) -> Optional[float]:
+        ts = self._ok_since(fault_end, prefix)
+        return None if ts is None else ts - fault_end
+
+    def drain(self, timeout: float = 120) -> None:
+        self.wait_for(lambda: self.portal.outstanding() == 0, timeout)
+
+    def lost_results(self) -> int:
+        with self.portal.lock:
+            return sum(1 for r in self.portal.runs.values() if r["claimed_at"] and r["reported_at"] is None)
+
+    def claims_between(self, start: float, end: float) -> int:
+        with self.portal.lock:
+            return sum(1 for r in self.portal.runs.values() if r["claimed_at"] and start <= r["claimed_at"] <= end)
+
+    def trace_events(self) -> list[dict[str, Any]]:
+        if not self.trace_path.exists():
+            return []
+        return [json.loads(line) for line in self.trace_path.read_text().splitlines() if line.strip()]
+
+    def loop_stalls(self, since: float) -> dict[str, Any]:
+        stalls = [e for e in self.trace_events() if e["event"] == "loop_stall" and e["ts"] >= since]
+        phase_max: dict[str, float] = {}
+        for e in stalls:
+            for phase, sec in e["phases"].items():
+                phase_max[phase] = max(phase_max.get(phase, 0.0), sec)
+        return {
+            "max_sec": max((e["duration_sec"] for e in stalls), default=0.0),
+            "count": len(stalls),
+            "phase_max_sec": phase_max,
+        }
+
+    def report_max_sec(self, since: float) -> float:
+        """run ごとの report_result 所要時間（最初の送信開始〜最後の試行終了）の最大"""
+        spans: dict[str, list[float]] = {}
+        for e in self.trace_events():
+            if e["event"] == "report" and e["ts"] >= since:
+                start = e["ts"] - e.get("latency_ms", 0) / 1000
+                span = spans.setdefault(e["run_id"], [start, e["ts"]])
+                span[0] = min(span[0], start)
+                span[1] = max(span[1], e["ts"])
+        return max((end - start for start, end in spans.values()), default=0.0)
+
+    def close(self) -> None:
+        self.stop_feeding()
+        self.portal.clear_faults()
+        self.dns_delay_file.write_text("0")
+        if self.agent and self.agent.poll() is None:
+            self.portal.pending_command = "stop"
+            try:
+                self.agent.wait(timeout=HEARTBEAT_INTERVAL * 2 + 40)
+            except subprocess.TimeoutExpired:
+                self.agent.kill()
+        self.portal.stop()
+
+
+# ---------------------------------------------------------------------------
+# シナリオ
+# 各シナリオは計測値と、満たすべき上限（checks: 名前 → (値, 上限)）を返す
+# ---------------------------------------------------------------------------
+def _fault_window(h: Harness, duration: float, inject: Callable[[], None], clear: Callable[[], None]) -> tuple[float, float]:
+    h.start_feeding()
+    time.sleep(2)
+    fault_start = time.time()
+    inject()
+    time.sleep(duration)
+    clear()
+    fault_end = time.time()
+    time.sleep(3)
+    h.stop_feeding()
+    h.drain()
+    return fault_start, fault_end
+
+
+def scenario_portal_5xx(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    start, end = _fault_window(
+        h, args.fault_sec,
+        lambda: h.portal.inject("error", RUNNER_API, status=503),
+        h.portal.clear_faults,
+    )
+    recovery = h.recovery_sec(end, "/api/runner/claim")
+    stalls = h.loop_stalls(start)
+    return {
+        "recovery_sec": recovery,
+        "lost": h.lost_results(),
+        "loop_stall": stalls,
+        "report_max_sec": h.report_max_sec(start),
+        "checks": {
+            "recovery_sec": (recovery, POLL_INTERVAL + HEARTBEAT_INTERVAL + 2),
+            "lost": (h.lost_results(), 0),
+            "loop_stall_sec": (stalls["max_sec"], 2.0),
+        },
+    }
+
+
+def scenario_portal_hang(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    start, end = _fault_window(
+        h, args.hang_sec + 5,
+        lambda: h.portal.inject("hang", RUNNER_API, hang_sec=args.hang_sec),
+        h.portal.clear_faults,
+    )
+    # 障害解除直前に送られたリクエストは最大 hang_sec 保留される
+    h.wait_for(lambda: h._ok_since(end, "/api/runner/claim") is not None, args.hang_sec + 30)
+    h.drain()
+    recovery = h.recovery_sec(end, "/api/runner/claim")
+    stalls = h.loop_stalls(start)
+    # heartbeat(10s) + claim(30s) のタイムアウトが上限
+    return {
+        "recovery_sec": recovery,
+        "lost": h.lost_results(),
+        "loop_stall": stalls,
+        "report_max_sec": h.report_max_sec(start),
+        "checks": {
+            "recovery_sec": (recovery, min(args.hang_sec, 40) + POLL_INTERVAL + 5),
+            "lost": (h.lost_results(), 0),
+            "loop_stall_sec": (stalls["max_sec"], 10 + 30 + 5),
+        },
+    }
+
+
+def scenario_report_reset(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    start, end = _fault_window(
+        h, args.fault_sec,
+        lambda: h.portal.inject("reset_after", ("/api/runner/report",)),
+        h.portal.clear_faults,
+    )
+    recovery = h.recovery_sec(end, "/api/runner/report")
+    stalls = h.loop_stalls(start)
+    return {
+        "recovery_sec": recovery,
+        "lost": h.lost_results(),
+        "loop_stall": stalls,
+        "report_max_sec": h.report_max_sec(start),
+        "checks": {
+            "lost": (h.lost_results(), 0),
+            "loop_stall_sec": (stalls["max_sec"], 2.0),
+            # 再送のバックオフ（1, 2, 4, 8...）で障害時間 + 1段分以内に届く
+            "report_max_sec": (h.report_max_sec(start), args.fault_sec * 2 + 5),
+        },
+    }
+
+
+def scenario_slow_dns(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    start, end = _fault_window(
+        h, args.fault_sec,
+        lambda: h.dns_delay_file.write_text(str(args.dns_delay_sec)),
+        lambda: h.dns_delay_file.write_text("0"),
+    )
+    recovery = h.recovery_sec(end, "/api/runner/claim")
+    stalls = h.loop_stalls(start)
+    # 1周あたり heartbeat + claim×2 + Lincoln 3 リクエスト分の名前解決
+    per_iteration = 6 * args.dns_delay_sec
+    return {
+        "recovery_sec": recovery,
+        "lost": h.lost_results(),
+        "loop_stall": stalls,
+        "report_max_sec": h.report_max_sec(start),
+        "checks": {
+            "recovery_sec": (recovery, per_iteration + POLL_INTERVAL + 2),
+            "lost": (h.lost_results(), 0),
+            "loop_stall_sec": (stalls["max_sec"], per_iteration + 2),
+        },
+    }
+
+
+def scenario_lincoln_down(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    start, end = _fault_window(
+        h, args.fault_sec * 2,
+        lambda: h.portal.inject("error", LINCOLN_API, status=503),
+        h.portal.clear_faults,
+    )
+    h.wait_for(lambda: h._ok_since(end, "/rest/v1/") is not None, 60)
+    stalls = h.loop_stalls(start)
+    claims = h.claims_between(start, end)
+    return {
+        "recovery_sec": h.recovery_sec(end, "/rest/v1/"),
+        "lost": h.lost_results(),
+        "loop_stall": stalls,
+        "claims_during_fault": claims,
+        "report_max_sec": h.report_max_sec(start),
+        "checks": {
+            "lost": (h.lost_results(), 0),
+            "loop_stall_sec": (stalls["max_sec"], 2.0),
+            # Lincoln 障害中も portal の run は処理され続ける
+            "claims_during_fault_min": (-claims, -1),
+            # バックオフ（10, 20, 40s）の1段分以内に再開
+            "recovery_sec": (h.recovery_sec(end, "/rest/v1/"), 45),
+        },
+    }
+
+
+def scenario_lincoln_hang(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    start, end = _fault_window(
+        h, args.fault_sec * 2,
+        lambda: h.portal.inject("hang", LINCOLN_API, hang_sec=args.hang_sec),
+        h.portal.clear_faults,
+    )
+    stalls = h.loop_stalls(start)
+    claims = h.claims_between(start, end)
+    lincoln_stalls = sum(
+        1 for e in h.trace_events()
+        if e["event"] == "loop_stall" and e["ts"] >= start and e["phases"].get("lincoln", 0) >= 5
+    )
+    return {
+        "lost": h.lost_results(),
+        "loop_stall": stalls,
+        "lincoln_stalls": lincoln_stalls,
+        "claims_during_fault": claims,
+        "report_max_sec": h.report_max_sec(start),
+        "checks": {
+            "lost": (h.lost_results(), 0),
+            # 1回のタイムアウト（10s）で打ち切り、以降はバックオフ中はスキップ
+            "loop_stall_sec": (stalls["max_sec"], 10 + 2),
+            "lincoln_stalls": (lincoln_stalls, 3),
+            "claims_during_fault_min": (-claims, -1),
+        },
+    }
+
+
+def scenario_ignore_sigterm(h: Harness, args: argparse.Namespace) -> dict[str, Any]:
+    if os.name == "nt":
+        return {"skipped": "POSIX only", "checks": {}}
+    script = h.work / "stubborn.py"
+    script.write_text(STUBBORN_SCRIPT)
+    pid_file = h.work / "stubborn.pid"
+    run_id = h.portal.enqueue("python_runner", str(script), run_config={"args": [str(pid_file)]}, run_id=f"{h.name}-stubborn")
+    h.wait_for(pid_file.exists, 20)
+    time.sleep(0.5)
+    requested = time.time()
+    h.portal.request_cancel(run_id)
+    h.wait_for(lambda: h.portal.runs[run_id]["reported_at"] is not None, TERMINATE_GRACE + HEARTBEAT_INTERVAL + 30)
+    reported_at = h.portal.runs[run_id]["reported_at"]
+    cancel_sec = (reported_at - requested) if reported_at else None
+    alive = False
+    if pid_file.exists():
+        try:
+            os.kill(int(pid_file.read_text()), 0)
+            alive = True
+        except (OSError, ValueError):
+            alive = False
+    status = h.portal.runs[run_id]["status"]
+    return {
+        "cancel_to_report_sec": cancel_sec,
+        "status": status,
+        "process_alive": alive,
+        "lost": h.lost_results(),
+        "checks": {
+            "cancel_to_report_sec": (cancel_sec, HEARTBEAT_INTERVAL + TERMINATE_GRACE + 3),
+            "lost": (h.lost_results(), 0),
+            "process_alive": (int(alive), 0),
+            "not_canceled": (int(status != "canceled"), 0),
+        },
+    }
+
+
+SCENARIOS: dict[str, Callable[[Harness, argparse.Namespace], dict[str, Any]]] = {
+    "portal_5xx": scenario_portal_5xx,
+    "portal_hang": scenario_portal_hang,
+    "report_reset": scenario_report_reset,
+    "slow_dns": scenario_slow_dns,
+    "lincoln_down": scenario_lincoln_down,
+    "lincoln_hang": scenario_lincoln_hang,
+    "ignore_sigterm": scenario_ignore_sigterm,
+}
+
+
+def evaluate(result: dict[str, Any]) -> list[str]:
+    failures = []
+    for name, (value, limit) in result.get("checks", {}).items():
+        if value is None or value > limit:
+            failures.append(f"{name}={value} (limit {limit})")
+    return failures
+
+
+def fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:,.1f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runner fault-injection scenario suite")
+    parser.add_argument("--only", help="実行するシナリオ（カンマ区切り）")
+    parser.add_argument("--fault-sec", type=float, default=10, help="障害の継続時間")
+    parser.add_argument("--hang-sec", type=float, default=30, help="応答保留の秒数")
+    parser.add_argument("--dns-delay-sec", type=float, default=2, help="名前解決1回あたりの遅延")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    results: dict[str, Any] = {}
+    failed = False
+    for name in names:
+        print(f"--- {name} ---", flush=True)
+        harness = Harness(name)
+        try:
+            harness.start_agent()
+            result = SCENARIOS[name](harness, args)
+        finally:
+            harness.close()
+        result["work_dir"] = str(harness.work)
+        result["failures"] = evaluate(result)
+        results[name] = result
+        failed = failed or bool(result["failures"])
+        stall = result.get("loop_stall", {})
+        if "cancel_to_report_sec" in result:
+            print(
+                f"cancel -> report {fmt(result['cancel_to_report_sec'])}s  status {result['status']}  "
+                f"process alive {result['process_alive']}  lost {result['lost']}"
+            )
+        elif "skipped" not in result:
+            print(
+                f"recovery {fmt(result.get('recovery_sec'))}s  lost {result.get('lost', '-')}  "
+                f"loop stall {fmt(stall.get('max_sec'))}s {stall.get('phase_max_sec', '')}  "
+                f"report {fmt(result.get('report_max_sec'))}s"
+            )
+        print("  PASS" if not result["failures"] else "  FAIL: " + "; ".join(result["failures"]), flush=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, default=str))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
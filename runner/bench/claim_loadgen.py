@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+claim_run() / Runner API の競合負荷ジェネレータ（asyncio）
+
+ローカルの PostgreSQL に supabase/migrations のスキーマを適用し、
+N 台の Runner を模した非同期タスクから /api/runner/* のルートと同じ
+クエリ列（マシン認証 → claim_run → run_token_hash 更新 → report）を発行する。
+
+計測:
+  - claim レイテンシ（ルート全体 / claim_run RPC 単体）の p50/p95/p99/max
+  - 二重 claim（同じ run_id を複数 Runner が取得）の検出 — 0 件でなければ exit 1
+  - ロック待ち（pg_stat_activity の wait_event_type = 'Lock' をサンプリング）
+  - DB の CPU 時間（DB がローカルの場合のみ /proc から取得）
+
+前提:
+  pip install asyncpg
+  空のデータベースを用意（--bootstrap で Supabase 互換の最小シムとマイグレーションを適用）
+
+例:
+  python claim_loadgen.py --dsn postgresql://postgres@localhost/loadtest --bootstrap
+  python claim_loadgen.py --dsn ... --runners 8,30,60 --queue-depths 1000,100000 --duration 30
+  # 実際の間隔（poll 10s / heartbeat 30s）ではなく、圧縮した間隔で負荷を上げる
+  python claim_loadgen.py --dsn ... --poll-interval 0.5 --heartbeat-interval 2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import re
+import secrets
+import sys
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import asyncpg
+except ImportError:
+    print("asyncpg が必要です: pip install asyncpg")
+    sys.exit(1)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "supabase" / "migrations"
+# loadgen が作る run（loadgen-* のツール）だけを対象にする条件
+LOADGEN_RUNS = "tool_id IN (SELECT id FROM public.tools WHERE name LIKE 'loadgen-%')"
+
+# Supabase が提供するロール・auth スキーマの最小シム（素の PostgreSQL 用）
+SUPABASE_SHIM_SQL = """
+DO $$
+BEGIN
+  CREATE ROLE anon NOLOGIN;
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+DO $$
+BEGIN
+  CREATE ROLE authenticated NOLOGIN;
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+DO $$
+BEGIN
+  CREATE ROLE service_role NOLOGIN BYPASSRLS;
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE SCHEMA IF NOT EXISTS auth;
+CREATE TABLE IF NOT EXISTS auth.users (
+  id UUID PRIMARY KEY,
+  email TEXT
+);
+CREATE OR REPLACE FUNCTION auth.uid() RETURNS UUID
+LANGUAGE sql STABLE AS $$
+  SELECT NULLIF(current_setting('request.jwt.claim.sub', true), '')::uuid
+$$;
+"""
+
+CLAIM_TOOL_TYPES = ["python_runner", "bat", "excel", "pad"]
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def split_sql(sql: str) -> list[str]:
+    """SQL をステートメント単位に分割（'...' / $tag$...$tag$ / -- コメント内の ; は無視）"""
+    statements = []
+    current: list[str] = []
+    i = 0
+    while i < len(sql):
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = len(sql) if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+            continue
+        if ch == "'":
+            end = sql.find("'", i + 1)
+            while end != -1 and sql.startswith("''", end):
+                end = sql.find("'", end + 2)
+            end = len(sql) if end == -1 else end + 1
+            current.append(sql[i:end])
+            i = end
+            continue
+        tag = re.match(r"\$[A-Za-z_]*\$", sql[i:])
+        if tag:
+            end = sql.find(tag.group(0), i + len(tag.group(0)))
+            end = len(sql) if end == -1 else end + len(tag.group(0))
+            current.append(sql[i:end])
+            i = end
+            continue
+        if ch == ";":
+            statements.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    statements.append("".join(current).strip())
+    # コメントだけの断片は除く
+    return [s for s in statements if re.sub(r"--[^\n]*", "", s).strip()]
+
+
+async def bootstrap(dsn: str) -> None:
+    """シム + 全マイグレーションを順に適用する
+
+    初期マイグレーションは create_tables.sql が後から書き換えられているため、
+    空の DB に順番通り流すと重複カラム等で失敗するものがある。
+    ファイル単位で失敗した場合はステートメント単位で再実行し、失敗した文だけ飛ばす。
+    """
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(SUPABASE_SHIM_SQL)
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            sql = path.read_text(encoding="utf-8")
+            try:
+                async with conn.transaction():
+                    await conn.execute(sql)
+                print(f"applied {path.name}")
+                continue
+            except asyncpg.PostgresError:
+                pass
+            skipped = 0
+            for statement in split_sql(sql):
+                try:
+                    async with conn.transaction():
+                        await conn.execute(statement)
+                except asyncpg.PostgresError as e:
+                    skipped += 1
+                    head = next(line for line in statement.splitlines() if line.strip() and not line.startswith("--"))
+                    print(f"  skip ({type(e).__name__}): {head[:80]}")
+            print(f"applied {path.name} ({skipped} statement(s) skipped)")
+    finally:
+        await conn.close()
+
+
+async def seed(pool: Any, runners: int, depth: int) -> tuple[list[str], dict[str, Any]]:
+    """マシン N 台とキュー depth 件を用意する（前回の loadgen の runs / machines は削除）
+
+    loadgen の Runner は claim_run() で他の queued run も取ってしまうため、
+    loadgen 以外の queued / running の run がある DB では実行しない。
+    """
+    async with pool.acquire() as conn:
+        foreign = await conn.fetchval(
+            f"SELECT count(*) FROM public.runs WHERE status IN ('queued', 'running') AND NOT ({LOADGEN_RUNS})"
+        )
+        if foreign:
+            raise SystemExit(
+                f"{foreign} queued/running run(s) not created by loadgen exist — use a dedicated database"
+            )
+        await conn.execute(f"DELETE FROM public.runs WHERE {LOADGEN_RUNS}")
+        await conn.execute("DELETE FROM public.machines WHERE name LIKE 'loadgen-%'")
+        # auth.users.email に一意制約はないため、既存のユーザーを探してからなければ作る
+        user_id = await conn.fetchval("SELECT id FROM auth.users WHERE email = 'loadgen@example.com' LIMIT 1") \
+            or await conn.fetchval(
+                "INSERT INTO auth.users (id, email) VALUES (uuid_generate_v4(), 'loadgen@example.com') RETURNING id"
+            )
+        category_id = await conn.fetchval("SELECT id FROM public.categories WHERE name = 'loadgen'") \
+            or await conn.fetchval("INSERT INTO public.categories (name) VALUES ('loadgen') RETURNING id")
+        tool_ids = []
+        for tool_type in CLAIM_TOOL_TYPES:
+            tool_id = await conn.fetchval(
+                "SELECT id FROM public.tools WHERE name = $1", f"loadgen-{tool_type}"
+            ) or await conn.fetchval(
+                "INSERT INTO public.tools (category_id, name, tool_type, execution_mode, target) "
+                "VALUES ($1, $2, $3, 'queue', 'C:\\\\loadgen') RETURNING id",
+                category_id, f"loadgen-{tool_type}", tool_type,
+            )
+            tool_ids.append(tool_id)
+
+        keys = []
+        for i in range(runners):
+            key = f"loadgen-key-{i}-{secrets.token_hex(4)}"
+            await conn.execute(
+                "INSERT INTO public.machines (name, key_hash, enabled) VALUES ($1, $2, true)",
+                f"loadgen-{i:03d}", key_hash(key),
+            )
+            keys.append(key)
+
+        # generate_series で一括投入（10万件でも数秒）
+        await conn.execute(
+            """
+            INSERT INTO public.runs (tool_id, requested_by, status, run_token_hash, requested_at, priority)
+            SELECT ($1::uuid[])[1 + (g % array_length($1::uuid[], 1))], $2, 'queued', md5(g::text),
+                   now() - (g || ' milliseconds')::interval, (g % 3) * 5
+            FROM generate_series(1, $3) AS g
+            """,
+            tool_ids, user_id, depth,
+        )
+        await conn.execute("ANALYZE public.runs")
+    return keys, {"user_id": user_id}
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.claim_ms: list[float] = []
+        self.rpc_ms: list[float] = []
+        self.heartbeat_ms: list[float] = []
+        self.report_ms: list[float] = []
+        self.empty_claims = 0
+        self.errors = 0
+        self.claimed: dict[str, str] = {}
+        self.double_claims: list[tuple[str, str, str]] = []
+        self.lock_wait_samples: list[int] = []
+
+
+async def route_claim(conn: Any, key: str, stats: Stats) -> Optional[str]:
+    """/api/runner/claim と同じクエリ列"""
+    started = time.perf_counter()
+    machine = await conn.fetchrow(
+        "SELECT id, name, enabled FROM public.machines WHERE key_hash = $1", key_hash(key)
+    )
+    if machine is None or not machine["enabled"]:
+        raise RuntimeError("machine auth failed")
+    rpc_started = time.perf_counter()
+    row = await conn.fetchrow(
+        "SELECT * FROM public.claim_run($1, $2, $3)", machine["id"], CLAIM_TOOL_TYPES, None
+    )
+    stats.rpc_ms.append((time.perf_counter() - rpc_started) * 1000)
+    if row is None:
+        stats.claim_ms.append((time.perf_counter() - started) * 1000)
+        stats.empty_claims += 1
+        return None
+    await conn.execute(
+        "UPDATE public.runs SET run_token_hash = $1 WHERE id = $2",
+        key_hash(secrets.token_hex(32)), row["run_id"],
+    )
+    stats.claim_ms.append((time.perf_counter() - started) * 1000)
+
+    run_id = str(row["run_id"])
+    previous = stats.claimed.get(run_id)
+    if previous is not None:
+        stats.double_claims.append((run_id, previous, key))
+    stats.claimed[run_id] = key
+    return run_id
+
+
+async def route_heartbeat(conn: Any, key: str, stats: Stats) -> None:
+    """/api/runner/heartbeat と同じクエリ列"""
+    columns = "id, name, enabled, pending_command" if await _has_pending_command(conn) else "id, name, enabled"
+    started = time.perf_counter()
+    machine = await conn.fetchrow(
+        f"SELECT {columns} FROM public.machines WHERE key_hash = $1", key_hash(key)
+    )
+    await conn.execute("UPDATE public.machines SET last_seen_at = now() WHERE id = $1", machine["id"])
+    await conn.fetch(
+        "SELECT id FROM public.runs WHERE machine_id = $1 AND status = 'running' "
+        "AND cancel_requested_at IS NOT NULL",
+        machine["id"],
+    )
+    stats.heartbeat_ms.append((time.perf_counter() - started) * 1000)
+
+
+_pending_command_column: Optional[bool] = None
+
+
+async def _has_pending_command(conn: Any) -> bool:
+    # machines.pending_command はマイグレーション外で追加されている環境がある
+    global _pending_command_column
+    if _pending_command_column is None:
+        _pending_command_column = bool(await conn.fetchval(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = 'machines' AND column_name = 'pending_command'"
+        ))
+    return _pending_command_column
+
+
+async def route_report(conn: Any, key: str, run_id: str, stats: Stats) -> None:
+    """/api/runner/report と同じクエリ列"""
+    started = time.perf_counter()
+    machine = await conn.fetchrow(
+        "SELECT id, name, enabled FROM public.machines WHERE key_hash = $1", key_hash(key)
+    )
+    run = await conn.fetchrow(
+        "SELECT id, machine_id, status, summary, exit_code FROM public.runs WHERE id = $1", run_id
+    )
+    if run["machine_id"] != machine["id"] or run["status"] != "running":
+        raise RuntimeError(f"report rejected for {run_id}")
+    await conn.execute(
+        "UPDATE public.runs SET status = 'success', finished_at = now(), summary = 'loadgen' WHERE id = $1",
+        run_id,
+    )
+    stats.report_ms.append((time.perf_counter() - started) * 1000)
+
+
+async def simulate_runner(
+    pool: Any, key: str, args: argparse.Namespace, stats: Stats, deadline: float
+) -> None:
+    """1台の Runner: poll 間隔で claim → exec_ms 後に report、heartbeat は別間隔"""
+    rng = random.Random(key)
+    # 起動タイミングをばらす
+    await asyncio.sleep(rng.uniform(0, args.poll_interval))
+    last_heartbeat = 0.0
+    while time.monotonic() < deadline:
+        try:
+            async with pool.acquire() as conn:
+                if time.monotonic() - last_heartbeat >= args.heartbeat_interval:
+                    await route_heartbeat(conn, key, stats)
+                    last_heartbeat = time.monotonic()
+                run_id = await route_claim(conn, key, stats)
+            if run_id:
+                await asyncio.sleep(args.exec_ms / 1000)
+                async with pool.acquire() as conn:
+                    await route_report(conn, key, run_id, stats)
+                # 空きスロットがあれば待たずに次を claim（agent と同じ）
+                continue
+        except Exception as e:
+            stats.errors += 1
+            if stats.errors <= 5:
+                print(f"  runner error: {e}")
+        await asyncio.sleep(args.poll_interval * rng.uniform(1 - args.jitter, 1 + args.jitter))
+
+
+async def sample_db(pool: Any, stats: Stats, stop: asyncio.Event) -> None:
+    """ロック待ちのバックエンド数をサンプリング"""
+    async with pool.acquire() as conn:
+        while not stop.is_set():
+            count = await conn.fetchval(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+            )
+            stats.lock_wait_samples.append(count)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=0.2)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def db_cpu_seconds(pool: Any) -> Optional[float]:
+    """DB プロセス群の CPU 時間合計（DB が同一ホストの Linux の場合のみ）"""
+    async with pool.acquire() as conn:
+        pids = [r["pid"] for r in await conn.fetch("SELECT pid FROM pg_stat_activity")]
+    total = 0.0
+    found = False
+    for pid in pids:
+        try:
+            fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            found = True
+        except (OSError, IndexError, ValueError):
+            continue
+    return total if found else None
+
+
+async def run_scenario(dsn: str, runners: int, depth: int, args: argparse.Namespace) -> dict[str, Any]:
+    pool = await asyncpg.create_pool(dsn, min_size=min(runners, args.pool_size) + 1, max_size=args.pool_size + 1)
+    try:
+        keys, _ = await seed(pool, runners, depth)
+        async with pool.acquire() as conn:
+            deadlocks_before = await conn.fetchval(
+                "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+            )
+        stats = Stats()
+        stop = asyncio.Event()
+        cpu_before = await db_cpu_seconds(pool)
+        sampler = asyncio.create_task(sample_db(pool, stats, stop))
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(simulate_runner(pool, k, args, stats, deadline) for k in keys))
+        elapsed = time.monotonic() - started
+        stop.set()
+        await sampler
+        cpu_after = await db_cpu_seconds(pool)
+
+        async with pool.acquire() as conn:
+            deadlocks_after = await conn.fetchval(
+                "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+            )
+            # DB 側でも確認: 1 run に複数マシンが記録されていないか（report 済み件数と照合）
+            db_claimed = await conn.fetchval(
+                f"SELECT count(*) FROM public.runs WHERE status IN ('running', 'success') AND {LOADGEN_RUNS}"
+            )
+    finally:
+        await pool.close()
+
+    return {
+        "runners": runners,
+        "queue_depth": depth,
+        "elapsed_sec": elapsed,
+        "claims": len(stats.claimed),
+        "claims_per_sec": len(stats.claimed) / elapsed if elapsed else 0,
+        "empty_claims": stats.empty_claims,
+        "claim_ms": {p: percentile(stats.claim_ms, p) for p in (50, 95, 99)} | {"max": max(stats.claim_ms, default=None)},
+        "rpc_ms": {p: percentile(stats.rpc_ms, p) for p in (50, 95, 99)},
+        "heartbeat_p95_ms": percentile(stats.heartbeat_ms, 95),
+        "report_p95_ms": percentile(stats.report_ms, 95),
+        "double_claims": len(stats.double_claims),
+        "db_claimed_matches": db_claimed == len(stats.claimed),
+        "lock_waits_max": max(stats.lock_wait_samples, default=0),
+        "lock_waits_avg": sum(stats.lock_wait_samples) / len(stats.lock_wait_samples) if stats.lock_wait_samples else 0,
+        "deadlocks": (deadlocks_after or 0) - (deadlocks_before or 0),
+        "db_cpu_sec": (cpu_after - cpu_before) if cpu_before is not None and cpu_after is not None else None,
+        "errors": stats.errors,
+    }
+
+
+def fmt(value: Optional[float], digits: int = 1) -> str:
+    return "-" if value is None else f"{value:,.{digits}f}"
+
+
+def print_results(results: list[dict[str, Any]]) -> None:
+    print("\n====== CLAIM CONTENTION ======")
+    print("runners | depth   | claims/s | claim p50/p95/p99/max ms     | rpc p95 | dbl | lockwait max/avg | db cpu s | err")
+    print("--------|---------|----------|------------------------------|---------|-----|------------------|----------|----")
+    for r in results:
+        c = r["claim_ms"]
+        print(
+            f"{r['runners']:>7} | {r['queue_depth']:>7} | {fmt(r['claims_per_sec']):>8} | "
+            f"{fmt(c[50]):>6}/{fmt(c[95]):>6}/{fmt(c[99]):>6}/{fmt(c['max']):>7} | "
+            f"{fmt(r['rpc_ms'][95]):>7} | {r['double_claims']:>3} | "
+            f"{r['lock_waits_max']:>7}/{fmt(r['lock_waits_avg'], 2):>8} | {fmt(r['db_cpu_sec'], 2):>8} | {r['errors']:>3}"
+        )
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    if args.bootstrap:
+        await bootstrap(args.dsn)
+    results = []
+    for depth in [int(d) for d in args.queue_depths.split(",")]:
+        for runners in [int(n) for n in args.runners.split(",")]:
+            print(f"scenario: runners={runners} depth={depth} duration={args.duration}s")
+            results.append(await run_scenario(args.dsn, runners, depth, args))
+    print_results(results)
+    if args.json:
+        import json
+        Path(args.json).write_text(json.dumps(results, indent=2, default=str))
+    if any(r["double_claims"] or not r["db_claimed_matches"] for r in results):
+        print("\nFAILED: double claim detected")
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="claim_run contention load generator")
+    parser.add_argument("--dsn", required=True, help="PostgreSQL 接続文字列（専用の空DBを推奨）")
+    parser.add_argument("--bootstrap", action="store_true", help="シム + supabase/migrations を適用")
+    parser.add_argument("--runners", default="8,30,60", help="Runner 台数（カンマ区切り）")
+    parser.add_argument("--queue-depths", default="1000,100000", help="キュー件数（カンマ区切り）")
+    parser.add_argument("--duration", type=float, default=30, help="シナリオごとの秒数")
+    parser.add_argument("--poll-interval", type=float, default=10, help="agent の poll_interval_sec")
+    parser.add_argument("--heartbeat-interval", type=float, default=30, help="agent の heartbeat_interval_sec")
+    parser.add_argument("--jitter", type=float, default=0.1, help="poll 間隔の揺らぎ（割合）")
+    parser.add_argument("--exec-ms", type=float, default=200, help="claim から report までの疑似実行時間")
+    parser.add_argument("--pool-size", type=int, default=40, help="DB 接続数（Next.js ルートの同時実行相当）")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+TC Portal Runner API のローカルスタブ
+
+agent.py が叩く以下のエンドポイントをメモリ上のキューで再現する。
+  POST /api/runner/claim
+  POST /api/runner/heartbeat
+  POST /api/runner/progress
+  POST /api/runner/report
+  POST /api/runner/log-paths
+  POST /api/runs/callback
+
+claim の順序・絞り込みは claim_run()（priority + エイジング, tool_types, min_priority）と同じ。
+各 run の claim / report 時刻を記録し、ベンチマークから参照できる。
+
+Lincoln 連携用に Supabase REST（/rest/v1/runners, jobs, calendar_sync_requests）も
+空の応答で再現する。inject() で障害（5xx / 応答保留 / 接続リセット）を注入できる。
+
+単体起動（手動確認用）:
+  python fake_portal.py --port 8787 --latency-ms 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import socket
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+# claim_run() と同じ: 優先度1あたり5分の前借り
+PRIORITY_STEP_SEC = 300
+DEFAULT_MACHINE_KEY = "bench-machine-key"
+
+
+class _QuietServer(ThreadingHTTPServer):
+    """リセット注入後の書き込み失敗などをトレースバック表示しない"""
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        pass
+
+
+class FakePortal:
+    """Runner API のインメモリ実装"""
+
+    def __init__(self, latency_ms: float = 0.0, machine_key: str = DEFAULT_MACHINE_KEY) -> None:
+        self.latency_ms = latency_ms
+        self.machine_key = machine_key
+        self.runs: dict[str, dict[str, Any]] = {}
+        self.pending_command: Optional[str] = None
+        self.last_profile_path: Optional[str] = None
+        self.log_server_port: Optional[int] = None
+        self.log_secret = uuid.uuid4().hex
+        self.request_counts: dict[str, int] = {}
+        # (応答時刻, パス, HTTP ステータス or None=リセット)
+        self.request_log: list[tuple[float, str, Optional[int]]] = []
+        self.faults: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.all_reported = threading.Event()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # -- キュー操作 ---------------------------------------------------------
+    def enqueue(
+        self,
+        tool_type: str,
+        target: Optional[str],
+        name: Optional[str] = None,
+        run_config: Optional[dict[str, Any]] = None,
+        payload: Optional[dict[str, Any]] = None,
+        priority: int = 0,
+        run_id: Optional[str] = None,
+    ) -> str:
+        run_id = run_id or str(uuid.uuid4())
+        now = time.time()
+        with self.lock:
+            self.runs[run_id] = {
+                "run_id": run_id,
+                "status": "queued",
+                "tool_type": tool_type,
+                "tool_name": name or f"{tool_type}-{run_id[:8]}",
+                "target": target,
+                "run_config": run_config,
+                "payload": payload,
+                "priority": priority,
+                "requested_at": now,
+                "queue_sort_at": now - priority * PRIORITY_STEP_SEC,
+                "run_token": uuid.uuid4().hex,
+                "claimed_at": None,
+                "reported_at": None,
+                "followup_at": None,
+                "report": None,
+                "followup": None,
+                "cancel_requested": False,
+                "expected_finish_at": None,
+                "slow": False,
+                "progress": None,
+                "metrics": None,
+                "progress_updates": 0,
+            }
+            self.all_reported.clear()
+        return run_id
+
+    def request_cancel(self, run_id: str) -> None:
+        with self.lock:
+            if run_id in self.runs:
+                self.runs[run_id]["cancel_requested"] = True
+
+    def outstanding(self) -> int:
+        """まだ報告されていない run 数"""
+        with self.lock:
+            return sum(1 for r in self.runs.values() if r["status"] in ("queued", "running"))
+
+    # -- 障害注入 -----------------------------------------------------------
+    def inject(
+        self,
+        fault: str,
+        paths: Optional[tuple[str, ...]] = None,
+        duration_sec: Optional[float] = None,
+        **params: Any,
+    ) -> None:
+        """障害を注入する
+
+        fault:
+          error         status（既定 503）を即座に返す
+          hang          hang_sec 秒（既定 30）保留した後、504 を返す（処理はしない）。
+                        process=True なら保留後に通常どおり処理する
+          reset_before  処理せずに接続をリセット
+          reset_after   処理した上で応答せずに接続をリセット（応答だけが失われる）
+        paths: 対象パスのプレフィックス（None なら全エンドポイント）
+        duration_sec: 指定秒後に自動で解除
+        """
+        until = time.time() + duration_sec if duration_sec is not None else None
+        with self.lock:
+            self.faults.append({"fault": fault, "paths": paths, "until": until, **params})
+
+    def clear_faults(self) -> None:
+        with self.lock:
+            self.faults.clear()
+
+    def active_fault(self, path: str) -> Optional[dict[str, Any]]:
+        now = time.time()
+        with self.lock:
+            self.faults = [f for f in self.faults if f["until"] is None or f["until"] > now]
+            for fault in self.faults:
+                if fault["paths"] is None or path.startswith(fault["paths"]):
+                    return fault
+        return None
+
+    def log_request(self, path: str, status: Optional[int]) -> None:
+        with self.lock:
+            self.request_log.append((time.time(), path, status))
+
+    # -- エンドポイント ------------------------------------------------------
+    def handle(self, path: str, headers: Any, body: dict[str, Any]) -> tuple[int, Optional[Any]]:
+        with self.lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+        if path.startswith("/rest/v1/"):
+            return self._lincoln(path)
+        if path == "/api/runs/callback":
+            return self._callback(body)
+        if headers.get("X-Machine-Key") != self.machine_key:
+            return 401, {"error": "Invalid machine key"}
+        if path == "/api/runner/claim":
+            return self._claim(body)
+        if path == "/api/runner/heartbeat":
+            return self._heartbeat(body)
+        if path == "/api/runner/progress":
+            return self._progress(body)
+        if path == "/api/runner/report":
+            return self._report(body)
+        if path == "/api/runner/log-paths":
+            return self._log_paths(body)
+        return 404, {"error": "Not found"}
+
+    def _claim(self, body: dict[str, Any]) -> tuple[int, Optional[dict[str, Any]]]:
+        tool_types = body.get("tool_types")
+        min_priority = body.get("min_priority")
+        with self.lock:
+            candidates = [
+                r for r in self.runs.values()
+                if r["status"] == "queued"
+                and (tool_types is None or r["tool_type"] in tool_types)
+                and (min_priority is None or r["priority"] >= min_priority)
+            ]
+            if not candidates:
+                return 204, None
+            run = min(candidates, key=lambda r: (r["queue_sort_at"], r["run_id"]))
+            run["status"] = "running"
+            run["claimed_at"] = time.time()
+        return 200, {
+            "run_id": run["run_id"],
+            "run_token": run["run_token"],
+            "tool": {
+                "id": f"tool-{run['tool_type']}",
+                "name": run["tool_name"],
+                "tool_type": run["tool_type"],
+                "target": run["target"],
+                "run_config": run["run_config"],
+            },
+            "payload": run["payload"],
+            "priority": run["priority"],
+            "requested_at": datetime.fromtimestamp(run["requested_at"], timezone.utc).isoformat(),
+            "trace_id": run["run_id"].replace("-", "") if len(run["run_id"]) == 36 else None,
+            "callback_url": "/api/runs/callback",
+        }
+
+    def _heartbeat(self, body: dict[str, Any]) -> tuple[int, Optional[dict[str, Any]]]:
+        with self.lock:
+            if body.get("profile_path"):
+                self.last_profile_path = body["profile_path"]
+            if "log_server_port" in body:
+                self.log_server_port = body["log_server_port"]
+            for estimate in body.get("run_estimates") or []:
+                run = self.runs.get(estimate.get("run_id"))
+                if run is not None and run["status"] == "running":
+                    run["expected_finish_at"] = estimate.get("expected_finish_at")
+                    run["slow"] = run["slow"] or bool(estimate.get("slow"))
+            command = None
+            if self.pending_command:
+                if not body.get("starting"):
+                    command = self.pending_command
+                self.pending_command = None
+            cancel_ids = [
+                r["run_id"] for r in self.runs.values()
+                if r["status"] == "running" and r["cancel_requested"]
+            ]
+        return 200, {
+            "success": True,
+            "machine_id": "bench-machine",
+            "machine_name": "bench",
+            "command": command,
+            "cancel_run_ids": cancel_ids,
+            **({"log_secret": self.log_secret} if body.get("log_server_port") else {}),
+        }
+
+    def _progress(self, body: dict[str, Any]) -> tuple[int, Optional[dict[str, Any]]]:
+        with self.lock:
+            for update in body.get("updates") or []:
+                run = self.runs.get(update.get("run_id"))
+                if run is None or run["status"] != "running":
+                    continue
+                run["progress_updates"] += 1
+                if "progress" in update:
+                    run["progress"] = (update["progress"], update.get("message"))
+                if update.get("metrics"):
+                    run["metrics"] = update["metrics"]
+        return 200, {"success": True}
+
+    def _log_paths(self, body: dict[str, Any]) -> tuple[int, Optional[dict[str, Any]]]:
+        with self.lock:
+            for move in body.get("moves") or []:
+                run = self.runs.get(move.get("run_id"))
+                if run is not None and run["report"] is not None:
+                    run["report"]["log_path"] = move.get("log_path")
+        return 200, {"success": True}
+
+    def _report(self, body: dict[str, Any]) -> tuple[int, Optional[dict[str, Any]]]:
+        run_id = body.get("run_id")
+        status = body.get("status")
+        if not run_id or status not in ("success", "failed", "canceled"):
+            return 400, {"error": "run_id and valid status are required"}
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                return 404, {"error": "Run not found"}
+            if body.get("followup"):
+                if run["status"] != "success" or run["followup"] is not None:
+                    return 400, {"error": "Followup is only allowed once for launched runs"}
+                run["status"] = status
+                run["followup"] = body
+                run["followup_at"] = time.time()
+                return 200, {"success": True}
+            if run["status"] != "running":
+                return 400, {"error": "Only running status can be updated"}
+            run["status"] = status
+            run["report"] = body
+            run["reported_at"] = time.time()
+            self._check_all_reported()
+        return 200, {"success": True}
+
+    def _callback(self, body: dict[str, Any]) -> tuple[int, Optional[dict[str, Any]]]:
+        run_id = body.get("run_id")
+        with self.lock:
+            run = self.runs.get(run_id or "")
+            if run is None:
+                return 404, {"error": "Run not found"}
+            if body.get("run_token") != run["run_token"]:
+                return 401, {"error": "Invalid run token"}
+            if run["status"] in ("success", "failed", "canceled"):
+                return 400, {"error": "Run is already completed"}
+            run["status"] = body.get("status", "failed")
+            run["report"] = body
+            run["reported_at"] = time.time()
+            self._check_all_reported()
+        return 200, {"success": True}
+
+    def _lincoln(self, path: str) -> tuple[int, Optional[Any]]:
+        """Lincoln Supabase（PostgREST）: 登録は受け付け、ジョブ・同期要求は常に空"""
+        if path == "/rest/v1/runners":
+            return 201, {}
+        return 200, []
+
+    def _check_all_reported(self) -> None:
+        # self.lock 保持中に呼ぶこと
+        if all(r["status"] not in ("queued", "running") for r in self.runs.values()):
+            self.all_reported.set()
+
+    # -- サーバー -----------------------------------------------------------
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:  # noqa: N802
+                self._dispatch()
+
+            def do_GET(self) -> None:  # noqa: N802
+                self._dispatch()
+
+            def _dispatch(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw else {}
+                except json.JSONDecodeError:
+                    body = {}
+                if portal.latency_ms:
+                    time.sleep(portal.latency_ms / 1000)
+                path = self.path.split("?")[0]
+
+                fault = portal.active_fault(path)
+                kind = fault["fault"] if fault else None
+                if kind == "error":
+                    self._send(fault.get("status", 503), {"error": "Injected fault"}, path)
+                    return
+                if kind == "hang":
+                    time.sleep(fault.get("hang_sec", 30))
+                    if not fault.get("process"):
+                        self._send(504, {"error": "Gateway timeout (injected)"}, path)
+                        return
+                if kind == "reset_before":
+                    self._reset(path)
+                    return
+
+                status, data = portal.handle(path, self.headers, body)
+                if kind == "reset_after":
+                    self._reset(path)
+                    return
+                self._send(status, data, path)
+
+            def _reset(self, path: str) -> None:
+                # SO_LINGER=0 で close すると RST が送られる
+                portal.log_request(path, None)
+                self.close_connection = True
+                try:
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    self.connection.close()
+                except OSError:
+                    pass
+
+            def _send(self, status: int, data: Optional[Any], path: str = "") -> None:
+                portal.log_request(path, status)
+                payload = json.dumps(data).encode() if data is not None else b""
+                self.send_response(status)
+                if payload:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if payload:
+                    self.wfile.write(payload)
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                pass
+
+        self._server = _QuietServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return f"http://{host}:{self._server.server_address[1]}"
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="TC Portal Runner API stub")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--machine-key", default=DEFAULT_MACHINE_KEY)
+    args = parser.parse_args()
+
+    portal = FakePortal(latency_ms=args.latency_ms, machine_key=args.machine_key)
+    url = portal.start(port=args.port)
+    print(f"Fake portal listening on {url} (machine key: {args.machine_key})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        portal.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+"""
+Runner フリートの離散イベントシミュレータ（オフライン）
+
+poll_interval_sec / heartbeat_interval_sec / 同時実行数 / resource_classes を
+フリート全体で変更する前に、キュー待ち時間・スロット使用率・ポータルへの
+リクエスト量がどう変わるかを見積もる。
+
+モデル（agent.py の polling_loop と同じ挙動）:
+  - 各 Runner は空きスロットのある tool_type だけを claim し、取れる限り続けて claim する
+  - claim ループ後に poll_interval 待機（スロットが全て埋まっている間は claim しない）
+  - キューの順序は claim_run() と同じ（queue_sort_at = requested_at - priority × 5分）
+  - 実行終了 → report 送信後にスロットが空く
+
+ポリシー:
+  poll      固定間隔（現行）
+  backoff   空振りごとに間隔を --backoff-factor 倍（--backoff-max まで）、claim 成功でリセット
+  long_poll claim リクエストを最大 --long-poll-sec 保留し、run が入った時点で即応答
+
+到着過程:
+  --history  runs のエクスポート（CSV / JSON / JSONL）をそのまま再生
+  未指定     --days / --runs-per-day / --mix で平日日中に偏った合成トラフィックを生成
+
+例:
+  python fleet_sim.py --days 30 --runs-per-day 2000 --runners 10,20 --poll-interval 5,10,30
+  python fleet_sim.py --history runs.csv --config config.json --policy poll,backoff,long_poll
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+# claim_run() と同じ: 優先度1あたり5分の前借り
+PRIORITY_STEP_SEC = 300
+
+ALL_TOOL_TYPES = ["python_runner", "pad", "exe", "excel", "sheet", "folder", "bi", "bat"]
+
+# 実行時間の既定分布（対数正規: 中央値秒, sigma）
+DEFAULT_DURATION = (30.0, 1.0)
+
+CYCLE, FINISH = 0, 1
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values: list[float]) -> dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def parse_weights(spec: str) -> list[tuple[str, float]]:
+    result = []
+    for part in spec.split(","):
+        key, _, weight = part.partition("=")
+        result.append((key.strip(), float(weight or 1)))
+    return result
+
+
+def resource_classes_from_config(config: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """agent.py の load_resource_classes と同じ正規化"""
+    raw = config.get("resource_classes")
+    if not raw:
+        return {
+            "default": {
+                "slots": max(1, int(config.get("max_concurrent_runs", 1))),
+                "tool_types": list(ALL_TOOL_TYPES),
+            }
+        }
+    return {
+        name: {"slots": max(0, int(spec.get("slots", 1))), "tool_types": list(spec.get("tool_types", []))}
+        for name, spec in raw.items()
+    }
+
+
+# ---------------------------------------------------------------------------
+# 到着過程・実行時間
+# ---------------------------------------------------------------------------
+class DurationModel:
+    """tool_type ごとの実行時間（履歴からの経験分布 or 対数正規）"""
+
+    def __init__(self, params: dict[str, tuple[float, float]], samples: dict[str, list[float]], rng: random.Random) -> None:
+        self.params = params
+        self.samples = samples
+        self.rng = rng
+
+    def sample(self, tool_type: str) -> float:
+        observed = self.samples.get(tool_type)
+        if observed and tool_type not in self.params:
+            return self.rng.choice(observed)
+        median, sigma = self.params.get(tool_type, DEFAULT_DURATION)
+        return median * math.exp(self.rng.gauss(0, sigma))
+
+
+def parse_durations(spec: Optional[str]) -> dict[str, tuple[float, float]]:
+    """'python_runner=60:1.2,excel=5' → {tool_type: (中央値秒, sigma)}"""
+    params: dict[str, tuple[float, float]] = {}
+    if not spec:
+        return params
+    for part in spec.split(","):
+        tool_type, _, value = part.partition("=")
+        median, _, sigma = value.partition(":")
+        params[tool_type.strip()] = (float(median), float(sigma or DEFAULT_DURATION[1]))
+    return params
+
+
+def _parse_time(value: Any) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def load_history(path: Path) -> list[dict[str, Any]]:
+    """runs エクスポートを読む（CSV ヘッダ付き / JSON 配列 / JSONL）
+
+    必要な列: requested_at, tool_type
+    任意の列: started_at, finished_at, duration_ms, priority
+    """
+    text = path.read_text(encoding="utf-8")
+    if path.suffix.lower() == ".csv":
+        rows = list(csv.DictReader(text.splitlines()))
+    elif text.lstrip().startswith("["):
+        rows = json.loads(text)
+    else:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    history = []
+    for row in rows:
+        requested_at = _parse_time(row.get("requested_at"))
+        if requested_at is None or not row.get("tool_type"):
+            continue
+        duration = None
+        if row.get("duration_ms") not in (None, ""):
+            duration = float(row["duration_ms"]) / 1000
+        else:
+            started_at = _parse_time(row.get("started_at"))
+            finished_at = _parse_time(row.get("finished_at"))
+            if started_at is not None and finished_at is not None:
+                duration = max(0.0, finished_at - started_at)
+        history.append({
+            "requested_at": requested_at,
+            "tool_type": row["tool_type"],
+            "priority": int(row.get("priority") or 0),
+            "duration": duration,
+        })
+    history.sort(key=lambda h: h["requested_at"])
+    return history
+
+
+def arrivals_from_history(
+    history: list[dict[str, Any]], durations: DurationModel, resample: bool
+) -> list[tuple[float, str, int, float]]:
+    origin = history[0]["requested_at"]
+    arrivals = []
+    for h in history:
+        duration = h["duration"]
+        if resample or duration is None:
+            duration = durations.sample(h["tool_type"])
+        arrivals.append((h["requested_at"] - origin, h["tool_type"], h["priority"], duration))
+    return arrivals
+
+
+def synthetic_arrivals(
+    days: float,
+    runs_per_day: float,
+    mix: list[tuple[str, float]],
+    priority_mix: list[tuple[str, float]],
+    durations: DurationModel,
+    rng: random.Random,
+) -> list[tuple[float, str, int, float]]:
+    """平日 9〜18 時に集中する非定常ポアソン到着（1時間単位で強度を変える）"""
+    def weight(hour_index: int) -> float:
+        day, hour = divmod(hour_index, 24)
+        if day % 7 >= 5:
+            return 0.5
+        return 8.0 if 9 <= hour < 18 else 1.0
+
+    hours = int(days * 24)
+    total_weight = sum(weight(h) for h in range(hours)) or 1
+    total_runs = runs_per_day * days
+    tool_types, tool_weights = zip(*mix)
+    priorities, priority_weights = zip(*priority_mix)
+
+    arrivals = []
+    for h in range(hours):
+        rate = total_runs * weight(h) / total_weight / 3600
+        if rate <= 0:
+            continue
+        t = h * 3600 + rng.expovariate(rate)
+        while t < (h + 1) * 3600:
+            tool_type = rng.choices(tool_types, tool_weights)[0]
+            priority = int(rng.choices(priorities, priority_weights)[0])
+            arrivals.append((t, tool_type, priority, durations.sample(tool_type)))
+            t += rng.expovariate(rate)
+    return arrivals
+
+
+# ---------------------------------------------------------------------------
+# シミュレーション本体
+# ---------------------------------------------------------------------------
+class SimRunner:
+    __slots__ = (
+        "index", "classes", "type_class", "busy", "min_priority",
+        "interval", "next_cycle", "scheduled", "holding", "skip_request", "_free",
+    )
+
+    def __init__(self, index: int, classes: dict[str, dict[str, Any]], min_priority: Optional[int], interval: float) -> None:
+        self.index = index
+        self.classes = classes
+        # resource_class_for と同じく、最初に定義されたクラスに属する
+        self.type_class: dict[str, str] = {}
+        for name, spec in classes.items():
+            for tool_type in spec["tool_types"]:
+                self.type_class.setdefault(tool_type, name)
+        self.busy = dict.fromkeys(classes, 0)
+        self.min_priority = min_priority
+        self.interval = interval
+        self.next_cycle = 0.0
+        self.scheduled = False
+        # long_poll: claim リクエストを保留中（run が入れば即応答）
+        self.holding = False
+        self.skip_request = False
+        self._free: Optional[frozenset[str]] = None
+
+    def free_types(self) -> frozenset[str]:
+        if self._free is None:
+            self._free = frozenset(
+                t for t, c in self.type_class.items() if self.busy[c] < self.classes[c]["slots"]
+            )
+        return self._free
+
+    def acquire(self, resource_class: str) -> None:
+        self.busy[resource_class] += 1
+        self._free = None
+
+    def release(self, resource_class: str) -> None:
+        self.busy[resource_class] -= 1
+        self._free = None
+
+
+class FleetSimulator:
+    """1シナリオ分のシミュレーション
+
+    アイドル中の Runner にはイベントを積まず、次の状態変化（到着・自分の run の終了）
+    の時点で空振りポーリング回数を閉形式で加算する。1か月・数十台でも数秒で終わる。
+    """
+
+    def __init__(self, scenario: dict[str, Any], arrivals: list[tuple[float, str, int, float]], seed: int) -> None:
+        self.scenario = scenario
+        self.arrivals = arrivals
+        self.policy = scenario["policy"]
+        self.base_interval = scenario["poll_interval"]
+        self.latency = scenario["request_ms"] / 1000
+        self.backoff_factor = scenario["backoff_factor"]
+        self.backoff_max = scenario["backoff_max"]
+        self.long_poll = scenario["long_poll_sec"]
+        rng = random.Random(seed)
+
+        self.runners = []
+        for i, (classes, min_priority) in enumerate(scenario["fleet"]):
+            runner = SimRunner(i, classes, min_priority, self.base_interval)
+            # 起動タイミングはばらばら
+            runner.next_cycle = rng.uniform(0, self.base_interval)
+            self.runners.append(runner)
+
+        self.events: list[tuple[float, int, int, Any]] = []
+        self.seq = itertools.count()
+        self.queues: dict[tuple[str, int], list[tuple[float, int, float, float]]] = {}
+        self.queued = 0
+
+        self.claim_requests = 0
+        self.empty_claims = 0
+        self.reports = 0
+        self.waits: list[float] = []
+        self.waits_by_priority: dict[int, list[float]] = {}
+        self.waits_by_type: dict[str, list[float]] = {}
+        self.busy_time: dict[str, float] = {}
+        self.capacity: dict[str, int] = {}
+        for runner in self.runners:
+            for name, spec in runner.classes.items():
+                self.capacity[name] = self.capacity.get(name, 0) + spec["slots"]
+        self.max_queue = 0
+        self.now = 0.0
+
+        claimable = {t for r in self.runners for t in r.type_class}
+        self.unclaimable = sum(1 for a in arrivals if a[1] not in claimable)
+
+    # -- キュー -------------------------------------------------------------
+    def _push_run(self, requested_at: float, tool_type: str, priority: int, duration: float) -> None:
+        key = (tool_type, priority)
+        heap = self.queues.setdefault(key, [])
+        heapq.heappush(heap, (requested_at - priority * PRIORITY_STEP_SEC, next(self.seq), requested_at, duration))
+        self.queued += 1
+        self.max_queue = max(self.max_queue, self.queued)
+
+    def _claimable_keys(self, runner: SimRunner) -> list[tuple[str, int]]:
+        free = runner.free_types()
+        return [
+            key for key, heap in self.queues.items()
+            if heap and key[0] in free and (runner.min_priority is None or key[1] >= runner.min_priority)
+        ]
+
+    def _pop_best(self, runner: SimRunner) -> Optional[tuple[tuple[str, int], tuple[float, int, float, float]]]:
+        keys = self._claimable_keys(runner)
+        if not keys:
+            return None
+        key = min(keys, key=lambda k: self.queues[k][0][:2])
+        self.queued -= 1
+        return key, heapq.heappop(self.queues[key])
+
+    # -- Runner の状態遷移 ---------------------------------------------------
+    def _requesting_step(self, runner: SimRunner) -> float:
+        if self.policy == "long_poll":
+            return self.long_poll + self.latency
+        return self.latency + runner.interval
+
+    def _catch_up(self, runner: SimRunner, t: float) -> None:
+        """休止中の Runner を時刻 t の直前まで進め、その間の空振り claim を数える"""
+        if runner.scheduled or runner.next_cycle >= t:
+            return
+        if not runner.free_types():
+            # 全スロット使用中: claim しない（待機するだけ）
+            n = math.ceil((t - runner.next_cycle) / runner.interval)
+            runner.next_cycle += n * runner.interval
+            return
+        if self.policy == "backoff":
+            while runner.interval < self.backoff_max and runner.next_cycle < t:
+                self.claim_requests += 1
+                self.empty_claims += 1
+                runner.interval = min(runner.interval * self.backoff_factor, self.backoff_max)
+                runner.next_cycle += self.latency + runner.interval
+        if runner.next_cycle < t:
+            step = self._requesting_step(runner)
+            n = math.ceil((t - runner.next_cycle) / step)
+            self.claim_requests += n
+            self.empty_claims += n
+            runner.next_cycle += n * step
+            runner.holding = self.policy == "long_poll"
+
+    def _wake_time(self, runner: SimRunner, t: float) -> float:
+        if runner.scheduled:
+            return runner.next_cycle
+        self._catch_up(runner, t)
+        if runner.holding:
+            # 保留中の claim がその場で応答する
+            return t
+        return runner.next_cycle
+
+    def _schedule(self, runner: SimRunner) -> None:
+        if runner.holding:
+            runner.next_cycle = self.now
+            runner.skip_request = True
+        runner.scheduled = True
+        heapq.heappush(self.events, (runner.next_cycle, next(self.seq), CYCLE, runner))
+
+    def _wake_for(self, tool_type: str, priority: int) -> None:
+        """このキューを取れる Runner のうち、最も早く claim するものにイベントを積む"""
+        best: Optional[SimRunner] = None
+        best_time = math.inf
+        for runner in self.runners:
+            if tool_type not in runner.free_types():
+                continue
+            if runner.min_priority is not None and priority < runner.min_priority:
+                continue
+            wake = self._wake_time(runner, self.now)
+            if wake < best_time:
+                best, best_time = runner, wake
+        if best is not None and not best.scheduled:
+            self._schedule(best)
+
+    def _cycle(self, runner: SimRunner) -> None:
+        """polling_loop の1周: 空きスロットがある限り claim → poll_interval 待機"""
+        runner.scheduled = False
+        runner.holding = False
+        now = self.now
+        claimed = 0
+        while runner.free_types():
+            if runner.skip_request:
+                # 保留していた claim の応答（空振りとして数えた分を戻す）
+                runner.skip_request = False
+                self.empty_claims -= 1
+            else:
+                self.claim_requests += 1
+            now += self.latency
+            picked = self._pop_best(runner)
+            if picked is None:
+                self.empty_claims += 1
+                break
+            (tool_type, priority), (_, _, requested_at, duration) = picked
+            wait = now - requested_at
+            self.waits.append(wait)
+            self.waits_by_priority.setdefault(priority, []).append(wait)
+            self.waits_by_type.setdefault(tool_type, []).append(wait)
+            resource_class = runner.type_class[tool_type]
+            runner.acquire(resource_class)
+            # 終了 → report 送信後にスロット解放
+            held = duration + self.latency
+            self.busy_time[resource_class] = self.busy_time.get(resource_class, 0.0) + held
+            heapq.heappush(self.events, (now + held, next(self.seq), FINISH, (runner, resource_class)))
+            claimed += 1
+
+        requesting = bool(runner.free_types())
+        if self.policy == "backoff":
+            if claimed:
+                runner.interval = self.base_interval
+            elif requesting:
+                runner.interval = min(runner.interval * self.backoff_factor, self.backoff_max)
+        if self.policy == "long_poll" and requesting:
+            # 最後の空振り claim がそのまま保留される
+            runner.holding = True
+            runner.next_cycle = now + self.long_poll
+        else:
+            runner.next_cycle = now + runner.interval
+
+        # 取り切れなかった run があれば別の Runner を起こす
+        for tool_type, priority in [k for k, heap in self.queues.items() if heap]:
+            self._wake_for(tool_type, priority)
+
+    def _finish(self, runner: SimRunner, resource_class: str) -> None:
+        self.reports += 1
+        self._catch_up(runner, self.now)
+        runner.release(resource_class)
+        if not runner.scheduled and self._claimable_keys(runner):
+            self._schedule(runner)
+
+    def run(self) -> dict[str, Any]:
+        wall_started = time.perf_counter()
+        arrival_iter = iter(self.arrivals)
+        next_arrival = next(arrival_iter, None)
+
+        while self.events or next_arrival is not None:
+            if next_arrival is not None and (not self.events or next_arrival[0] <= self.events[0][0]):
+                self.now = next_arrival[0]
+                requested_at, tool_type, priority, duration = next_arrival
+                self._push_run(requested_at, tool_type, priority, duration)
+                self._wake_for(tool_type, priority)
+                next_arrival = next(arrival_iter, None)
+                continue
+            self.now, _, kind, payload = heapq.heappop(self.events)
+            if kind == CYCLE:
+                self._cycle(payload)
+            else:
+                self._finish(*payload)
+
+        horizon = max(self.now, self.arrivals[-1][0] if self.arrivals else 0.0)
+        for runner in self.runners:
+            self._catch_up(runner, horizon)
+        heartbeats = int(horizon / self.scenario["heartbeat_interval"]) * len(self.runners)
+        total_requests = self.claim_requests + heartbeats + self.reports
+        minutes = horizon / 60 if horizon else 1
+
+        return {
+            "policy": self.policy,
+            "runners": len(self.runners),
+            "poll_interval": self.base_interval,
+            "heartbeat_interval": self.scenario["heartbeat_interval"],
+            "simulated_days": horizon / 86400,
+            "runs": len(self.arrivals),
+            "claimed": len(self.waits),
+            "unclaimable": self.unclaimable,
+            "wait_sec": summarize(self.waits),
+            "wait_sec_by_priority": {p: summarize(w) for p, w in sorted(self.waits_by_priority.items())},
+            "wait_sec_by_type": {t: summarize(w) for t, w in sorted(self.waits_by_type.items())},
+            "max_queue": self.max_queue,
+            "utilization": {
+                name: self.busy_time.get(name, 0.0) / (slots * horizon) if slots and horizon else None
+                for name, slots in self.capacity.items()
+            },
+            "requests": {
+                "claim": self.claim_requests,
+                "claim_empty": self.empty_claims,
+                "heartbeat": heartbeats,
+                "report": self.reports,
+                "total": total_requests,
+                "per_min": total_requests / minutes,
+            },
+            "wall_sec": time.perf_counter() - wall_started,
+        }
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+def fmt(value: Optional[float], digits: int = 1) -> str:
+    return "-" if value is None else f"{value:,.{digits}f}"
+
+
+def print_results(results: list[dict[str, Any]]) -> None:
+    print("\n====== FLEET SIMULATION ======")
+    print("policy    | runners | poll s | wait p50/p95/p99/max s          | util                 | req/min | empty % | wall s")
+    print("----------|---------|--------|---------------------------------|----------------------|---------|---------|-------")
+    for r in results:
+        w = r["wait_sec"]
+        util = " ".join(f"{k}={fmt(v * 100 if v is not None else None, 0)}%" for k, v in r["utilization"].items())
+        claims = r["requests"]["claim"]
+        empty = r["requests"]["claim_empty"] / claims * 100 if claims else None
+        print(
+            f"{r['policy']:<9} | {r['runners']:>7} | {fmt(r['poll_interval']):>6} | "
+            f"{fmt(w['p50']):>7}/{fmt(w['p95']):>7}/{fmt(w['p99']):>7}/{fmt(w['max']):>7} | "
+            f"{util:<20} | {fmt(r['requests']['per_min']):>7} | {fmt(empty):>7} | {fmt(r['wall_sec'], 2):>6}"
+        )
+    first = results[0] if results else None
+    if first:
+        print(f"\nruns: {first['runs']} over {fmt(first['simulated_days'])} simulated days"
+              + (f" ({first['unclaimable']} with no matching resource class)" if first["unclaimable"] else ""))
+        for r in results:
+            by_priority = ", ".join(f"{p}: p95 {fmt(s['p95'])}s" for p, s in r["wait_sec_by_priority"].items())
+            print(f"  {r['policy']}/{r['runners']}/{fmt(r['poll_interval'])}s  priority {by_priority}  max queue {r['max_queue']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runner fleet discrete-event simulator")
+    parser.add_argument("--history", help="runs エクスポート（CSV/JSON/JSONL）。未指定なら合成トラフィック")
+    parser.add_argument("--resample-durations", action="store_true", help="履歴の実行時間を tool_type ごとの分布から引き直す")
+    parser.add_argument("--days", type=float, default=30, help="合成トラフィックの日数")
+    parser.add_argument("--runs-per-day", type=float, default=1000)
+    parser.add_argument("--mix", default="python_runner=0.5,excel=0.2,pad=0.15,bat=0.15", help="tool_type=重み")
+    parser.add_argument("--priority-mix", default="10=0.6,0=0.3,-10=0.1", help="priority=重み")
+    parser.add_argument("--durations", help="tool_type=中央値秒[:sigma]（対数正規）。履歴があれば未指定の型は経験分布")
+    parser.add_argument("--config", help="agent の config.json（resource_classes / 間隔 / claim_preferences を使う）")
+    parser.add_argument("--slots", type=int, help="max_concurrent_runs（--config より優先）")
+    parser.add_argument("--resource-classes", help="resource_classes 設定（JSON、--config より優先）")
+    parser.add_argument("--runners", default="10", help="Runner 台数（カンマ区切りで比較）")
+    parser.add_argument("--policy", default="poll", help="poll / backoff / long_poll（カンマ区切りで比較）")
+    parser.add_argument("--poll-interval", help="poll_interval_sec（カンマ区切りで比較、既定は config か 10）")
+    parser.add_argument("--heartbeat-interval", type=float, help="heartbeat_interval_sec（既定は config か 30）")
+    parser.add_argument("--backoff-factor", type=float, default=2.0)
+    parser.add_argument("--backoff-max", type=float, default=60.0)
+    parser.add_argument("--long-poll-sec", type=float, default=25.0)
+    parser.add_argument("--request-ms", type=float, default=150, help="ポータル API 1回あたりの往復時間")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    config: dict[str, Any] = {}
+    if args.config:
+        config = json.loads(Path(args.config).read_text(encoding="utf-8"))
+    if args.slots is not None:
+        config["max_concurrent_runs"] = args.slots
+    if args.resource_classes:
+        config["resource_classes"] = json.loads(args.resource_classes)
+    classes = resource_classes_from_config(config)
+    min_priority = (config.get("claim_preferences") or {}).get("min_priority")
+    poll_intervals = [float(v) for v in (args.poll_interval or str(config.get("poll_interval_sec", 10))).split(",")]
+    heartbeat_interval = args.heartbeat_interval or float(config.get("heartbeat_interval_sec", 30))
+
+    rng = random.Random(args.seed)
+    history = load_history(Path(args.history)) if args.history else []
+    samples: dict[str, list[float]] = {}
+    for h in history:
+        if h["duration"] is not None:
+            samples.setdefault(h["tool_type"], []).append(h["duration"])
+    durations = DurationModel(parse_durations(args.durations), samples, rng)
+    if history:
+        arrivals = arrivals_from_history(history, durations, args.resample_durations)
+    else:
+        arrivals = synthetic_arrivals(
+            args.days, args.runs_per_day, parse_weights(args.mix), parse_weights(args.priority_mix), durations, rng
+        )
+    if not arrivals:
+        print("No arrivals to simulate")
+        sys.exit(1)
+
+    results = []
+    for policy, runners, poll_interval in itertools.product(
+        args.policy.split(","), [int(n) for n in args.runners.split(",")], poll_intervals
+    ):
+        scenario = {
+            "policy": policy.strip(),
+            "fleet": [(classes, min_priority)] * runners,
+            "poll_interval": poll_interval,
+            "heartbeat_interval": heartbeat_interval,
+            "request_ms": args.request_ms,
+            "backoff_factor": args.backoff_factor,
+            "backoff_max": max(args.backoff_max, poll_interval),
+            "long_poll_sec": args.long_poll_sec,
+        }
+        results.append(FleetSimulator(scenario, arrivals, args.seed).run())
+
+    print_results(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+実行トレースの再生（record-and-replay）
+
+agent.py の trace_path で記録したトレース（JSONL）を fake_portal に流し直し、
+実際の agent.py に処理させる。実行部分は代役（replay_standins）に置き換え、
+記録された実行時間・終了コード・起動のみかどうか・キャンセルを再現する。
+
+同じトレースを異なる agent.py（ループの新旧）で再生し、結果を比較できる。
+
+例:
+  python replay_trace.py trace.jsonl --speed 10
+  python replay_trace.py trace.jsonl --speed 60 --compress-idle 300 --agent-config ../config.json
+  python replay_trace.py trace.jsonl --agent /path/to/old/agent.py --json old.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+from fake_portal import FakePortal  # noqa: E402
+
+AGENT_PATH = Path(__file__).resolve().parent.parent / "agent.py"
+
+EXIT_CODE_PATTERN = re.compile(r"Exit code: (-?\d+)")
+CANCELED_RUN_EXTRA_SEC = 3600
+
+# 再生時に元の設定から引き継がないキー
+OVERRIDDEN_KEYS = ("portal_url", "machine_key", "log_dir", "agent_log_path", "trace_path", "history_db", "lincoln")
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values: list[float]) -> dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else None,
+    }
+
+
+def load_trace(path: Path) -> list[dict[str, Any]]:
+    """トレースを run 単位のタイムラインにまとめる（claim が記録された run のみ）"""
+    events: dict[str, dict[str, dict[str, Any]]] = {}
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        event = json.loads(line)
+        if event.get("run_id"):
+            # 同じ種類のイベントは最初のものを使う（report のリトライ等）
+            events.setdefault(event["run_id"], {}).setdefault(event["event"], event)
+
+    runs = []
+    for run_id, e in events.items():
+        claim = e.get("claim")
+        if claim is None:
+            continue
+        task = claim["task"]
+        requested_at = claim["ts"]
+        if task.get("requested_at"):
+            requested_at = min(requested_at, datetime.fromisoformat(task["requested_at"]).timestamp())
+        exec_started = (e.get("spawn") or e.get("start") or claim)["ts"]
+        followup = e.get("followup")
+        report = e.get("report") or {}
+        if followup:
+            usage = followup.get("resource_usage") or {}
+            duration = usage.get("duration_sec") or followup["ts"] - exec_started
+            exit_code = followup.get("exit_code", 0)
+        else:
+            duration = (e.get("executed") or report or claim)["ts"] - exec_started
+            exit_code = 0 if report.get("status", "success") == "success" else 1
+            matched = EXIT_CODE_PATTERN.search(report.get("error") or "")
+            if matched:
+                exit_code = int(matched.group(1))
+        duration = max(0.0, duration)
+        cancel = e.get("cancel")
+        standin_duration = duration
+        if report.get("status") == "canceled" and cancel:
+            # キャンセルで打ち切られた run は、キャンセル要求が届くまで走り続ける代役にする
+            standin_duration += CANCELED_RUN_EXTRA_SEC
+        runs.append({
+            "run_id": run_id,
+            "tool_type": task["tool_type"],
+            "tool_name": task.get("tool_name"),
+            "priority": task.get("priority", 0),
+            "requested_at": requested_at,
+            "claimed_at": claim["ts"],
+            "duration_sec": duration,
+            "standin_duration_sec": standin_duration,
+            "exit_code": exit_code,
+            "launch_only": followup is not None,
+            "cancel_at": cancel["ts"] if cancel else None,
+            "status": report.get("status"),
+        })
+    runs.sort(key=lambda r: r["requested_at"])
+    return runs
+
+
+def build_timeline(runs: list[dict[str, Any]], compress_idle: Optional[float]) -> dict[str, float]:
+    """記録時刻 → 再生時刻（秒, 先頭 0）の対応。compress_idle 秒を超える空白は詰める"""
+    offsets: dict[str, float] = {}
+    shift = 0.0
+    busy_until = runs[0]["requested_at"] if runs else 0.0
+    origin = busy_until
+    for r in runs:
+        if compress_idle is not None and r["requested_at"] - busy_until > compress_idle:
+            shift += r["requested_at"] - busy_until - compress_idle
+        offsets[r["run_id"]] = r["requested_at"] - origin - shift
+        busy_until = max(busy_until, r["claimed_at"] + r["duration_sec"])
+    return offsets
+
+
+def feed(
+    portal: FakePortal,
+    runs: list[dict[str, Any]],
+    offsets: dict[str, float],
+    speed: float,
+    started: float,
+    stop: threading.Event,
+) -> None:
+    """記録時刻に合わせてキューへ投入し、キャンセルも同じタイミングで要求する"""
+    actions: list[tuple[float, str, dict[str, Any]]] = []
+    for r in runs:
+        actions.append((offsets[r["run_id"]], "enqueue", r))
+        if r["cancel_at"] is not None:
+            actions.append((offsets[r["run_id"]] + r["cancel_at"] - r["requested_at"], "cancel", r))
+    actions.sort(key=lambda a: a[0])
+
+    for offset, action, r in actions:
+        delay = started + offset / speed - time.time()
+        if delay > 0 and stop.wait(delay):
+            return
+        if action == "enqueue":
+            portal.enqueue(
+                r["tool_type"],
+                None,
+                name=r["tool_name"],
+                run_config={
+                    "standin": {
+                        "duration_sec": r["standin_duration_sec"] / speed,
+                        "exit_code": r["exit_code"],
+                        "launch_only": r["launch_only"],
+                    }
+                },
+                priority=r["priority"],
+                run_id=r["run_id"],
+            )
+        else:
+            portal.request_cancel(r["run_id"])
+
+
+def write_agent_config(args: argparse.Namespace, work: Path, portal: FakePortal, portal_url: str) -> Path:
+    config: dict[str, Any] = {}
+    if args.agent_config:
+        config = json.loads(Path(args.agent_config).read_text(encoding="utf-8"))
+        for key in OVERRIDDEN_KEYS:
+            config.pop(key, None)
+    poll_interval = float(config.get("poll_interval_sec", 10))
+    heartbeat_interval = float(config.get("heartbeat_interval_sec", 30))
+    if args.scale_intervals:
+        poll_interval /= args.speed
+        heartbeat_interval /= args.speed
+    config.update({
+        "portal_url": portal_url,
+        "machine_key": portal.machine_key,
+        "poll_interval_sec": poll_interval,
+        "heartbeat_interval_sec": heartbeat_interval,
+        "replay_standins": True,
+        "agent_log_path": str(work / "agent.log"),
+        "trace_path": str(work / "replay-trace.jsonl"),
+        "history_db": str(work / "run_history.db"),
+    })
+    path = work / "config.json"
+    path.write_text(json.dumps(config, indent=2))
+    return path
+
+
+def wait_until_done(portal: FakePortal, runs: list[dict[str, Any]], timeout: float) -> bool:
+    """全 run の report（起動のみの run は followup も）を待つ"""
+    launch_only = {r["run_id"] for r in runs if r["launch_only"]}
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with portal.lock:
+            done = len(portal.runs) == len(runs) and all(
+                r["status"] not in ("queued", "running")
+                and (r["run_id"] not in launch_only or r["followup"] is not None or r["status"] != "success")
+                for r in portal.runs.values()
+            )
+        if done:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def replay(args: argparse.Namespace) -> dict[str, Any]:
+    runs = load_trace(Path(args.trace))
+    if not runs:
+        raise SystemExit("No claimed runs in trace")
+    offsets = build_timeline(runs, args.compress_idle)
+    work = Path(tempfile.mkdtemp(prefix="tc-runner-replay-"))
+    portal = FakePortal(latency_ms=args.latency_ms)
+    portal_url = portal.start()
+    config_path = write_agent_config(args, work, portal, portal_url)
+
+    stop = threading.Event()
+    agent_cmd = [sys.executable, str(Path(args.agent).resolve()), "--config", str(config_path)]
+    with open(work / "agent.stdout", "w") as out:
+        agent = subprocess.Popen(agent_cmd, stdout=out, stderr=subprocess.STDOUT)
+    started = time.time()
+    feeder = threading.Thread(target=feed, args=(portal, runs, offsets, args.speed, started, stop), daemon=True)
+    feeder.start()
+    try:
+        completed = wait_until_done(portal, runs, args.timeout)
+        portal.pending_command = "stop"
+        try:
+            agent.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            agent.terminate()
+            agent.wait(timeout=10)
+    finally:
+        stop.set()
+        if agent.poll() is None:
+            agent.kill()
+        portal.stop()
+
+    recorded_wait = [(r["claimed_at"] - r["requested_at"]) for r in runs]
+    replay_wait = []
+    mismatches = []
+    recorded_status = {r["run_id"]: r["status"] for r in runs}
+    for run in portal.runs.values():
+        if run["claimed_at"]:
+            # 記録時間のスケールに戻す
+            replay_wait.append((run["claimed_at"] - run["requested_at"]) * args.speed)
+        if recorded_status.get(run["run_id"]) and run["report"] and run["report"].get("status") != recorded_status[run["run_id"]]:
+            mismatches.append(run["run_id"])
+    finished = [run["followup_at"] or run["reported_at"] for run in portal.runs.values() if run["reported_at"]]
+    recorded_span = max(r["claimed_at"] + r["duration_sec"] for r in runs) - runs[0]["requested_at"]
+
+    return {
+        "completed": completed,
+        "runs": len(runs),
+        "reported": sum(1 for run in portal.runs.values() if run["reported_at"]),
+        "speed": args.speed,
+        "recorded_wait_sec": summarize(recorded_wait),
+        "replay_wait_sec": summarize(replay_wait),
+        "recorded_span_sec": recorded_span,
+        "replay_span_sec": ((max(finished) - started) * args.speed) if finished else None,
+        "status_mismatches": mismatches,
+        "requests": dict(portal.request_counts),
+        "work_dir": str(work),
+    }
+
+
+def fmt(value: Optional[float], unit: str = "") -> str:
+    return "-" if value is None else f"{value:,.1f}{unit}"
+
+
+def print_report(result: dict[str, Any]) -> None:
+    print(f"\n====== TRACE REPLAY (x{result['speed']:g}) ======")
+    print(f"Runs reported   : {result['reported']}/{result['runs']}")
+    for key, label in (("recorded_wait_sec", "Wait (recorded)"), ("replay_wait_sec", "Wait (replay)")):
+        s = result[key]
+        print(f"{label:<16}: p50 {fmt(s['p50'], 's')}  p95 {fmt(s['p95'], 's')}  max {fmt(s['max'], 's')}")
+    print(f"Span            : recorded {fmt(result['recorded_span_sec'], 's')}  replay {fmt(result['replay_span_sec'], 's')}")
+    print(f"Status mismatch : {len(result['status_mismatches'])}")
+    print(f"Requests        : {result['requests']}")
+    print(f"Work dir        : {result['work_dir']}")
+    print("(時間はすべて記録時のスケールに換算)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded runner trace against the fake portal")
+    parser.add_argument("trace", help="agent.py の trace_path で記録した JSONL")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（10 = 10倍速）")
+    parser.add_argument("--compress-idle", type=float, help="この秒数を超える無負荷区間を詰める")
+    parser.add_argument("--agent", default=str(AGENT_PATH), help="再生させる agent.py（新旧比較用）")
+    parser.add_argument("--agent-config", help="元の config.json（resource_classes 等を引き継ぐ）")
+    parser.add_argument("--no-scale-intervals", dest="scale_intervals", action="store_false",
+                        help="poll / heartbeat 間隔を再生速度で縮めない")
+    parser.add_argument("--latency-ms", type=float, default=0, help="スタブの応答遅延")
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    result = replay(args)
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+    if not result["completed"]:
+        print("\nFAILED: not all runs were reported before timeout")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
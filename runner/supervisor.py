@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+TC Portal Runner Supervisor
+
+agent.py を子プロセスとして起動し、ワーキングセット（RSS）とハンドル数の増加を監視する。
+閾値を超え続けたら agent にドレイン（新規 claim を止め、実行中の run と送信中の report の
+完了を待って終了）を要求し、起動し直す。異常終了した場合もバックオフ付きで起動し直す。
+
+親プロセスは標準ライブラリのみで動く（pystray / PIL / requests は読み込まない）。
+設定は agent と同じ設定ファイルの "supervisor" セクション、状態と再起動履歴は
+state_path（デフォルト: supervisor_state.json）に書き出す。
+
+  python supervisor.py [--config config.json]
+"""
+from __future__ import annotations
+
+import argparse
+import ctypes
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+IS_WINDOWS = os.name == "nt"
+BASE_DIR = Path(__file__).resolve().parent
+AGENT_PATH = BASE_DIR / "agent.py"
+
+# agent.py の終了コード（EXIT_RESTART と合わせる）
+EXIT_RESTART = 75
+
+DEFAULTS: dict[str, Any] = {
+    "check_interval_sec": 60,
+    "warmup_sec": 600,  # 起動直後の読み込みが落ち着いてから基準の RSS を取る
+    "max_rss_mb": 800,
+    "max_rss_growth_mb": 300,  # 基準からの増加
+    "max_handles": 10000,
+    "breach_checks": 3,  # 連続で超えたら再起動（一時的なピークでは再起動しない）
+    "drain_timeout_sec": None,  # 未設定なら agent の execution_timeout + terminate_grace_sec + 300
+    "drain_abort_sec": 120,  # 待ち切れなかった run を agent がキャンセル・報告するまでの猶予
+    "crash_backoff_max_sec": 300,
+    "history_limit": 50,
+}
+
+_agent_log_path = BASE_DIR / "agent.log"
+_trace_path: Optional[Path] = None
+
+
+def log(message: str) -> None:
+    """agent と同じログファイルに [supervisor] 付きで出力"""
+    line = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [supervisor] {message}"
+    print(line, flush=True)
+    try:
+        with open(_agent_log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError:
+        pass
+
+
+def trace(event: str, **fields: Any) -> None:
+    """agent の trace_path に同じ形式で追記"""
+    if _trace_path is None:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "event": event, "run_id": None, **fields}, default=str)
+    try:
+        with open(_trace_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError:
+        pass
+
+
+def load_config(config_path: Optional[str]) -> dict[str, Any]:
+    """agent.py の load_config と同じ順で設定ファイルを探す"""
+    if config_path:
+        path = Path(config_path)
+    else:
+        computer_name = os.environ.get("COMPUTERNAME", "").upper()
+        path = BASE_DIR / f"config-{computer_name}.json"
+        if not path.exists():
+            path = BASE_DIR / "config.json"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        # 設定エラーは agent 側で表示させる
+        print(f"Warning: Failed to read {path}: {e}")
+        return {}
+
+
+# ---------------------------------------------------------------------------
+# プロセスのリソース使用量
+# Windows: GetProcessMemoryInfo（WorkingSetSize）/ GetProcessHandleCount
+# Linux: /proc/<pid>/status（VmRSS）/ /proc/<pid>/fd の数
+# ---------------------------------------------------------------------------
+if IS_WINDOWS:
+    from ctypes import wintypes
+
+    class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _psapi = ctypes.WinDLL("psapi", use_last_error=True)
+    _kernel32.OpenProcess.restype = wintypes.HANDLE
+
+
+def process_usage(pid: int) -> dict[str, Optional[float]]:
+    """RSS（MB）とハンドル数（POSIX はファイルディスクリプタ数）"""
+    rss_mb: Optional[float] = None
+    handles: Optional[float] = None
+    if IS_WINDOWS:
+        handle = _kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return {"rss_mb": None, "handles": None}
+        try:
+            counters = _PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            if _psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                rss_mb = counters.WorkingSetSize / 1048576
+            count = wintypes.DWORD()
+            if _kernel32.GetProcessHandleCount(handle, ctypes.byref(count)):
+                handles = count.value
+        finally:
+            _kernel32.CloseHandle(handle)
+    else:
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss_mb = int(line.split()[1]) / 1024
+                        break
+            handles = len(os.listdir(f"/proc/{pid}/fd"))
+        except OSError:
+            pass
+    return {
+        "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+        "handles": handles,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 監視ループ
+# ---------------------------------------------------------------------------
+class Supervisor:
+    """agent.py の起動・監視・再起動"""
+
+    def __init__(self, agent_args: list[str], settings: dict[str, Any], state_path: Path) -> None:
+        self.agent_args = agent_args
+        self.settings = settings
+        self.state_path = state_path
+        self.drain_file = state_path.with_name(f"supervisor-drain-{os.getpid()}.request")
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = time.time()
+        self.agent_started_at = 0.0
+        self.baseline_rss_mb: Optional[float] = None
+        self.peak_rss_mb = 0.0
+        self.last_usage: dict[str, Optional[float]] = {}
+        self.breaches = 0
+        self.history: list[dict[str, Any]] = self._load_history()
+
+    def _load_history(self) -> list[dict[str, Any]]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("restarts", [])
+        except (OSError, ValueError):
+            return []
+
+    def launch(self) -> None:
+        self.drain_file.unlink(missing_ok=True)
+        env = dict(os.environ)
+        env["TC_SUPERVISOR_DRAIN_FILE"] = str(self.drain_file)
+        self.process = subprocess.Popen(
+            [sys.executable, str(AGENT_PATH), *self.agent_args],
+            cwd=str(BASE_DIR),
+            env=env,
+        )
+        self.agent_started_at = time.time()
+        self.baseline_rss_mb = None
+        self.peak_rss_mb = 0.0
+        self.breaches = 0
+        log(f"Agent started (PID: {self.process.pid})")
+
+    def check(self) -> Optional[str]:
+        """閾値を超え続けていれば再起動理由を返す"""
+        assert self.process is not None
+        usage = process_usage(self.process.pid)
+        self.last_usage = usage
+        rss = usage["rss_mb"]
+        handles = usage["handles"]
+        uptime = time.time() - self.agent_started_at
+        if rss is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+            if self.baseline_rss_mb is None and uptime >= self.settings["warmup_sec"]:
+                self.baseline_rss_mb = rss
+                log(f"Baseline RSS: {rss:.0f} MB (handles: {handles})")
+
+        reason = None
+        if rss is not None and rss > self.settings["max_rss_mb"]:
+            reason = f"RSS {rss:.0f} MB > {self.settings['max_rss_mb']} MB"
+        elif (
+            rss is not None
+            and self.baseline_rss_mb is not None
+            and rss - self.baseline_rss_mb > self.settings["max_rss_growth_mb"]
+        ):
+            reason = f"RSS grew {rss - self.baseline_rss_mb:.0f} MB since baseline ({self.baseline_rss_mb:.0f} MB)"
+        elif handles is not None and handles > self.settings["max_handles"]:
+            reason = f"{handles} handles > {self.settings['max_handles']}"
+
+        self.breaches = self.breaches + 1 if reason else 0
+        self.write_state()
+        if reason and self.breaches >= self.settings["breach_checks"]:
+            return reason
+        return None
+
+    def drain(self) -> float:
+        """ドレインを要求して終了を待つ。戻り値は待った秒数"""
+        assert self.process is not None
+        started = time.time()
+        self.drain_file.touch()
+        try:
+            self.process.wait(timeout=self.settings["drain_timeout_sec"])
+        except subprocess.TimeoutExpired:
+            # 強制終了すると実行中の run がポータルで running のまま残るため、先に agent に
+            # キャンセルと報告をさせる（ドレイン要求ファイルの中身を "abort" にする）
+            log(f"Drain timed out after {self.settings['drain_timeout_sec']}s — asking agent to cancel active runs")
+            self.drain_file.write_text("abort", encoding="utf-8")
+            try:
+                self.process.wait(timeout=self.settings["drain_abort_sec"])
+            except subprocess.TimeoutExpired:
+                log(f"Agent did not exit within {self.settings['drain_abort_sec']}s — terminating agent")
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+        self.drain_file.unlink(missing_ok=True)
+        return time.time() - started
+
+    def record_restart(self, reason: str, exit_code: Optional[int], drain_sec: Optional[float] = None) -> None:
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "reason": reason,
+            "exit_code": exit_code,
+            "uptime_sec": round(time.time() - self.agent_started_at),
+            "rss_mb": self.last_usage.get("rss_mb"),
+            "baseline_rss_mb": self.baseline_rss_mb,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "handles": self.last_usage.get("handles"),
+            "drain_sec": round(drain_sec, 1) if drain_sec is not None else None,
+        }
+        self.history = (self.history + [entry])[-self.settings["history_limit"]:]
+        trace("supervisor_restart", **entry)
+        self.write_state()
+
+    def write_state(self) -> None:
+        """現在値と再起動履歴を書き出す（一時ファイル経由で置き換え）"""
+        state = {
+            "supervisor_pid": os.getpid(),
+            "supervisor_started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "agent": {
+                "pid": self.process.pid if self.process else None,
+                "started_at": datetime.fromtimestamp(self.agent_started_at).isoformat(timespec="seconds"),
+                "uptime_sec": round(time.time() - self.agent_started_at),
+                "rss_mb": self.last_usage.get("rss_mb"),
+                "baseline_rss_mb": self.baseline_rss_mb,
+                "peak_rss_mb": round(self.peak_rss_mb, 1),
+                "handles": self.last_usage.get("handles"),
+                "breaches": self.breaches,
+            },
+            "restart_count": len(self.history),
+            "restarts": self.history,
+            "settings": self.settings,
+        }
+        tmp = self.state_path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            log(f"Failed to write state: {e}")
+
+    def run(self) -> int:
+        backoff = 5.0
+        self.launch()
+        while True:
+            assert self.process is not None
+            try:
+                code = self.process.wait(timeout=self.settings["check_interval_sec"])
+            except subprocess.TimeoutExpired:
+                reason = self.check()
+                if reason:
+                    log(f"Restarting agent: {reason}")
+                    drain_sec = self.drain()
+                    self.record_restart(reason, self.process.returncode, drain_sec)
+                    self.launch()
+                continue
+            except KeyboardInterrupt:
+                log("Interrupted — draining agent")
+                self.drain()
+                return 0
+
+            uptime = time.time() - self.agent_started_at
+            if code == 0:
+                # ポータルの停止コマンド・トレイの「停止」など、意図した終了
+                log("Agent exited normally — supervisor stopping")
+                self.write_state()
+                return 0
+            if code == EXIT_RESTART:
+                reason = "agent requested restart"
+                delay = 0.0
+            else:
+                reason = f"agent exited with code {code}"
+                # 起動直後に落ち続ける場合に備えてバックオフ（10分動けばリセット）
+                if uptime >= 600:
+                    backoff = 5.0
+                delay = backoff
+                backoff = min(backoff * 2, self.settings["crash_backoff_max_sec"])
+            log(f"Restarting agent: {reason}" + (f" (in {delay:.0f}s)" if delay else ""))
+            self.record_restart(reason, code)
+            time.sleep(delay)
+            self.launch()
+
+
+def main() -> None:
+    global _agent_log_path, _trace_path
+
+    parser = argparse.ArgumentParser(description="TC Portal Runner Supervisor")
+    parser.add_argument("--config", help="設定ファイルのパス（agent.py にもそのまま渡す）")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    settings = {**DEFAULTS, **config.get("supervisor", {})}
+    if settings["drain_timeout_sec"] is None:
+        # 実行中の run が agent 自身のタイムアウトで終わるまで待つ
+        settings["drain_timeout_sec"] = config.get("execution_timeout", 3600) + config.get("terminate_grace_sec", 10) + 300
+    if config.get("agent_log_path"):
+        _agent_log_path = Path(config["agent_log_path"])
+    if config.get("trace_path"):
+        _trace_path = Path(config["trace_path"])
+    state_path = Path(settings.get("state_path") or BASE_DIR / "supervisor_state.json")
+
+    # agent は BASE_DIR で起動するため相対パスは解決しておく
+    agent_args = ["--config", os.path.abspath(args.config)] if args.config else []
+    log(
+        f"Supervising agent (max RSS {settings['max_rss_mb']} MB, growth {settings['max_rss_growth_mb']} MB, "
+        f"handles {settings['max_handles']}, check every {settings['check_interval_sec']}s)"
+    )
+    sys.exit(Supervisor(agent_args, settings, state_path).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
-import { History, ExternalLink, Clock, CheckCircle, XCircle, Loader2, Ban } from "lucide-react";
+import { History, ExternalLink, Clock, CheckCircle, XCircle, Loader2, Ban, FileText } from "lucide-react";
 import { getRuns } from "@/lib/queries/runs";
 import { getEnabledMachines } from "@/lib/actions/machines";
 import { LogPathActions } from "@/components/runs/LogPathActions";
 import { RunnerStatusPanel } from "@/components/runs/RunnerStatusPanel";
+import { RunsAutoRefresh } from "@/components/runs/RunsAutoRefresh";
+import { formatRunMetrics } from "@/lib/run-metrics";
 import type { RunStatus } from "@/types/database";
 
 // ステータスの日本語ラベルとスタイル
@@ -35,9 +37,11 @@ export default async function RunsPage() {
     getEnabledMachines(),
   ]);
   const machines = machinesResult.machines || [];
+  const hasActiveRuns = runs.some((run) => run.status === "queued" || run.status === "running");
 
   return (
     <div className="space-y-6">
+      <RunsAutoRefresh active={hasActiveRuns} />
       <div className="flex items-center gap-3">
         <History className="w-6 h-6" />
         <h1 className="text-2xl font-bold">実行履歴</h1>
@@ -67,6 +71,7 @@ export default async function RunsPage() {
               {runs.map((run) => {
                 const statusConfig = STATUS_CONFIG[run.status];
                 const StatusIcon = statusConfig.icon;
+                const metricsText = formatRunMetrics(run.metrics, run.started_at, run.finished_at);
                 return (
                   <div key={run.id} data-testid={`run-row-${run.id}`} className="grid grid-cols-7 gap-4 text-sm py-2 border-b last:border-0 items-center">
                     <div>
@@ -74,6 +79,24 @@ export default async function RunsPage() {
                         <StatusIcon className={`w-3 h-3 ${run.status === "running" ? "animate-spin" : ""}`} />
                         {statusConfig.label}
                       </Badge>
+                      {run.status === "running" && run.slow_at && (
+                        <span className="text-xs text-orange-600" title="過去の実行時間の99%タイルを超えています">
+                          通常より遅延
+                        </span>
+                      )}
+                      {run.status === "running" && (run.progress !== null || run.progress_message) && (
+                        <div className="mt-1 space-y-0.5" title={run.progress_message || undefined}>
+                          {run.progress !== null && (
+                            <div className="h-1.5 w-24 rounded bg-muted overflow-hidden">
+                              <div className="h-full bg-primary" style={{ width: `${run.progress}%` }} />
+                            </div>
+                          )}
+                          <p className="text-xs text-muted-foreground truncate max-w-[140px]">
+                            {run.progress !== null && `${Math.round(run.progress)}% `}
+                            {run.progress_message}
+                          </p>
+                        </div>
+                      )}
                     </div>
                     <div className="font-medium truncate" title={run.tools?.name}>
                       {run.tools?.name || "不明"}
@@ -85,7 +108,13 @@ export default async function RunsPage() {
                       {formatDateTime(run.started_at)}
                     </div>
                     <div className="text-muted-foreground">
-                      {formatDateTime(run.finished_at)}
+                      {run.status === "running" && run.expected_finish_at ? (
+                        <span title="過去の実行時間からの見込み">
+                          {formatDateTime(run.expected_finish_at)} 予定
+                        </span>
+                      ) : (
+                        formatDateTime(run.finished_at)
+                      )}
                     </div>
                     <div className="flex items-center gap-2">
                       {run.summary && (
@@ -98,6 +127,16 @@ export default async function RunsPage() {
                           {run.error_message}
                         </span>
                       )}
+                      {metricsText && (
+                        <span className="text-xs text-muted-foreground truncate max-w-[120px]" title={metricsText}>
+                          {metricsText}
+                        </span>
+                      )}
+                      {run.output_excerpt && (
+                        <span className="text-muted-foreground cursor-help" title={run.output_excerpt}>
+                          <FileText className="w-4 h-4" />
+                        </span>
+                      )}
                       {run.log_url && (
                         <a
                           href={run.log_url}
@@ -111,7 +150,7 @@ export default async function RunsPage() {
                       )}
                     </div>
                     <div>
-                      {run.log_path && <LogPathActions logPath={run.log_path} />}
+                      {run.log_path && <LogPathActions logPath={run.log_path} runId={run.id} />}
                     </div>
                   </div>
                 );
@@ -8,6 +8,7 @@ import { Badge } from "@/components/ui/badge";
 import { Button } from "@/components/ui/button";
 import { ToolIcon } from "@/components/tools/ToolIcon";
 import { ExecuteConfirmDialog } from "@/components/tools/ExecuteConfirmDialog";
+import { formatRunMetrics } from "@/lib/run-metrics";
 import type { Tool, Category, RunWithDetails, RunStatus } from "@/types/database";
 import { TOOL_TYPE_LABELS, TOOL_TYPE_VARIANTS } from "@/types/database";
 
@@ -239,9 +240,25 @@ export function ToolDetailClient({ tool, category, runs, lastSuccess, userId }:
                         {run.error_message && (
                           <p className="text-xs text-red-500 line-clamp-1">{run.error_message}</p>
                         )}
+                        {run.status === "running" && (run.progress !== null || run.progress_message) && (
+                          <p className="text-xs text-muted-foreground line-clamp-1">
+                            {run.progress !== null && `${Math.round(run.progress)}% `}
+                            {run.progress_message}
+                          </p>
+                        )}
+                        {run.metrics && (
+                          <p className="text-xs text-muted-foreground line-clamp-1">
+                            {formatRunMetrics(run.metrics, run.started_at, run.finished_at)}
+                          </p>
+                        )}
                       </div>
                     </div>
                     <div className="text-xs text-muted-foreground">
+                      {run.status === "running" && run.expected_finish_at && (
+                        <span className={run.slow_at ? "text-orange-600" : undefined}>
+                          {run.slow_at ? "遅延・" : ""}{formatDate(run.expected_finish_at)} 終了予定
+                        </span>
+                      )}
                       {run.finished_at && run.started_at && (
                         <span>
                           {Math.round((new Date(run.finished_at).getTime() - new Date(run.started_at).getTime()) / 1000)}秒
@@ -9,8 +9,13 @@ import { createHash, randomBytes } from "crypto";
  * Headers:
  *   X-Machine-Key: マシンキー（必須）
  *
+ * Body (JSON, 任意):
+ *   tool_types?: string[] - 今すぐ開始できる tool_type（空きスロットのあるリソースクラス分）
+ *   min_priority?: number - この優先度以上の run のみ取得（Runner の claim 設定）
+ *
  * Response:
  *   200: タスクを取得成功
+ *        trace_id: run ID（UUID）を 32 桁の16進にしたもの。Runner のスパンで共有する
  *   204: キューにタスクがない
  *   401: 認証失敗
  *   403: マシンが無効
@@ -26,6 +31,25 @@ export async function POST(request: NextRequest) {
     );
   }
 
+  // 取得対象の tool_type（オプション）
+  let toolTypes: string[] | null = null;
+  let minPriority: number | null = null;
+  try {
+    const body = await request.json();
+    if (Array.isArray(body.tool_types)) {
+      toolTypes = body.tool_types.filter((t: unknown): t is string => typeof t === "string");
+    }
+    if (Number.isInteger(body.min_priority)) {
+      minPriority = body.min_priority;
+    }
+  } catch {
+    // ボディがない場合は全 tool_type が対象
+  }
+
+  if (toolTypes && toolTypes.length === 0) {
+    return new NextResponse(null, { status: 204 });
+  }
+
   const supabase = createAdminClient();
 
   // マシンキーをハッシュ化して照合
@@ -53,7 +77,11 @@ export async function POST(request: NextRequest) {
 
   // claim_run関数を呼び出してキューからタスクを取得
   const { data: claimed, error: claimError } = await supabase
-    .rpc("claim_run", { p_machine_id: machine.id });
+    .rpc("claim_run", {
+      p_machine_id: machine.id,
+      p_tool_types: toolTypes,
+      p_min_priority: minPriority,
+    });
 
   if (claimError) {
     console.error("Error claiming run:", claimError);
@@ -75,10 +103,13 @@ export async function POST(request: NextRequest) {
   const runTokenHash = createHash("sha256").update(runToken).digest("hex");
 
   // run_token_hashを更新（claim_run関数では更新していないため）
-  await supabase
+  // requested_at は Runner 側のトレース（キュー待ち時間の再現）用に返す
+  const { data: updatedRun } = await supabase
     .from("runs")
     .update({ run_token_hash: runTokenHash })
-    .eq("id", task.run_id);
+    .eq("id", task.run_id)
+    .select("requested_at")
+    .single();
 
   // ポータルのベースURL（環境変数から取得）
   const portalBaseUrl = process.env.NEXT_PUBLIC_APP_URL || "http://localhost:3000";
@@ -94,6 +125,9 @@ export async function POST(request: NextRequest) {
       run_config: task.run_config,
     },
     payload: task.payload,
+    priority: task.priority,
+    requested_at: updatedRun?.requested_at ?? null,
+    trace_id: task.run_id.replace(/-/g, ""),
     callback_url: `${portalBaseUrl}/api/runs/callback`,
   });
 }
@@ -1,6 +1,13 @@
 import { NextRequest, NextResponse } from "next/server";
 import { createAdminClient } from "@/lib/supabase/admin";
 import { createHash } from "crypto";
+import { runnerLogSecret } from "@/lib/runner-log";
+
+interface RunEstimate {
+  run_id: string;
+  expected_finish_at: string;
+  slow?: boolean;
+}
 
 /**
  * POST /api/runner/heartbeat
@@ -12,9 +19,14 @@ import { createHash } from "crypto";
  * Body (JSON):
  *   hostname?: string  - RunnerのPC名（COMPUTERNAME）
  *   starting?: boolean - 起動直後のハートビート（古いコマンドを無視）
+ *   profile_path?: string - profile コマンドの結果（.folded）のパス
+ *   run_estimates?: { run_id, expected_finish_at, slow }[] - 実行中 run の終了予定（前回から変わったもののみ）
+ *   log_server_port?: number | null - ログ配信サーバーのポート（無効なら null）
  *
  * Response:
- *   200: 成功（command フィールドにペンディングコマンドを含む場合あり）
+ *   200: 成功（command フィールドにペンディングコマンドを含む場合あり: stop / profile:<秒数>）
+ *        cancel_run_ids: このマシンで実行中かつキャンセル要求のある run ID 一覧
+ *        log_secret: ログ配信の署名鍵（log_server_port を送った場合のみ）
  *   401: 認証失敗
  *   403: マシンが無効
  *   500: サーバーエラー
@@ -32,10 +44,22 @@ export async function POST(request: NextRequest) {
   // リクエストボディを取得（オプション）
   let hostname: string | null = null;
   let starting = false;
+  let profilePath: string | null = null;
+  let runEstimates: RunEstimate[] = [];
+  let logServerPort: number | null | undefined;
   try {
     const body = await request.json();
     hostname = body.hostname || null;
     starting = body.starting === true;
+    profilePath = typeof body.profile_path === "string" ? body.profile_path : null;
+    if ("log_server_port" in body) {
+      logServerPort = Number.isInteger(body.log_server_port) ? body.log_server_port : null;
+    }
+    if (Array.isArray(body.run_estimates)) {
+      runEstimates = body.run_estimates.filter(
+        (e: RunEstimate) => typeof e?.run_id === "string" && typeof e?.expected_finish_at === "string"
+      );
+    }
   } catch {
     // ボディがない場合は無視
   }
@@ -66,7 +90,13 @@ export async function POST(request: NextRequest) {
   }
 
   // last_seen_at と hostname を更新
-  const updateData: { last_seen_at: string; hostname?: string } = {
+  const updateData: {
+    last_seen_at: string;
+    hostname?: string;
+    last_profile_path?: string;
+    last_profile_at?: string;
+    log_server_port?: number | null;
+  } = {
     last_seen_at: new Date().toISOString(),
   };
 
@@ -75,6 +105,17 @@ export async function POST(request: NextRequest) {
     updateData.hostname = hostname;
   }
 
+  // ログ配信サーバー（古い Runner は送らないので変更しない）
+  if (logServerPort !== undefined) {
+    updateData.log_server_port = logServerPort;
+  }
+
+  // profile コマンドの結果パス
+  if (profilePath) {
+    updateData.last_profile_path = profilePath;
+    updateData.last_profile_at = updateData.last_seen_at;
+  }
+
   const { error: updateError } = await supabase
     .from("machines")
     .update(updateData)
@@ -88,6 +129,24 @@ export async function POST(request: NextRequest) {
     );
   }
 
+  // 実行中 run の終了予定・遅延（このマシンで実行中のものだけ更新）
+  const now = updateData.last_seen_at;
+  for (const estimate of runEstimates) {
+    const { error: estimateError } = await supabase
+      .from("runs")
+      .update({
+        expected_finish_at: estimate.expected_finish_at,
+        ...(estimate.slow ? { slow_at: now } : {}),
+      })
+      .eq("id", estimate.run_id)
+      .eq("machine_id", machine.id)
+      .eq("status", "running");
+
+    if (estimateError) {
+      console.error("Error updating run estimate:", estimateError);
+    }
+  }
+
   // pending_command の処理
   let command: string | null = null;
   if (machine.pending_command) {
@@ -102,10 +161,24 @@ export async function POST(request: NextRequest) {
       .eq("id", machine.id);
   }
 
+  // キャンセル要求のある実行中 run（Runner がプロセスツリーを終了して canceled を報告）
+  const { data: cancelRuns, error: cancelError } = await supabase
+    .from("runs")
+    .select("id")
+    .eq("machine_id", machine.id)
+    .eq("status", "running")
+    .not("cancel_requested_at", "is", null);
+
+  if (cancelError) {
+    console.error("Error fetching cancel requests:", cancelError);
+  }
+
   return NextResponse.json({
     success: true,
     machine_id: machine.id,
     machine_name: machine.name,
     command,
+    cancel_run_ids: (cancelRuns || []).map((r) => r.id),
+    ...(logServerPort ? { log_secret: runnerLogSecret(machine.id) } : {}),
   });
 }
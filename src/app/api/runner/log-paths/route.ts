@@ -0,0 +1,101 @@
+import { NextRequest, NextResponse } from "next/server";
+import { createAdminClient } from "@/lib/supabase/admin";
+import { createHash } from "crypto";
+
+interface LogPathMove {
+  run_id: string;
+  log_path: string | null;
+}
+
+// 1リクエストで受け付ける run 数の上限
+const MAX_MOVES = 500;
+
+/**
+ * POST /api/runner/log-paths
+ * Runner がログの保持（log_retention / logs prune）で圧縮・削除したラン ログの新しいパスを送るエンドポイント
+ * runs.log_path を更新する（削除されたログは null）。このマシンの run だけ更新する
+ *
+ * Headers:
+ *   X-Machine-Key: マシンキー（必須）
+ *
+ * Body:
+ *   moves: { run_id, log_path }[] - log_path は圧縮後の .log.gz のパス、削除時は null
+ *
+ * Response:
+ *   200: 更新成功
+ *   400: 不正なリクエスト
+ *   401: 認証失敗
+ *   403: マシンが無効
+ */
+export async function POST(request: NextRequest) {
+  const machineKey = request.headers.get("X-Machine-Key");
+
+  if (!machineKey) {
+    return NextResponse.json(
+      { error: "X-Machine-Key header is required" },
+      { status: 401 }
+    );
+  }
+
+  let moves: LogPathMove[];
+  try {
+    const body = await request.json();
+    if (!Array.isArray(body.moves)) {
+      throw new Error("moves must be an array");
+    }
+    moves = body.moves
+      .filter(
+        (m: LogPathMove) =>
+          typeof m?.run_id === "string" && (typeof m.log_path === "string" || m.log_path === null)
+      )
+      .slice(0, MAX_MOVES);
+  } catch {
+    return NextResponse.json(
+      { error: "Invalid JSON body" },
+      { status: 400 }
+    );
+  }
+
+  const supabase = createAdminClient();
+
+  // マシンキーをハッシュ化して照合
+  const keyHash = createHash("sha256").update(machineKey).digest("hex");
+
+  const { data: machine, error: machineError } = await supabase
+    .from("machines")
+    .select("id, enabled")
+    .eq("key_hash", keyHash)
+    .single();
+
+  if (machineError || !machine) {
+    return NextResponse.json(
+      { error: "Invalid machine key" },
+      { status: 401 }
+    );
+  }
+
+  if (!machine.enabled) {
+    return NextResponse.json(
+      { error: "Machine is disabled" },
+      { status: 403 }
+    );
+  }
+
+  for (const move of moves) {
+    const { error: updateError } = await supabase
+      .from("runs")
+      .update({ log_path: move.log_path })
+      .eq("id", move.run_id)
+      .eq("machine_id", machine.id);
+
+    if (updateError) {
+      console.error("Error updating run log_path:", updateError);
+      return NextResponse.json(
+        { error: "Failed to update log_path" },
+        { status: 500 }
+      );
+    }
+  }
+
+  return NextResponse.json({ success: true });
+}
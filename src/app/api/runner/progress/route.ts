@@ -0,0 +1,118 @@
+import { NextRequest, NextResponse } from "next/server";
+import { createAdminClient } from "@/lib/supabase/admin";
+import { createHash } from "crypto";
+
+interface ProgressUpdate {
+  run_id: string;
+  progress?: number | null;
+  message?: string | null;
+  metrics?: Record<string, number>;
+}
+
+// 1リクエストで受け付ける run 数の上限
+const MAX_UPDATES = 100;
+
+/**
+ * POST /api/runner/progress
+ * Runner が実行中 run の進捗・メトリクスを送るエンドポイント
+ * Runner は run ごとの最新の値だけを数秒おき（progress_interval_sec）にまとめて送る
+ * running の run だけ更新する（report 後に届いた古い値で最終値を上書きしない）
+ *
+ * Headers:
+ *   X-Machine-Key: マシンキー（必須）
+ *
+ * Body:
+ *   updates: { run_id, progress?, message?, metrics? }[] - 前回から変わった run のみ
+ *     progress: 0〜100（progress と message はどちらかが変わると両方届く）
+ *     metrics: スクリプトが報告したカウンタの合計
+ *
+ * Response:
+ *   200: 更新成功
+ *   400: 不正なリクエスト
+ *   401: 認証失敗
+ *   403: マシンが無効
+ */
+export async function POST(request: NextRequest) {
+  const machineKey = request.headers.get("X-Machine-Key");
+
+  if (!machineKey) {
+    return NextResponse.json(
+      { error: "X-Machine-Key header is required" },
+      { status: 401 }
+    );
+  }
+
+  let updates: ProgressUpdate[];
+  try {
+    const body = await request.json();
+    if (!Array.isArray(body.updates)) {
+      throw new Error("updates must be an array");
+    }
+    updates = body.updates
+      .filter((u: ProgressUpdate) => typeof u?.run_id === "string")
+      .slice(0, MAX_UPDATES);
+  } catch {
+    return NextResponse.json(
+      { error: "Invalid JSON body" },
+      { status: 400 }
+    );
+  }
+
+  const supabase = createAdminClient();
+
+  // マシンキーをハッシュ化して照合
+  const keyHash = createHash("sha256").update(machineKey).digest("hex");
+
+  const { data: machine, error: machineError } = await supabase
+    .from("machines")
+    .select("id, enabled")
+    .eq("key_hash", keyHash)
+    .single();
+
+  if (machineError || !machine) {
+    return NextResponse.json(
+      { error: "Invalid machine key" },
+      { status: 401 }
+    );
+  }
+
+  if (!machine.enabled) {
+    return NextResponse.json(
+      { error: "Machine is disabled" },
+      { status: 403 }
+    );
+  }
+
+  // このマシンが実行中の run だけ更新する。report の直前に取った値が report より後に届くことがあるため、
+  // 条件付き UPDATE で終了済みの run は変えない（起動のみの run の最終値は followup で届く）
+  const now = new Date().toISOString();
+  for (const update of updates) {
+    const updateData: {
+      progress_at: string;
+      progress?: number | null;
+      progress_message?: string | null;
+      metrics?: Record<string, number>;
+    } = { progress_at: now };
+
+    if ("progress" in update || "message" in update) {
+      updateData.progress = typeof update.progress === "number" ? Math.min(Math.max(update.progress, 0), 100) : null;
+      updateData.progress_message = typeof update.message === "string" ? update.message.slice(0, 200) : null;
+    }
+    if (update.metrics && typeof update.metrics === "object") {
+      updateData.metrics = update.metrics;
+    }
+
+    const { error: updateError } = await supabase
+      .from("runs")
+      .update(updateData)
+      .eq("id", update.run_id)
+      .eq("machine_id", machine.id)
+      .eq("status", "running");
+
+    if (updateError) {
+      console.error("Error updating run progress:", updateError);
+    }
+  }
+
+  return NextResponse.json({ success: true });
+}
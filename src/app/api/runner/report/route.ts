@@ -2,13 +2,22 @@ import { NextRequest, NextResponse } from "next/server";
 import { createAdminClient } from "@/lib/supabase/admin";
 import { createHash } from "crypto";
 
+// 出力の抜粋の保存上限（Runner の既定は 6KB 程度。設定の誤りで巨大な値が来ても切り詰める）
+const OUTPUT_EXCERPT_MAX_LENGTH = 16384;
+
 interface ReportBody {
   run_id: string;
-  status: "success" | "failed";
+  status: "success" | "failed" | "canceled";
   summary?: string;
   error_message?: string;
   log_path?: string;
   log_url?: string;
+  output_excerpt?: string;
+  metrics?: Record<string, number>;
+  followup?: boolean;
+  exit_code?: number;
+  duration_ms?: number;
+  resource_usage?: Record<string, number>;
 }
 
 /**
@@ -20,11 +29,17 @@ interface ReportBody {
  *
  * Body:
  *   run_id: 実行ID
- *   status: "success" | "failed"
+ *   status: "success" | "failed" | "canceled"
  *   summary?: 要約
  *   error_message?: エラーメッセージ
  *   log_path?: ログファイルパス
  *   log_url?: ログURL
+ *   output_excerpt?: 出力の先頭・末尾の抜粋（最大 OUTPUT_EXCERPT_MAX_LENGTH 文字で保存）
+ *   metrics?: スクリプトが報告したカウンタの最終値
+ *   followup?: true の場合、起動のみで success 報告済みの run に実際の終了結果を追記
+ *   exit_code?: 終了コード
+ *   duration_ms?: 所要時間（ミリ秒）
+ *   resource_usage?: CPU時間・ピークメモリ等
  *
  * Response:
  *   200: 更新成功
@@ -79,7 +94,10 @@ export async function POST(request: NextRequest) {
     );
   }
 
-  const { run_id, status, summary, error_message, log_path, log_url } = body;
+  const {
+    run_id, status, summary, error_message, log_path, log_url, output_excerpt, metrics,
+    followup, exit_code, duration_ms, resource_usage,
+  } = body;
 
   if (!run_id || !status) {
     return NextResponse.json(
@@ -88,9 +106,9 @@ export async function POST(request: NextRequest) {
     );
   }
 
-  if (!["success", "failed"].includes(status)) {
+  if (!["success", "failed", "canceled"].includes(status)) {
     return NextResponse.json(
-      { error: "status must be 'success' or 'failed'" },
+      { error: "status must be 'success', 'failed' or 'canceled'" },
       { status: 400 }
     );
   }
@@ -98,7 +116,7 @@ export async function POST(request: NextRequest) {
   // runの存在確認とマシンIDの照合
   const { data: run, error: runError } = await supabase
     .from("runs")
-    .select("id, machine_id, status")
+    .select("id, machine_id, status, summary, exit_code")
     .eq("id", run_id)
     .single();
 
@@ -117,6 +135,51 @@ export async function POST(request: NextRequest) {
     );
   }
 
+  // followup: 起動時に success 報告済みで、まだ終了結果が記録されていない run のみ
+  if (followup) {
+    if (run.status !== "success" || run.exit_code !== null) {
+      return NextResponse.json(
+        { error: "Followup is only allowed once for launched runs" },
+        { status: 400 }
+      );
+    }
+
+    // 同時・再送の followup が記録済みの結果を上書きしないよう、条件付きで更新する
+    const { data: updated, error: followupError } = await supabase
+      .from("runs")
+      .update({
+        status,
+        finished_at: new Date().toISOString(),
+        summary: summary || run.summary,
+        error_message: error_message || null,
+        exit_code: exit_code ?? null,
+        duration_ms: duration_ms ?? null,
+        resource_usage: resource_usage || null,
+        ...(metrics ? { metrics } : {}),
+      })
+      .eq("id", run_id)
+      .eq("status", "success")
+      .is("exit_code", null)
+      .select("id");
+
+    if (followupError) {
+      console.error("Error updating run outcome:", followupError);
+      return NextResponse.json(
+        { error: "Failed to update run" },
+        { status: 500 }
+      );
+    }
+
+    if (!updated || updated.length === 0) {
+      return NextResponse.json(
+        { error: "Followup is only allowed once for launched runs" },
+        { status: 400 }
+      );
+    }
+
+    return NextResponse.json({ success: true });
+  }
+
   // runningのみ更新可能
   if (run.status !== "running") {
     return NextResponse.json(
@@ -135,6 +198,11 @@ export async function POST(request: NextRequest) {
       error_message: error_message || null,
       log_path: log_path || null,
       log_url: log_url || null,
+      output_excerpt: output_excerpt ? output_excerpt.slice(0, OUTPUT_EXCERPT_MAX_LENGTH) : null,
+      exit_code: exit_code ?? null,
+      duration_ms: duration_ms ?? null,
+      resource_usage: resource_usage || null,
+      ...(metrics ? { metrics } : {}),
     })
     .eq("id", run_id);
 
@@ -2,14 +2,19 @@
 
 import { useState } from "react";
 import { Button } from "@/components/ui/button";
-import { FolderOpen, Copy, Check } from "lucide-react";
+import { FolderOpen, Copy, Check, ScrollText, Loader2 } from "lucide-react";
+import { getRunLogViewUrl } from "@/lib/actions/runs";
 
 interface LogPathActionsProps {
   logPath: string;
+  // 指定時は Runner のログ配信サーバーで末尾を表示するボタンを出す
+  runId?: string;
 }
 
-export function LogPathActions({ logPath }: LogPathActionsProps) {
+export function LogPathActions({ logPath, runId }: LogPathActionsProps) {
   const [copied, setCopied] = useState(false);
+  const [opening, setOpening] = useState(false);
+  const [tailError, setTailError] = useState<string | null>(null);
 
   const handleOpen = () => {
     // tcportal:// プロトコルでヘルパーを呼び出してファイルを開く
@@ -27,8 +32,50 @@ export function LogPathActions({ logPath }: LogPathActionsProps) {
     }
   };
 
+  const handleTail = async () => {
+    if (!runId) return;
+    // ポップアップブロックを避けるため、クリック時点でウィンドウを開いておく
+    const win = window.open("", "_blank");
+    setOpening(true);
+    setTailError(null);
+    try {
+      const result = await getRunLogViewUrl(runId);
+      if (result.success && result.url) {
+        if (win) {
+          win.location.href = result.url;
+        } else {
+          window.open(result.url, "_blank");
+        }
+      } else {
+        win?.close();
+        setTailError(result.error || "ログを表示できません");
+      }
+    } catch {
+      win?.close();
+      setTailError("通信エラーが発生しました");
+    } finally {
+      setOpening(false);
+    }
+  };
+
   return (
     <div className="flex items-center gap-1">
+      {runId && (
+        <Button
+          variant="ghost"
+          size="sm"
+          className="h-7 px-2"
+          onClick={handleTail}
+          disabled={opening}
+          title={tailError || "ログの末尾を表示（実行中は追従）"}
+        >
+          {opening ? (
+            <Loader2 className="w-3.5 h-3.5 animate-spin" />
+          ) : (
+            <ScrollText className={`w-3.5 h-3.5 ${tailError ? "text-red-600" : ""}`} />
+          )}
+        </Button>
+      )}
       <Button
         variant="ghost"
         size="sm"
@@ -4,11 +4,18 @@ import { useState } from "react";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
-import { Power, Square, Loader2 } from "lucide-react";
-import { stopRunner } from "@/lib/actions/machines";
+import { Power, Square, Loader2, Activity } from "lucide-react";
+import { stopRunner, profileRunner } from "@/lib/actions/machines";
+import { LogPathActions } from "@/components/runs/LogPathActions";
 import type { Machine } from "@/types/database";
 
-type MachineInfo = Pick<Machine, "id" | "name" | "hostname" | "last_seen_at">;
+type MachineInfo = Pick<
+  Machine,
+  "id" | "name" | "hostname" | "last_seen_at" | "last_profile_path" | "last_profile_at"
+>;
+
+// プロファイルのサンプリング秒数
+const PROFILE_SECONDS = 60;
 
 interface RunnerStatusPanelProps {
   machines: MachineInfo[];
@@ -23,7 +30,9 @@ function isOnline(lastSeenAt: string | null): boolean {
 
 export function RunnerStatusPanel({ machines }: RunnerStatusPanelProps) {
   const [stoppingId, setStoppingId] = useState<string | null>(null);
+  const [profilingId, setProfilingId] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
+  const [notice, setNotice] = useState<string | null>(null);
 
   const handleStop = async (machineId: string) => {
     setStoppingId(machineId);
@@ -40,6 +49,24 @@ export function RunnerStatusPanel({ machines }: RunnerStatusPanelProps) {
     }
   };
 
+  const handleProfile = async (machineId: string) => {
+    setProfilingId(machineId);
+    setError(null);
+    setNotice(null);
+    try {
+      const result = await profileRunner(machineId, PROFILE_SECONDS);
+      if (!result.success) {
+        setError(result.error || "プロファイルの開始に失敗しました");
+      } else {
+        setNotice(`次のハートビートから${PROFILE_SECONDS}秒間プロファイルを取得します`);
+      }
+    } catch {
+      setError("通信エラーが発生しました");
+    } finally {
+      setProfilingId(null);
+    }
+  };
+
   if (machines.length === 0) return null;
 
   return (
@@ -74,24 +101,58 @@ export function RunnerStatusPanel({ machines }: RunnerStatusPanelProps) {
                   <Badge variant={online ? "default" : "secondary"} className="text-xs">
                     {online ? "オンライン" : "オフライン"}
                   </Badge>
-                </div>
-                <Button
-                  variant="destructive"
-                  size="sm"
-                  disabled={!online || stoppingId === machine.id}
-                  onClick={() => handleStop(machine.id)}
-                >
-                  {stoppingId === machine.id ? (
-                    <Loader2 className="w-3.5 h-3.5 mr-1 animate-spin" />
-                  ) : (
-                    <Square className="w-3.5 h-3.5 mr-1" />
+                  {machine.last_profile_path && (
+                    <div
+                      className="flex items-center gap-1 text-xs text-muted-foreground"
+                      title={machine.last_profile_path}
+                    >
+                      プロファイル
+                      {machine.last_profile_at &&
+                        ` ${new Date(machine.last_profile_at).toLocaleString("ja-JP", {
+                          timeZone: "Asia/Tokyo",
+                          month: "2-digit",
+                          day: "2-digit",
+                          hour: "2-digit",
+                          minute: "2-digit",
+                        })}`}
+                      <LogPathActions logPath={machine.last_profile_path} />
+                    </div>
                   )}
-                  停止
-                </Button>
+                </div>
+                <div className="flex items-center gap-2">
+                  <Button
+                    variant="outline"
+                    size="sm"
+                    disabled={!online || profilingId === machine.id}
+                    onClick={() => handleProfile(machine.id)}
+                    title={`${PROFILE_SECONDS}秒間 CPU / メモリのプロファイルを取得`}
+                  >
+                    {profilingId === machine.id ? (
+                      <Loader2 className="w-3.5 h-3.5 mr-1 animate-spin" />
+                    ) : (
+                      <Activity className="w-3.5 h-3.5 mr-1" />
+                    )}
+                    プロファイル
+                  </Button>
+                  <Button
+                    variant="destructive"
+                    size="sm"
+                    disabled={!online || stoppingId === machine.id}
+                    onClick={() => handleStop(machine.id)}
+                  >
+                    {stoppingId === machine.id ? (
+                      <Loader2 className="w-3.5 h-3.5 mr-1 animate-spin" />
+                    ) : (
+                      <Square className="w-3.5 h-3.5 mr-1" />
+                    )}
+                    停止
+                  </Button>
+                </div>
               </div>
             );
           })}
         </div>
+        {notice && <p className="text-sm text-muted-foreground mt-2">{notice}</p>}
         {error && <p className="text-sm text-red-600 mt-2">{error}</p>}
       </CardContent>
     </Card>
@@ -0,0 +1,31 @@
+"use client";
+
+import { useEffect } from "react";
+import { useRouter } from "next/navigation";
+
+// 実行中の run がある間の再取得間隔（Runner の進捗送信は既定 5 秒おき）
+const REFRESH_INTERVAL_MS = 10_000;
+
+interface RunsAutoRefreshProps {
+  active: boolean;
+}
+
+/**
+ * 実行中の run がある間、ページを定期的に再取得して進捗・メトリクスを更新する
+ */
+export function RunsAutoRefresh({ active }: RunsAutoRefreshProps) {
+  const router = useRouter();
+
+  useEffect(() => {
+    if (!active) return;
+    const timer = setInterval(() => {
+      // バックグラウンドのタブでは取得しない
+      if (document.visibilityState === "visible") {
+        router.refresh();
+      }
+    }, REFRESH_INTERVAL_MS);
+    return () => clearInterval(timer);
+  }, [active, router]);
+
+  return null;
+}
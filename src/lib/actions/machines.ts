@@ -59,7 +59,7 @@ export async function getOnlineMachines(
  */
 export async function getEnabledMachines(): Promise<{
   success: boolean;
-  machines?: Pick<Machine, "id" | "name" | "hostname" | "last_seen_at">[];
+  machines?: Pick<Machine, "id" | "name" | "hostname" | "last_seen_at" | "last_profile_path" | "last_profile_at">[];
   error?: string;
 }> {
   const supabase = await createClient();
@@ -73,7 +73,7 @@ export async function getEnabledMachines(): Promise<{
   // enabled なマシンを全て取得（オンライン/オフライン問わず）
   const { data: machines, error } = await supabase
     .from("machines")
-    .select("id, name, hostname, last_seen_at")
+    .select("id, name, hostname, last_seen_at, last_profile_path, last_profile_at")
     .eq("enabled", true)
     .order("name");
 
@@ -123,11 +123,15 @@ export async function getAllMachines(): Promise<{
 }
 
 /**
- * Runner に停止コマンドを送信する
- * machines.pending_command に "stop" をセットし、
- * 次のハートビートで Runner が受信して停止する。
+ * Runner にコマンドを送信する（stopRunner / profileRunner 共通）
+ * machines.pending_command にコマンドをセットし、
+ * 次のハートビートで Runner が受信する。
  */
-export async function stopRunner(machineId: string): Promise<{
+async function sendRunnerCommand(
+  machineId: string,
+  command: string,
+  caller: string
+): Promise<{
   success: boolean;
   error?: string;
 }> {
@@ -164,14 +168,44 @@ export async function stopRunner(machineId: string): Promise<{
   const adminSupabase = createAdminClient();
   const { error: updateError } = await adminSupabase
     .from("machines")
-    .update({ pending_command: "stop" })
+    .update({ pending_command: command })
     .eq("id", machineId);
 
   if (updateError) {
-    console.error("[stopRunner] Update error:", updateError);
+    console.error(`[${caller}] Update error:`, updateError);
     return { success: false, error: "コマンドの送信に失敗しました" };
   }
 
   revalidatePath("/runs");
   return { success: true };
 }
+
+/**
+ * Runner に停止コマンドを送信する
+ * machines.pending_command に "stop" をセットし、
+ * 次のハートビートで Runner が受信して停止する。
+ */
+export async function stopRunner(machineId: string): Promise<{
+  success: boolean;
+  error?: string;
+}> {
+  return sendRunnerCommand(machineId, "stop", "stopRunner");
+}
+
+/**
+ * Runner にプロファイルコマンドを送信する
+ * Runner は指定秒数だけ自プロセスをサンプリングし、結果を log_dir に書き出して
+ * そのパスを次のハートビートで返す（machines.last_profile_path）。
+ *
+ * @param seconds サンプリング秒数（1〜600）
+ */
+export async function profileRunner(
+  machineId: string,
+  seconds: number = 60
+): Promise<{
+  success: boolean;
+  error?: string;
+}> {
+  const duration = Math.min(Math.max(Math.round(seconds), 1), 600);
+  return sendRunnerCommand(machineId, `profile:${duration}`, "profileRunner");
+}
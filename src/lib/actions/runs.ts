@@ -1,19 +1,24 @@
 "use server";
 
 import { createClient } from "@/lib/supabase/server";
+import { createAdminClient } from "@/lib/supabase/admin";
 import { revalidatePath } from "next/cache";
 import { randomBytes, createHash } from "crypto";
 import { HELPER_SUCCESS_MESSAGES } from "@/lib/helper";
+import { RUN_PRIORITY } from "@/types/database";
+import { buildRunnerLogViewUrl } from "@/lib/runner-log";
 
 /**
  * 実行依頼を作成する
  * @param toolId ツールID
  * @param targetMachineId 実行先マシンID（NULLなら任意のRunnerが実行可能）
+ * @param priority 優先度（省略時はツールのデフォルト、なければ対話実行の優先度）
  * @returns 作成結果
  */
 export async function createRun(
   toolId: string,
-  targetMachineId?: string | null
+  targetMachineId?: string | null,
+  priority?: number
 ): Promise<{
   success: boolean;
   runId?: string;
@@ -30,7 +35,7 @@ export async function createRun(
   // ツールの存在確認（削除済みを除外）
   const { data: tool, error: toolError } = await supabase
     .from("tools")
-    .select("id, name, tool_type, execution_mode")
+    .select("id, name, tool_type, execution_mode, default_priority")
     .eq("id", toolId)
     .is("deleted_at", null)
     .single();
@@ -59,6 +64,8 @@ export async function createRun(
       status: "queued",
       run_token_hash: runTokenHash,
       target_machine_id: targetMachineId || null,
+      // ユーザーのクリックは夜間バッチ等より先に claim されるようにする
+      priority: priority ?? tool.default_priority ?? RUN_PRIORITY.interactive,
     })
     .select("id")
     .single();
@@ -163,7 +170,10 @@ export async function createHelperRun(toolId: string): Promise<{
 }
 
 /**
- * 実行をキャンセルする（queued状態の場合のみ）
+ * 実行をキャンセルする
+ * - queued: その場で canceled に更新
+ * - running: cancel_requested_at をセットし、Runner がハートビートで受信して
+ *   プロセスツリーを終了 → canceled を報告する
  * @param runId 実行ID
  * @returns キャンセル結果
  */
@@ -194,14 +204,24 @@ export async function cancelRun(runId: string): Promise<{
     return { success: false, error: "権限がありません" };
   }
 
-  if (run.status !== "queued") {
-    return { success: false, error: "キャンセルできるのは待機中の実行のみです" };
+  if (run.status !== "queued" && run.status !== "running") {
+    return { success: false, error: "キャンセルできるのは待機中・実行中の実行のみです" };
   }
 
-  const { error: updateError } = await supabase
-    .from("runs")
-    .update({ status: "canceled", finished_at: new Date().toISOString() })
-    .eq("id", runId);
+  // runs には UPDATE ポリシーがないため admin client で更新（所有者確認は上で実施）
+  const adminSupabase = createAdminClient();
+  const now = new Date().toISOString();
+  const { error: updateError } = run.status === "queued"
+    ? await adminSupabase
+        .from("runs")
+        .update({ status: "canceled", finished_at: now })
+        .eq("id", runId)
+        .eq("status", "queued")
+    : await adminSupabase
+        .from("runs")
+        .update({ cancel_requested_at: now })
+        .eq("id", runId)
+        .eq("status", "running");
 
   if (updateError) {
     console.error("Error canceling run:", updateError);
@@ -212,3 +232,55 @@ export async function cancelRun(runId: string): Promise<{
 
   return { success: true };
 }
+
+/**
+ * run ログの表示ページ（Runner のログ配信サーバー）の署名付き URL を取得する
+ * 末尾を表示し、実行中なら追記分を追従する。URL の有効期限は10分
+ * @param runId 実行ID
+ * @returns URL
+ */
+export async function getRunLogViewUrl(runId: string): Promise<{
+  success: boolean;
+  url?: string;
+  error?: string;
+}> {
+  const supabase = await createClient();
+
+  // Get current user
+  const { data: { user } } = await supabase.auth.getUser();
+  if (!user) {
+    return { success: false, error: "ログインが必要です" };
+  }
+
+  const { data: run, error: fetchError } = await supabase
+    .from("runs")
+    .select("id, machine_id, log_path")
+    .eq("id", runId)
+    .single();
+
+  if (fetchError || !run) {
+    return { success: false, error: "実行履歴が見つかりません" };
+  }
+
+  if (!run.machine_id || !run.log_path) {
+    return { success: false, error: "この実行にはログがありません" };
+  }
+
+  const { data: machine } = await supabase
+    .from("machines")
+    .select("id, hostname, log_server_port")
+    .eq("id", run.machine_id)
+    .single();
+
+  if (!machine?.hostname || !machine.log_server_port) {
+    return { success: false, error: "このRunnerはログ配信が無効です（log_server_port 未設定）" };
+  }
+
+  return {
+    success: true,
+    url: buildRunnerLogViewUrl(
+      { id: machine.id, hostname: machine.hostname, log_server_port: machine.log_server_port },
+      run.id
+    ),
+  };
+}
@@ -0,0 +1,43 @@
+/**
+ * run のメトリクス（スクリプトが TC_PORTAL_METRICS に書いたカウンタ）の表示
+ */
+
+function formatNumber(value: number, key: string): string {
+  // bytes を含むキーはサイズとして表示
+  if (/bytes/i.test(key)) {
+    const units = ["B", "KB", "MB", "GB", "TB"];
+    let size = value;
+    let unit = 0;
+    while (size >= 1024 && unit < units.length - 1) {
+      size /= 1024;
+      unit++;
+    }
+    return `${size.toLocaleString("ja-JP", { maximumFractionDigits: unit ? 1 : 0 })}${units[unit]}`;
+  }
+  return value.toLocaleString("ja-JP", { maximumFractionDigits: 1 });
+}
+
+/**
+ * メトリクスを「rows 1,200 (40/s) · bytes 5.2MB (170KB/s)」の形式にする
+ * @param metrics カウンタ
+ * @param startedAt 開始時刻（秒あたりの値の計算に使う）
+ * @param finishedAt 終了時刻（実行中は現在時刻で計算）
+ */
+export function formatRunMetrics(
+  metrics: Record<string, number> | null,
+  startedAt: string | null,
+  finishedAt: string | null
+): string | null {
+  if (!metrics) return null;
+  const entries = Object.entries(metrics);
+  if (entries.length === 0) return null;
+  const elapsedSec = startedAt
+    ? ((finishedAt ? new Date(finishedAt).getTime() : Date.now()) - new Date(startedAt).getTime()) / 1000
+    : 0;
+  return entries
+    .map(([key, value]) => {
+      const rate = elapsedSec >= 1 ? ` (${formatNumber(value / elapsedSec, key)}/s)` : "";
+      return `${key} ${formatNumber(value, key)}${rate}`;
+    })
+    .join(" · ");
+}
@@ -0,0 +1,35 @@
+/**
+ * Runner のログ配信サーバー（agent.py の log_server_port）用の署名付き URL
+ *
+ * 署名鍵はマシンごとに SUPABASE_SERVICE_ROLE_KEY から導出し、ハートビートの応答で Runner に渡す。
+ * machines は認証済みユーザー全員が読めるため、key_hash 等のテーブルの値は鍵に使わない。
+ * ※サーバーサイドでのみ使用すること
+ */
+
+import { createHmac } from "crypto";
+
+// 署名付き URL の有効期間（秒）
+export const RUNNER_LOG_URL_TTL_SEC = 600;
+
+/**
+ * マシンごとのログ配信の署名鍵
+ */
+export function runnerLogSecret(machineId: string): string {
+  const serviceRoleKey = process.env.SUPABASE_SERVICE_ROLE_KEY;
+  if (!serviceRoleKey) {
+    throw new Error("Missing SUPABASE_SERVICE_ROLE_KEY for runner log signing");
+  }
+  return createHmac("sha256", serviceRoleKey).update(`runner-log:${machineId}`).digest("hex");
+}
+
+/**
+ * run のログ表示ページ（末尾表示 + 追従）の URL
+ */
+export function buildRunnerLogViewUrl(
+  machine: { id: string; hostname: string; log_server_port: number },
+  runId: string
+): string {
+  const exp = Math.floor(Date.now() / 1000) + RUNNER_LOG_URL_TTL_SEC;
+  const sig = createHmac("sha256", runnerLogSecret(machine.id)).update(`${runId}:${exp}`).digest("hex");
+  return `http://${machine.hostname}:${machine.log_server_port}/runs/${runId}/view?exp=${exp}&sig=${sig}`;
+}
@@ -20,6 +20,13 @@ export type ExecutionMode = "open" | "queue" | "helper";
 
 export type RunStatus = "queued" | "running" | "success" | "failed" | "canceled";
 
+// Run の優先度（大きいほど優先。1あたり5分の前借り）
+export const RUN_PRIORITY = {
+  bulk: -10,
+  normal: 0,
+  interactive: 10,
+} as const;
+
 // Excelツールの起動モード
 export type ExcelOpenMode = "file" | "folder_latest_created" | "folder_pick";
 
@@ -99,6 +106,8 @@ export interface Tool {
   // Excel専用フィールド
   excel_open_mode: ExcelOpenMode;
   excel_folder_path: string | null;
+  // Runner実行時のデフォルト優先度（NULLなら0）
+  default_priority: number | null;
   // Soft delete
   deleted_at: string | null;
   deleted_by: string | null;
@@ -133,6 +142,9 @@ export interface Machine {
   last_seen_at: string | null;
   hostname: string | null;
   pending_command: string | null;
+  last_profile_path: string | null;
+  last_profile_at: string | null;
+  log_server_port: number | null;
   created_at: string;
 }
 
@@ -148,8 +160,21 @@ export interface Run {
   error_message: string | null;
   log_path: string | null;
   log_url: string | null;
+  output_excerpt: string | null;
   machine_id: string | null;
   target_machine_id: string | null;
+  cancel_requested_at: string | null;
+  priority: number;
+  queue_sort_at: string;
+  exit_code: number | null;
+  duration_ms: number | null;
+  resource_usage: Record<string, number> | null;
+  metrics: Record<string, number> | null;
+  progress: number | null;
+  progress_message: string | null;
+  progress_at: string | null;
+  expected_finish_at: string | null;
+  slow_at: string | null;
   run_token_hash: string;
   payload: Record<string, unknown> | null;
 }
@@ -0,0 +1,16 @@
+-- =====================================================
+-- 実行中 run のリモートキャンセル
+-- =====================================================
+-- cancelRun() が running の run に cancel_requested_at をセットし、
+-- 実行中の Runner がハートビート応答（cancel_run_ids）で受け取って
+-- プロセスツリーを終了 → status = 'canceled' を報告する
+
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS cancel_requested_at TIMESTAMPTZ NULL;
+
+COMMENT ON COLUMN public.runs.cancel_requested_at IS '実行中runのキャンセル要求日時（Runnerがハートビートで受信）';
+
+-- ハートビートごとの「このマシンで実行中かつキャンセル要求あり」検索用
+CREATE INDEX IF NOT EXISTS idx_runs_running_cancel_requested
+  ON public.runs (machine_id)
+  WHERE status = 'running' AND cancel_requested_at IS NOT NULL;
@@ -0,0 +1,14 @@
+-- =====================================================
+-- Runner 実行結果の詳細（終了コード・所要時間・リソース使用量）
+-- =====================================================
+-- 起動のみで success を報告する BAT（ログなし）/ EXE について、
+-- Runner がプロセス終了後に followup 報告で実際の結果を記録する
+
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS exit_code INTEGER NULL,
+  ADD COLUMN IF NOT EXISTS duration_ms INTEGER NULL,
+  ADD COLUMN IF NOT EXISTS resource_usage JSONB NULL;
+
+COMMENT ON COLUMN public.runs.exit_code IS 'プロセスの終了コード（Runnerのfollowup報告）';
+COMMENT ON COLUMN public.runs.duration_ms IS 'プロセス起動から終了までの所要時間（ミリ秒）';
+COMMENT ON COLUMN public.runs.resource_usage IS 'CPU時間・ピークメモリ等: {"cpu_user_sec", "cpu_kernel_sec", "peak_memory_mb", "process_count"}';
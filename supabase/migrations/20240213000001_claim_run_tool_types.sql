@@ -0,0 +1,72 @@
+-- =====================================================
+-- claim_run() を更新: 取得可能な tool_type で絞り込む
+-- =====================================================
+-- Runner はリソースクラス（GUI / CPU 等）ごとに同時実行数を持ち、
+-- 空きスロットのある tool_type だけを p_tool_types で要求する。
+--   - p_tool_types IS NULL → 従来通り全 tool_type が対象
+--   - GUI スロットが埋まっていても、後続のヘッドレス run は取得できる
+
+-- 引数が変わるため旧シグネチャを削除してから再定義
+DROP FUNCTION IF EXISTS public.claim_run(UUID);
+
+CREATE OR REPLACE FUNCTION public.claim_run(
+  p_machine_id UUID,
+  p_tool_types TEXT[] DEFAULT NULL
+)
+RETURNS TABLE (
+  run_id UUID,
+  tool_id UUID,
+  tool_name TEXT,
+  tool_type TEXT,
+  tool_target TEXT,
+  run_config JSONB,
+  payload JSONB
+) AS $$
+DECLARE
+  v_run_id UUID;
+BEGIN
+  -- 1件のqueuedなrunを取得してrunningに更新（競合を避ける）
+  -- tools と JOIN するため、ロック対象は runs の行のみに限定（FOR UPDATE OF r2）
+  UPDATE public.runs r
+  SET
+    status = 'running',
+    started_at = now(),
+    machine_id = p_machine_id
+  WHERE r.id = (
+    SELECT r2.id
+    FROM public.runs r2
+    JOIN public.tools t2 ON t2.id = r2.tool_id
+    WHERE r2.status = 'queued'
+      AND (r2.target_machine_id IS NULL OR r2.target_machine_id = p_machine_id)
+      AND (p_tool_types IS NULL OR t2.tool_type = ANY(p_tool_types))
+    ORDER BY r2.requested_at ASC
+    LIMIT 1
+    FOR UPDATE OF r2 SKIP LOCKED
+  )
+  RETURNING r.id INTO v_run_id;
+
+  -- 取得できなかった場合は空を返す
+  IF v_run_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  -- run情報とtool情報を結合して返す
+  RETURN QUERY
+  SELECT
+    r.id AS run_id,
+    t.id AS tool_id,
+    t.name AS tool_name,
+    t.tool_type,
+    t.target AS tool_target,
+    t.run_config,
+    r.payload
+  FROM public.runs r
+  JOIN public.tools t ON r.tool_id = t.id
+  WHERE r.id = v_run_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- セキュリティ設定（service_role のみ）
+REVOKE EXECUTE ON FUNCTION public.claim_run(UUID, TEXT[]) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_run(UUID, TEXT[]) TO service_role;
+ALTER FUNCTION public.claim_run(UUID, TEXT[]) SET search_path = public;
@@ -0,0 +1,126 @@
+-- =====================================================
+-- 優先度付き claim（エイジング付き）
+-- =====================================================
+-- runs.priority が大きいほど優先。優先度は「待ち時間の前借り」として扱い、
+--   queue_sort_at = requested_at - priority × 5分
+-- の昇順で claim する。
+--   - ユーザーのクリック（priority 10）は直近50分以内に積まれた
+--     夜間バッチ（priority 0）より先に実行される
+--   - それより古い低優先度 run は先に実行されるため、飢餓状態にならない（エイジング）
+-- queue_sort_at は挿入時に確定するため、部分インデックスで
+-- FOR UPDATE SKIP LOCKED の先頭取得を安く保てる（queued が10万件以上でも）
+
+-- 1. tools にデフォルト優先度を追加
+ALTER TABLE public.tools
+  ADD COLUMN IF NOT EXISTS default_priority SMALLINT NULL;
+
+COMMENT ON COLUMN public.tools.default_priority IS 'このツールのrunのデフォルト優先度（NULLなら0。大きいほど優先）';
+
+-- 2. runs に priority と queue_sort_at を追加
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS queue_sort_at TIMESTAMPTZ NULL;
+
+-- priority 未指定の挿入をトリガーで補完するためデフォルトを外す
+ALTER TABLE public.runs ALTER COLUMN priority DROP DEFAULT;
+
+UPDATE public.runs SET queue_sort_at = requested_at WHERE queue_sort_at IS NULL;
+ALTER TABLE public.runs ALTER COLUMN queue_sort_at SET NOT NULL;
+
+COMMENT ON COLUMN public.runs.priority IS '実行優先度（大きいほど優先。1あたり5分の前借り）';
+COMMENT ON COLUMN public.runs.queue_sort_at IS 'claim順序キー: requested_at - priority × 5分（トリガーで設定）';
+
+-- 3. priority の補完と queue_sort_at の算出
+CREATE OR REPLACE FUNCTION public.set_run_queue_sort_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.priority IS NULL THEN
+    SELECT COALESCE(t.default_priority, 0) INTO NEW.priority
+    FROM public.tools t
+    WHERE t.id = NEW.tool_id;
+    NEW.priority := COALESCE(NEW.priority, 0);
+  END IF;
+  NEW.queue_sort_at := NEW.requested_at - NEW.priority * interval '5 minutes';
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = public;
+
+DROP TRIGGER IF EXISTS trigger_set_run_queue_sort_at ON public.runs;
+CREATE TRIGGER trigger_set_run_queue_sort_at
+  BEFORE INSERT OR UPDATE OF priority, requested_at ON public.runs
+  FOR EACH ROW
+  EXECUTE FUNCTION public.set_run_queue_sort_at();
+
+-- 4. claim 用インデックス（queued のみ）
+CREATE INDEX IF NOT EXISTS idx_runs_queued_sort
+  ON public.runs (queue_sort_at, id)
+  WHERE status = 'queued';
+
+-- 5. claim_run() を再定義: 優先度順 + Runner の claim 設定（最低優先度）
+DROP FUNCTION IF EXISTS public.claim_run(UUID, TEXT[]);
+
+CREATE OR REPLACE FUNCTION public.claim_run(
+  p_machine_id UUID,
+  p_tool_types TEXT[] DEFAULT NULL,
+  p_min_priority INTEGER DEFAULT NULL
+)
+RETURNS TABLE (
+  run_id UUID,
+  tool_id UUID,
+  tool_name TEXT,
+  tool_type TEXT,
+  tool_target TEXT,
+  run_config JSONB,
+  payload JSONB,
+  priority SMALLINT
+) AS $$
+DECLARE
+  v_run_id UUID;
+BEGIN
+  -- queue_sort_at（優先度 + エイジング）順に1件取得してrunningに更新
+  UPDATE public.runs r
+  SET
+    status = 'running',
+    started_at = now(),
+    machine_id = p_machine_id
+  WHERE r.id = (
+    SELECT r2.id
+    FROM public.runs r2
+    JOIN public.tools t2 ON t2.id = r2.tool_id
+    WHERE r2.status = 'queued'
+      AND (r2.target_machine_id IS NULL OR r2.target_machine_id = p_machine_id)
+      AND (p_tool_types IS NULL OR t2.tool_type = ANY(p_tool_types))
+      AND (p_min_priority IS NULL OR r2.priority >= p_min_priority)
+    ORDER BY r2.queue_sort_at ASC, r2.id ASC
+    LIMIT 1
+    FOR UPDATE OF r2 SKIP LOCKED
+  )
+  RETURNING r.id INTO v_run_id;
+
+  -- 取得できなかった場合は空を返す
+  IF v_run_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  -- run情報とtool情報を結合して返す
+  RETURN QUERY
+  SELECT
+    r.id AS run_id,
+    t.id AS tool_id,
+    t.name AS tool_name,
+    t.tool_type,
+    t.target AS tool_target,
+    t.run_config,
+    r.payload,
+    r.priority
+  FROM public.runs r
+  JOIN public.tools t ON r.tool_id = t.id
+  WHERE r.id = v_run_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- セキュリティ設定（service_role のみ）
+REVOKE EXECUTE ON FUNCTION public.claim_run(UUID, TEXT[], INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_run(UUID, TEXT[], INTEGER) TO service_role;
+ALTER FUNCTION public.claim_run(UUID, TEXT[], INTEGER) SET search_path = public;
@@ -0,0 +1,19 @@
+-- =====================================================
+-- Runner のリモートプロファイル
+-- =====================================================
+-- profileRunner() が machines.pending_command に 'profile:<秒数>' をセットし、
+-- Runner がハートビートで受け取って自プロセスをサンプリングする。
+-- 結果（collapsed stack / tracemalloc）は Runner の log_dir に書き出され、
+-- そのパスが次のハートビートの profile_path で届く
+
+-- pending_command は既存環境では手動で追加済み
+ALTER TABLE public.machines
+  ADD COLUMN IF NOT EXISTS pending_command TEXT NULL;
+
+ALTER TABLE public.machines
+  ADD COLUMN IF NOT EXISTS last_profile_path TEXT NULL,
+  ADD COLUMN IF NOT EXISTS last_profile_at TIMESTAMPTZ NULL;
+
+COMMENT ON COLUMN public.machines.pending_command IS 'Runner への保留コマンド（stop / profile:<秒数>）。次のハートビートで配信してクリア';
+COMMENT ON COLUMN public.machines.last_profile_path IS '最新のプロファイル結果（.folded）のパス。同じ場所に .alloc.txt';
+COMMENT ON COLUMN public.machines.last_profile_at IS 'last_profile_path の受信日時';
@@ -0,0 +1,13 @@
+-- =====================================================
+-- run の終了予定（ETA）と遅延
+-- =====================================================
+-- Runner は tool ごとの所要時間分布（ローカルの実行履歴から学習）で run の
+-- 終了予定を見積もり、ハートビートの run_estimates で送る。
+-- 経過時間が p99 を超えた run は slow: true で届き、slow_at が記録される
+
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS expected_finish_at TIMESTAMPTZ NULL,
+  ADD COLUMN IF NOT EXISTS slow_at TIMESTAMPTZ NULL;
+
+COMMENT ON COLUMN public.runs.expected_finish_at IS 'Runner が見積もった終了予定（経過に応じて p50 → p90 → p99 で更新）';
+COMMENT ON COLUMN public.runs.slow_at IS '所要時間が過去の p99 を超えたと Runner が通知した日時';
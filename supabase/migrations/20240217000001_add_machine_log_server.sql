@@ -0,0 +1,11 @@
+-- =====================================================
+-- Runner のログ配信サーバー
+-- =====================================================
+-- agent.py の log_server_port 設定時、Runner はハートビートでポート番号を送る。
+-- ポータルは hostname と合わせて署名付きの URL（/runs/{id}/view）を組み立て、
+-- run ログの末尾表示・追従をブラウザから直接 Runner に要求する
+
+ALTER TABLE public.machines
+  ADD COLUMN IF NOT EXISTS log_server_port INTEGER NULL;
+
+COMMENT ON COLUMN public.machines.log_server_port IS 'Runner のログ配信サーバーのポート（無効なら NULL）。ハートビートごとに更新';
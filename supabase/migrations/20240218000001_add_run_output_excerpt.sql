@@ -0,0 +1,10 @@
+-- =====================================================
+-- run の出力の抜粋
+-- =====================================================
+-- Runner はログに書いた出力の先頭・末尾（既定 2KB / 4KB）を report の
+-- output_excerpt で送る。ログファイルを開かずに失敗の原因を確認するため
+
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS output_excerpt TEXT NULL;
+
+COMMENT ON COLUMN public.runs.output_excerpt IS 'Runner が報告した出力の先頭・末尾の抜粋（ログ出力のある tool のみ）';
@@ -0,0 +1,11 @@
+-- =====================================================
+-- run のメトリクス
+-- =====================================================
+-- スクリプトは Runner が環境変数 TC_PORTAL_METRICS で渡すファイルに
+-- JSON のカウンタ（処理行数・転送バイト数など）を追記する。Runner は合計を
+-- report の metrics で送る（起動のみの run は followup で送る）
+
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS metrics JSONB NULL;
+
+COMMENT ON COLUMN public.runs.metrics IS 'スクリプトが報告したカウンタの合計（例: {"rows": 1200, "bytes": 52000}）';
@@ -0,0 +1,15 @@
+-- =====================================================
+-- run の進捗
+-- =====================================================
+-- スクリプトは標準出力の "##tc-progress 42% メッセージ" 行か、メトリクスファイルの
+-- {"progress": 42, "message": "..."} で進捗を伝える。Runner は数秒ごとに最新の値だけを
+-- /api/runner/progress で送る（メトリクスの途中経過も同じリクエストで送る）
+
+ALTER TABLE public.runs
+  ADD COLUMN IF NOT EXISTS progress REAL NULL,
+  ADD COLUMN IF NOT EXISTS progress_message TEXT NULL,
+  ADD COLUMN IF NOT EXISTS progress_at TIMESTAMPTZ NULL;
+
+COMMENT ON COLUMN public.runs.progress IS 'スクリプトが報告した進捗（0〜100）';
+COMMENT ON COLUMN public.runs.progress_message IS '進捗とあわせて報告されたメッセージ';
+COMMENT ON COLUMN public.runs.progress_at IS '進捗・メトリクスを最後に受け取った日時';